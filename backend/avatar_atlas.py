@@ -0,0 +1,240 @@
+"""
+头像图集
+
+把所有人员的缩略头像打包到少量几张图集（WebP）中，并生成 人员ID → 图集位置/UV 的JSON索引，
+展示端只需几次请求就能加载整面卡片墙，不必为每张卡片单独请求缩略图。
+
+图集在请求索引时按 persons 表版本号惰性更新，并且是增量的：
+- 每个人员分配一个固定格子，只有头像变化、新增或删除的人员所在的图集会重绘；
+- 删除人员空出的格子会被新人员复用，其他人员的位置保持不变；
+- 图集按内容哈希命名，可以长期缓存。
+图集状态保存在 uploads/atlas/state.json 中，重启后继续增量更新。
+"""
+
+import asyncio
+import heapq
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+
+from database import Person
+from http_cache import CachedResponse
+from image_utils import render_atlas_sheet
+from image_worker import image_pool
+from table_versions import table_versions
+
+UPLOAD_DIR = "uploads"
+ATLAS_DIR = os.path.join(UPLOAD_DIR, "atlas")
+STATE_FILE = os.path.join(ATLAS_DIR, "state.json")
+# 只打包本地的缩略图（外部URL和base64头像由展示端单独加载）
+THUMBNAIL_URL_PREFIX = "/api/uploads/thumbnails/"
+THUMBNAIL_DIR = os.path.join(UPLOAD_DIR, "thumbnails")
+
+# 格子边长和图集边长
+ATLAS_CELL_SIZE = int(os.getenv("ATLAS_CELL_SIZE", "128"))
+ATLAS_SHEET_SIZE = int(os.getenv("ATLAS_SHEET_SIZE", "2048"))
+
+if not os.path.exists(ATLAS_DIR):
+    os.makedirs(ATLAS_DIR)
+
+
+def atlas_url(filename: str) -> str:
+    return f"/api/uploads/atlas/{filename}"
+
+
+def thumbnail_path(thumbnail_avatar: Optional[str]) -> Optional[str]:
+    """缩略图URL对应的本地文件路径，不是本地缩略图时返回 None"""
+    if not thumbnail_avatar or not thumbnail_avatar.startswith(THUMBNAIL_URL_PREFIX):
+        return None
+    filename = thumbnail_avatar[len(THUMBNAIL_URL_PREFIX):].split("?", 1)[0]
+    if filename != os.path.basename(filename):
+        return None
+    path = os.path.join(THUMBNAIL_DIR, filename)
+    return path if os.path.isfile(path) else None
+
+
+class AvatarAtlas:
+    """增量更新的头像图集（只在事件循环线程中使用）"""
+
+    def __init__(self, cell_size: int = ATLAS_CELL_SIZE, sheet_size: int = ATLAS_SHEET_SIZE):
+        self.cell_size = cell_size
+        self.sheet_size = sheet_size
+        self.cells_per_sheet = (sheet_size // cell_size) ** 2
+        self._lock = asyncio.Lock()
+        self._version = -1
+        self._cached: Optional[CachedResponse] = None
+        # 人员ID → 格子序号（全局序号，图集序号 = 序号 // cells_per_sheet）
+        self._slots: Dict[int, int] = {}
+        # 人员ID → 绘制时的缩略图URL，用来判断头像是否变化
+        self._sources: Dict[int, str] = {}
+        # 缩略图无法读取的人员ID → 缩略图URL，URL不变时不再重试
+        self._skipped: Dict[int, str] = {}
+        # 各图集的文件名
+        self._sheets: List[Optional[str]] = []
+        self._load_state()
+
+    def _load_state(self):
+        if not os.path.exists(STATE_FILE):
+            return
+        try:
+            with open(STATE_FILE) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        if state.get("cell_size") != self.cell_size or state.get("sheet_size") != self.sheet_size:
+            # 尺寸配置变化，全部重建
+            return
+        self._slots = {int(k): v for k, v in state["slots"].items()}
+        self._sources = {int(k): v for k, v in state["sources"].items()}
+        self._skipped = {int(k): v for k, v in state["skipped"].items()}
+        self._sheets = state["sheets"]
+        if any(sheet and not os.path.isfile(os.path.join(ATLAS_DIR, sheet)) for sheet in self._sheets):
+            self._slots, self._sources, self._skipped, self._sheets = {}, {}, {}, []
+
+    def _save_state(self):
+        temp_file = f"{STATE_FILE}.tmp"
+        with open(temp_file, "w") as f:
+            json.dump({
+                "cell_size": self.cell_size,
+                "sheet_size": self.sheet_size,
+                "slots": self._slots,
+                "sources": self._sources,
+                "skipped": self._skipped,
+                "sheets": self._sheets,
+            }, f)
+        os.replace(temp_file, STATE_FILE)
+
+    def _remove_stale_sheets(self):
+        """删除不再使用的旧版本图集"""
+        keep = {sheet for sheet in self._sheets if sheet} | {os.path.basename(STATE_FILE)}
+        for filename in os.listdir(ATLAS_DIR):
+            if filename not in keep and filename.endswith(".webp"):
+                os.remove(os.path.join(ATLAS_DIR, filename))
+
+    def _build_index(self) -> bytes:
+        columns = self.sheet_size // self.cell_size
+        cell, size = self.cell_size, self.sheet_size
+        persons = {}
+        for person_id, slot in sorted(self._slots.items()):
+            sheet, index = divmod(slot, self.cells_per_sheet)
+            x, y = (index % columns) * cell, (index // columns) * cell
+            persons[person_id] = {
+                "sheet": sheet,
+                "x": x,
+                "y": y,
+                "w": cell,
+                "h": cell,
+                "uv": [x / size, y / size, (x + cell) / size, (y + cell) / size],
+            }
+        return json.dumps({
+            "version": self._version,
+            "cell_size": cell,
+            "sheet_size": size,
+            "sheets": [atlas_url(sheet) if sheet else "" for sheet in self._sheets],
+            "persons": persons,
+        }, separators=(",", ":")).encode()
+
+    async def get_index(self, db: Session) -> CachedResponse:
+        """获取图集索引，persons 表有变化时先增量更新图集"""
+        # 共享表版本号时版本号来自数据库，使用异步版本，不阻塞事件循环
+        (version,) = await table_versions.asnapshot(("persons",))
+        if self._cached is not None and self._version == version:
+            return self._cached
+        async with self._lock:
+            # 先取版本号再查询：更新期间有新的提交时，下次请求会再次更新
+            (version,) = await table_versions.asnapshot(("persons",))
+            if self._cached is not None and self._version == version:
+                return self._cached
+            rows = await run_in_threadpool(
+                lambda: db.query(Person.id, Person.thumbnail_avatar).all()
+            )
+            await self._update(rows)
+            self._version = version
+            self._cached = CachedResponse(self._build_index())
+            return self._cached
+
+    async def _update(self, rows: List[Tuple[int, Optional[str]]]):
+        thumbnails = dict(rows)
+        # 缩略图URL没有变化的人员继续跳过
+        skipped = {k: v for k, v in self._skipped.items() if thumbnails.get(k) == v}
+        current = {
+            person_id: thumbnail
+            for person_id, thumbnail in rows
+            if thumbnail_path(thumbnail) and self._skipped.get(person_id) != thumbnail
+        }
+        slots = dict(self._slots)
+        sources = dict(self._sources)
+        # 需要重绘的格子：图集序号 → {格子序号: 图片路径或None}
+        dirty: Dict[int, Dict[int, Optional[str]]] = {}
+
+        def mark(slot: int, path: Optional[str]):
+            sheet, index = divmod(slot, self.cells_per_sheet)
+            dirty.setdefault(sheet, {})[index] = path
+
+        for person_id in list(slots):
+            if person_id not in current:
+                mark(slots.pop(person_id), None)
+                sources.pop(person_id, None)
+
+        used = set(slots.values())
+        free = [slot for slot in range(len(self._sheets) * self.cells_per_sheet) if slot not in used]
+        heapq.heapify(free)
+        next_slot = len(self._sheets) * self.cells_per_sheet
+        for person_id in sorted(current):
+            thumbnail = current[person_id]
+            if person_id in slots:
+                if sources.get(person_id) == thumbnail:
+                    continue
+            elif free:
+                slots[person_id] = heapq.heappop(free)
+            else:
+                slots[person_id] = next_slot
+                next_slot += 1
+            sources[person_id] = thumbnail
+            mark(slots[person_id], thumbnail_path(thumbnail))
+
+        if not dirty:
+            self._skipped = skipped
+            return
+
+        sheets = list(self._sheets)
+        sheets.extend([None] * (max(dirty) + 1 - len(sheets)))
+        # 同时重绘的图集数不超过进程数：图集多时（人员多）不会占满排队上限导致上传被拒绝，
+        # 也不会因为排队已满而失败、下次请求又重绘同一批图集
+        limit = asyncio.Semaphore(image_pool.max_workers)
+
+        async def render(sheet: int, cells: Dict[int, Optional[str]]):
+            async with limit:
+                return await image_pool.run_batch_job(
+                    render_atlas_sheet,
+                    os.path.join(ATLAS_DIR, sheets[sheet]) if sheets[sheet] else None,
+                    ATLAS_DIR,
+                    f"atlas_{sheet}",
+                    self.sheet_size,
+                    self.cell_size,
+                    sorted(cells.items()),
+                )
+
+        results = await asyncio.gather(*(render(sheet, cells) for sheet, cells in sorted(dirty.items())))
+
+        slot_owners = {slot: person_id for person_id, slot in slots.items()}
+        for sheet, (filename, failed) in zip(sorted(dirty), results):
+            sheets[sheet] = filename
+            for index in failed:
+                person_id = slot_owners[sheet * self.cells_per_sheet + index]
+                skipped[person_id] = sources.pop(person_id)
+                del slots[person_id]
+
+        # 末尾的空图集不再保留
+        last_sheet = max((slot // self.cells_per_sheet for slot in slots.values()), default=-1)
+        del sheets[last_sheet + 1:]
+
+        self._slots, self._sources, self._skipped, self._sheets = slots, sources, skipped, sheets
+        self._save_state()
+        self._remove_stale_sheets()
+
+
+avatar_atlas = AvatarAtlas()
@@ -0,0 +1,9 @@
+"""
+后端性能基准测试
+
+    python -m bench                          # 1k/10k/100k 人员，结果写入 bench-results.json
+    python -m bench --sizes 1000 --baseline old.json
+
+每个名单规模在单独的子进程和临时目录中运行（临时SQLite数据库和上传目录），
+通过进程内的 ASGI 客户端请求接口，输出延迟分位数和吞吐量的JSON，便于对比不同提交的结果。
+"""
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+基准测试命令行
+
+    python -m bench --sizes 1000,10000 --output results.json
+    python -m bench --baseline old.json          # 与之前的结果对比，有退化时退出码为1
+    python -m bench --compare old.json new.json  # 只对比两个结果文件
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_SIZES = "1000,10000,100000"
+# 结果文件格式版本，字段不兼容地修改时递增
+RESULT_VERSION = 1
+
+
+def _git(*args: str) -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", *args], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> Dict[str, Any]:
+    """运行环境，写入结果文件用于判断两次结果是否可比"""
+    status = _git("status", "--porcelain")
+    return {
+        "git_commit": _git("rev-parse", "HEAD"),
+        "git_dirty": bool(status) if status is not None else None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "sqlite": sqlite3.sqlite_version,
+    }
+
+
+def run_child(size: int, args: argparse.Namespace) -> Dict[str, Any]:
+    """在临时目录中启动子进程测试一个名单规模（数据库、上传目录和进程内缓存互不影响）"""
+    with tempfile.TemporaryDirectory(prefix="lottery-bench-") as workdir:
+        output = os.path.join(workdir, "result.json")
+        env = dict(os.environ)
+        env["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        env.pop("ASYNC_DATABASE_URL", None)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(BACKEND_DIR), env.get("PYTHONPATH")]))
+        command = [
+            sys.executable, "-m", "bench.run", "--child", str(size), "--child-output", output,
+            "--concurrency", str(args.concurrency), "--warmup", str(args.warmup),
+        ]
+        if args.requests:
+            command += ["--requests", str(args.requests)]
+        if args.scenarios:
+            command += ["--scenarios", args.scenarios]
+        subprocess.run(command, cwd=workdir, env=env, check=True)
+        with open(output, encoding="utf-8") as f:
+            return json.load(f)
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> List[str]:
+    """
+    对比两次结果，打印各场景 p50/p95 延迟和吞吐量的变化
+
+    Returns:
+        超过阈值的退化（延迟增加或吞吐量下降超过 threshold 比例）
+    """
+    regressions = []
+    old_sizes = {result["size"]: result["scenarios"] for result in baseline.get("results", [])}
+    print(f"{'size':>7} {'scenario':<20} {'p50 ms':>21} {'p95 ms':>21} {'req/s':>21}")
+    for result in current.get("results", []):
+        old_scenarios = old_sizes.get(result["size"], {})
+        for name, new in result["scenarios"].items():
+            old = old_scenarios.get(name)
+            if old is None:
+                continue
+            cells = []
+            for metric, old_value, new_value, higher_is_worse in (
+                ("p50", old["latency_ms"]["p50"], new["latency_ms"]["p50"], True),
+                ("p95", old["latency_ms"]["p95"], new["latency_ms"]["p95"], True),
+                ("throughput", old["throughput_rps"], new["throughput_rps"], False),
+            ):
+                change = (new_value - old_value) / old_value if old_value else 0.0
+                cells.append(f"{old_value:>8.2f} -> {new_value:>8.2f}")
+                if (change if higher_is_worse else -change) > threshold:
+                    regressions.append(f"{result['size']} {name} {metric}: {old_value} -> {new_value} ({change:+.0%})")
+            print(f"{result['size']:>7} {name:<20} {cells[0]:>21} {cells[1]:>21} {cells[2]:>21}")
+    return regressions
+
+
+def _load(path: str) -> Dict[str, Any]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _report(regressions: List[str], threshold: float) -> int:
+    if not regressions:
+        print(f"没有超过 {threshold:.0%} 的退化")
+        return 0
+    print(f"超过 {threshold:.0%} 的退化：")
+    for line in regressions:
+        print(f"  {line}")
+    return 1
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(prog="python -m bench", description="后端接口基准测试")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"名单规模，逗号分隔（默认 {DEFAULT_SIZES}）")
+    parser.add_argument("--requests", type=int, help="每个场景的请求数（默认按场景和规模决定）")
+    parser.add_argument("--concurrency", type=int, default=8, help="只读场景的并发数（默认 8）")
+    parser.add_argument("--warmup", type=int, default=3, help="每个场景计时前的预热请求数（默认 3）")
+    parser.add_argument("--scenarios", help="只运行这些场景，逗号分隔（如 persons.list,config.get）")
+    parser.add_argument("--output", default="bench-results.json", help="结果文件（默认 bench-results.json）")
+    parser.add_argument("--baseline", help="与之前的结果文件对比")
+    parser.add_argument("--threshold", type=float, default=0.2, help="判定为退化的变化比例（默认 0.2）")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="只对比两个结果文件，不运行测试")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--child-output", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        sys.exit(_report(compare(_load(args.compare[0]), _load(args.compare[1]), args.threshold), args.threshold))
+
+    if args.child is not None:
+        from bench.scenarios import run_size
+
+        only = args.scenarios.split(",") if args.scenarios else None
+        result = asyncio.run(run_size(args.child, args.requests, args.concurrency, args.warmup, only))
+        with open(args.child_output, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        return
+
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    document = {
+        "version": RESULT_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": environment(),
+        "config": {
+            "sizes": sizes,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "warmup": args.warmup,
+            "scenarios": args.scenarios,
+        },
+        "results": [],
+    }
+    for size in sizes:
+        print(f"名单规模 {size}", flush=True)
+        document["results"].append(run_child(size, args))
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(document, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {args.output}")
+
+    if args.baseline:
+        sys.exit(_report(compare(_load(args.baseline), document, args.threshold), args.threshold))
+
+
+if __name__ == "__main__":
+    main()
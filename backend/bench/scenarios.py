@@ -0,0 +1,248 @@
+"""
+基准测试场景（在子进程中运行）
+
+子进程的工作目录是临时目录，DATABASE_URL 指向其中的SQLite数据库，
+所以数据库和应用模块在函数内导入，不能在模块顶层导入。
+"""
+
+import asyncio
+import io
+import itertools
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+# 中奖人员的比例（ID能被整除的人员），用于 /not/prize 和 /reset/won
+WINNER_EVERY = 10
+# 批量导入每个请求的人数
+BATCH_SIZE = 100
+# 上传图片的边长（像素）
+UPLOAD_IMAGE_SIZE = 512
+SEED_CHUNK = 5000
+PRIZE_ID = 1
+PRIZE_NAME = "一等奖"
+DEPARTMENTS = [f"部门{i:02d}" for i in range(20)]
+
+
+class Scenario(NamedTuple):
+    """一个测试场景"""
+    name: str
+    method: str
+    path: str
+    requests: int
+    concurrency: int
+    # 每个请求的参数（不计时），返回传给 client.request 的关键字参数
+    build: Optional[Callable[[], Dict[str, Any]]] = None
+    # 每个请求前的准备（不计时，只能用于并发为1的场景）
+    setup: Optional[Callable[[], None]] = None
+    # 每个请求处理的条目数（批量导入为每批人数），用于计算 items_per_s
+    items: int = 1
+
+
+def percentile(values: List[float], q: float) -> float:
+    """已排序数据的分位数（线性插值），q 取 0-100"""
+    if not values:
+        return 0.0
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(
+    latencies: List[float], duration: float, statuses: Dict[int, int], body_bytes: int, scenario: Scenario
+) -> Dict[str, Any]:
+    """统计延迟分位数（毫秒）、吞吐量和平均响应体大小"""
+    values = sorted(latency * 1000 for latency in latencies)
+    count = len(values)
+    errors = sum(n for status, n in statuses.items() if status >= 400)
+    result = {
+        "method": scenario.method,
+        "path": scenario.path,
+        "requests": count,
+        "concurrency": scenario.concurrency,
+        "errors": errors,
+        "status_codes": {str(status): n for status, n in sorted(statuses.items())},
+        "duration_s": round(duration, 4),
+        "throughput_rps": round(count / duration, 2) if duration else 0.0,
+        "response_bytes": body_bytes // count if count else 0,
+        "latency_ms": {
+            "min": round(values[0], 3) if values else 0.0,
+            "mean": round(sum(values) / count, 3) if values else 0.0,
+            "p50": round(percentile(values, 50), 3),
+            "p90": round(percentile(values, 90), 3),
+            "p95": round(percentile(values, 95), 3),
+            "p99": round(percentile(values, 99), 3),
+            "max": round(values[-1], 3) if values else 0.0,
+        },
+    }
+    if scenario.items > 1:
+        result["items_per_s"] = round(count * scenario.items / duration, 2) if duration else 0.0
+    return result
+
+
+def seed(size: int) -> float:
+    """写入 size 个合成人员和一个奖项（ID能被 WINNER_EVERY 整除的人员已中奖），返回耗时（秒）"""
+    from sqlalchemy import insert
+
+    from database import SessionLocal, init_db, Person as PersonModel, Prize as PrizeModel
+
+    started = time.perf_counter()
+    init_db()
+    db = SessionLocal()
+    try:
+        db.add(PrizeModel(id=PRIZE_ID, name=PRIZE_NAME, sort=1, count=size))
+        for start in range(1, size + 1, SEED_CHUNK):
+            rows = [
+                {
+                    "id": i,
+                    "uid": f"U{i:06d}",
+                    "uuid": f"bench-{i}",
+                    "name": f"人员{i}",
+                    "department": DEPARTMENTS[i % len(DEPARTMENTS)],
+                    "position": "工程师",
+                    "device_fingerprint": f"fp-{i}" if i % 2 else "",
+                }
+                for i in range(start, min(start + SEED_CHUNK, size + 1))
+            ]
+            db.execute(insert(PersonModel), rows)
+        db.commit()
+    finally:
+        db.close()
+    mark_winners()
+    return time.perf_counter() - started
+
+
+def mark_winners():
+    """把ID能被 WINNER_EVERY 整除的人员标记为中奖（直接写数据库，之后使缓存失效）"""
+    from sqlalchemy import insert, update
+
+    from database import SessionLocal, Person as PersonModel, PersonPrize as PersonPrizeModel, person_prize_rows
+    from device_cache import device_cache
+    from eligibility import eligibility_index
+
+    prize_time = time.strftime("%Y-%m-%d %H:%M:%S")
+    db = SessionLocal()
+    try:
+        winner = PersonModel.id % WINNER_EVERY == 0
+        db.execute(
+            update(PersonModel).where(winner).values(
+                is_win=True, prize_id=[str(PRIZE_ID)], prize_name=[PRIZE_NAME], prize_time=[prize_time],
+            )
+        )
+        rows = []
+        for (person_id,) in db.query(PersonModel.id).filter(winner):
+            rows.extend(person_prize_rows(person_id, [PRIZE_ID], [PRIZE_NAME], [prize_time]))
+        if rows:
+            db.execute(insert(PersonPrizeModel), rows)
+        db.commit()
+    finally:
+        db.close()
+    eligibility_index.invalidate()
+    device_cache.invalidate()
+
+
+def _png(index: int) -> bytes:
+    """生成内容各不相同的PNG（颜色由序号决定），上传时不会被去重"""
+    from PIL import Image
+
+    color = (index % 256, (index // 256) % 256, (index // 65536) % 256)
+    buffer = io.BytesIO()
+    Image.new("RGB", (UPLOAD_IMAGE_SIZE, UPLOAD_IMAGE_SIZE), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def default_scenarios(size: int, requests: Optional[int] = None, concurrency: int = 8) -> List[Scenario]:
+    """
+    默认场景：先测只读接口，再测写接口（批量导入会增加人员，放在读接口之后）
+
+    Args:
+        size: 名单规模，返回全部人员的接口默认请求数随规模减少
+        requests: 覆盖每个场景的请求数
+        concurrency: 只读场景的并发数
+    """
+    # 全量列表有响应缓存，未中此奖的人员每次请求都查询并序列化全部人员
+    list_requests = max(20, min(200, 2_000_000 // size))
+    not_prize_requests = max(10, min(100, 200_000 // size))
+    batch_counter = itertools.count(1)
+    upload_counter = itertools.count(1)
+
+    def batch_body():
+        n = next(batch_counter)
+        return {"json": [
+            {"uuid": f"batch-{n}-{i}", "name": f"导入{n}-{i}", "department": DEPARTMENTS[i % len(DEPARTMENTS)]}
+            for i in range(BATCH_SIZE)
+        ]}
+
+    def upload_body():
+        n = next(upload_counter)
+        return {"files": {"file": (f"bench-{n}.png", _png(n), "image/png")}}
+
+    return [
+        Scenario("config.get", "GET", "/api/config/", requests or 1000, concurrency),
+        Scenario("persons.list", "GET", "/api/persons/", requests or list_requests, concurrency),
+        Scenario("persons.not_prize", "GET", f"/api/persons/not/prize/{PRIZE_ID}", requests or not_prize_requests, concurrency),
+        Scenario("media.upload", "POST", "/api/media/upload", requests or 40, min(concurrency, 4), build=upload_body),
+        Scenario("persons.batch", "POST", "/api/persons/batch", requests or 50, 1, build=batch_body, items=BATCH_SIZE),
+        Scenario("persons.reset_won", "POST", "/api/persons/reset/won", requests or 20, 1, setup=mark_winners),
+    ]
+
+
+async def run_scenario(client, scenario: Scenario, warmup: int) -> Dict[str, Any]:
+    """预热 warmup 次后按并发数执行场景，返回统计结果"""
+    async def call() -> Tuple[float, int, int]:
+        if scenario.setup:
+            scenario.setup()
+        kwargs = scenario.build() if scenario.build else {}
+        started = time.perf_counter()
+        response = await client.request(scenario.method, scenario.path, **kwargs)
+        return time.perf_counter() - started, response.status_code, len(response.content)
+
+    for _ in range(min(warmup, scenario.requests)):
+        await call()
+
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    body_bytes = 0
+    remaining = iter(range(scenario.requests))
+
+    async def worker():
+        nonlocal body_bytes
+        for _ in remaining:
+            latency, status, size = await call()
+            latencies.append(latency)
+            body_bytes += size
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(scenario.concurrency)))
+    return summarize(latencies, time.perf_counter() - started, statuses, body_bytes, scenario)
+
+
+async def run_size(
+    size: int,
+    requests: Optional[int] = None,
+    concurrency: int = 8,
+    warmup: int = 3,
+    only: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """写入 size 个人员，启动应用（包括启动事件），依次执行各场景"""
+    import httpx
+
+    seed_seconds = seed(size)
+
+    from main import app
+
+    scenarios = [s for s in default_scenarios(size, requests, concurrency) if not only or s.name in only]
+    results: Dict[str, Any] = {}
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for scenario in scenarios:
+                result = results[scenario.name] = await run_scenario(client, scenario, warmup)
+                print(
+                    f"  {scenario.name:<20} p50 {result['latency_ms']['p50']:>9.2f} ms  "
+                    f"p95 {result['latency_ms']['p95']:>9.2f} ms  {result['throughput_rps']:>9.1f} req/s  "
+                    f"errors {result['errors']}",
+                    flush=True,
+                )
+    return {"size": size, "seed_s": round(seed_seconds, 3), "scenarios": results}
@@ -0,0 +1,117 @@
+"""
+数据变更日志
+
+记录 persons / prizes / departments / global_config 表中每一行的新增、修改和删除，
+供 GET /api/sync?since=<seq> 只返回客户端上次同步之后变化的行。
+
+变更由 Session 事件自动收集（ORM对象的增删改、按主键的批量 UPDATE），在提交前与数据修改写入同一事务。
+无法确定影响了哪些行的批量语句（如整表 UPDATE / DELETE）记录为该表的 resync 标记，客户端需要重新拉取整张表。
+
+客户端按 seq > since 读取，要求 seq 按提交顺序递增：否则先分配到较小 seq 的事务后提交时，
+已经读到更大 seq 的客户端会永远错过这条变更。SQLite 同时只有一个写事务，天然满足；
+PostgreSQL（多进程、多主机并发写入）在写入变更记录前锁住变更日志表直到提交，使各事务的 seq 分配和提交串行。
+"""
+
+import os
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import Table, delete, event, func, insert, inspect, select, text
+from sqlalchemy.orm import Session
+
+# 记录变更的表
+TRACKED_TABLES = ("persons", "prizes", "departments", "global_config")
+
+OP_UPSERT = "upsert"
+OP_DELETE = "delete"
+OP_RESYNC = "resync"
+
+# 保留的变更记录条数，更早的记录会被清理（客户端的 since 早于保留范围时需要全量同步）
+CHANGE_LOG_RETENTION = int(os.getenv("CHANGE_LOG_RETENTION", "50000"))
+# 一次增量同步最多返回的变更条数，超过时让客户端全量同步
+SYNC_MAX_CHANGES = int(os.getenv("SYNC_MAX_CHANGES", "5000"))
+# 每写入多少条变更记录清理一次
+_PRUNE_EVERY = 1000
+
+# Session.info 中记录本事务的变更
+_CHANGES_KEY = "change_log"
+
+# 执行选项：为 False 时不自动记录该语句的变更（调用方用 record_changes 自行记录）
+RECORD_CHANGES_OPTION = "record_changes"
+
+
+def record_changes(session: Session, table_name: str, row_ids: Iterable[Optional[int]], op: str = OP_UPSERT):
+    """记录本事务中的行变更（提交时写入变更日志）"""
+    session.info.setdefault(_CHANGES_KEY, []).extend((table_name, row_id, op) for row_id in row_ids)
+
+
+def _coalesce(changes: List[Tuple[str, Optional[int], str]]) -> List[Tuple[str, Optional[int], str]]:
+    """同一行的多次变更只保留最后一次"""
+    latest = {}
+    for table_name, row_id, op in changes:
+        latest.pop((table_name, row_id), None)
+        latest[(table_name, row_id)] = op
+    return [(table_name, row_id, op) for (table_name, row_id), op in latest.items()]
+
+
+def track_changes(session_factory, log_table: Table):
+    """为会话工厂注册事件，把被跟踪表的行变更写入变更日志表"""
+    written = {"count": 0}
+
+    @event.listens_for(session_factory, "after_flush")
+    def _collect_flushed(session, flush_context):
+        for op, objects in (
+            (OP_UPSERT, list(session.new) + [obj for obj in session.dirty if session.is_modified(obj)]),
+            (OP_DELETE, list(session.deleted)),
+        ):
+            for obj in objects:
+                table = getattr(obj, "__table__", None)
+                if table is not None and table.name in TRACKED_TABLES:
+                    # 新对象在 after_flush 时还没有 identity，从实例上读取主键
+                    row_id = inspect(obj).mapper.primary_key_from_instance(obj)[0]
+                    record_changes(session, table.name, [row_id], op)
+
+    @event.listens_for(session_factory, "do_orm_execute")
+    def _collect_bulk(orm_execute_state):
+        if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+            return
+        table = getattr(orm_execute_state.statement, "table", None)
+        if table is None or table.name not in TRACKED_TABLES:
+            return
+        if orm_execute_state.execution_options.get(RECORD_CHANGES_OPTION, True) is False:
+            return
+        params = orm_execute_state.parameters
+        if (
+            not orm_execute_state.is_delete
+            and isinstance(params, list)
+            and params
+            and all("id" in row for row in params)
+        ):
+            # 按主键的批量 INSERT / UPDATE，可以确定影响的行
+            record_changes(orm_execute_state.session, table.name, [row["id"] for row in params])
+        else:
+            record_changes(orm_execute_state.session, table.name, [None], OP_RESYNC)
+
+    @event.listens_for(session_factory, "before_commit")
+    def _write_log(session):
+        # 先刷新，确保本事务的ORM变更都已收集
+        session.flush()
+        changes = session.info.pop(_CHANGES_KEY, None)
+        if not changes:
+            return
+        rows = [
+            {"table_name": table_name, "row_id": row_id, "op": op}
+            for table_name, row_id, op in _coalesce(changes)
+        ]
+        if session.get_bind().dialect.name == "postgresql":
+            # 持有到提交：并发的写事务在这里排队，seq 按提交顺序分配（EXCLUSIVE 不阻塞 /api/sync 的读取）
+            session.execute(text(f"LOCK TABLE {log_table.name} IN EXCLUSIVE MODE"))
+        session.execute(insert(log_table), rows)
+        written["count"] += len(rows)
+        if written["count"] >= _PRUNE_EVERY:
+            written["count"] = 0
+            newest = select(func.max(log_table.c.seq)).scalar_subquery()
+            session.execute(delete(log_table).where(log_table.c.seq <= newest - CHANGE_LOG_RETENTION))
+
+    @event.listens_for(session_factory, "after_rollback")
+    def _discard_rolled_back(session):
+        session.info.pop(_CHANGES_KEY, None)
@@ -0,0 +1,33 @@
+"""
+pytest 配置
+
+测试在临时目录中运行（临时SQLite数据库和上传目录），不影响 lottery.db 和 uploads。
+数据库和应用模块读取的环境变量和相对路径在导入时确定，所以在这里、测试模块导入之前设置。
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+_WORKDIR = tempfile.mkdtemp(prefix="lottery-test-")
+os.chdir(_WORKDIR)
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_WORKDIR, 'test.db')}"
+os.environ.pop("ASYNC_DATABASE_URL", None)
+
+
+@pytest.fixture
+def client():
+    """启动应用（包括启动事件）的测试客户端，结束时清空人员和奖项"""
+    from fastapi.testclient import TestClient
+
+    from main import app
+
+    with TestClient(app) as test_client:
+        yield test_client
+        test_client.delete("/api/persons/")
+        test_client.delete("/api/prizes/")
@@ -1,19 +1,43 @@
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, Text, DateTime, JSON, ForeignKey
+from sqlalchemy import create_engine, event, Column, Integer, Float, String, Boolean, Text, DateTime, JSON, LargeBinary, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker, relationship
 from datetime import datetime
 
-# SQLite数据库配置
-SQLALCHEMY_DATABASE_URL = "sqlite:///./lottery.db"
-
-# 创建数据库引擎
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+from db_config import (
+    ASYNC_DATABASE_URL, DATABASE_URL, async_engine_options, configure_sqlite, engine_options, shared_table_versions,
 )
+from table_versions import table_versions, track_table_changes
+from change_log import track_changes
+
+# 数据库配置（通过环境变量 DATABASE_URL 设置，默认使用本地SQLite文件）
+SQLALCHEMY_DATABASE_URL = DATABASE_URL
+
+# 创建数据库引擎（连接池和PRAGMA配置见 db_config.py）
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_options(SQLALCHEMY_DATABASE_URL))
+configure_sqlite(engine)
 
 # 创建会话工厂
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# 异步引擎和会话工厂：读多的接口使用，不占用线程池
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **async_engine_options(ASYNC_DATABASE_URL))
+configure_sqlite(async_engine.sync_engine)
+
+
+class AsyncSyncSession(Session):
+    """异步会话内部使用的同步会话（用于注册表版本号事件）"""
+
+
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, expire_on_commit=False, autoflush=False, sync_session_class=AsyncSyncSession
+)
+
+# 提交后自动递增被修改表的版本号（用于条件请求和响应缓存）
+track_table_changes(SessionLocal)
+track_table_changes(AsyncSyncSession)
+
 # 创建基类
 Base = declarative_base()
 
@@ -34,6 +58,7 @@ class Person(Base):
     thumbnail_avatar = Column(Text, default="")
     device_fingerprint = Column(String, index=True, default="")
     is_win = Column(Boolean, default=False)
+    weight = Column(Float, default=1.0)  # 抽奖权重，0 表示不参与抽奖
     x = Column(Integer, default=0)
     y = Column(Integer, default=0)
     create_time = Column(String, default="")
@@ -43,6 +68,20 @@ class Person(Base):
     prize_time = Column(JSON, default=list)
 
 
+class PersonPrize(Base):
+    """人员中奖记录表（persons.prize_id/prize_name/prize_time 的归一化索引）"""
+    __tablename__ = "person_prizes"
+    __table_args__ = (
+        Index("ix_person_prizes_prize_person", "prize_id", "person_id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    person_id = Column(Integer, ForeignKey("persons.id", ondelete="CASCADE"), nullable=False, index=True)
+    prize_id = Column(String, nullable=False)
+    prize_name = Column(String, default="")
+    prize_time = Column(String, default="")
+
+
 class Prize(Base):
     """奖项配置表"""
     __tablename__ = "prizes"
@@ -63,6 +102,18 @@ class Prize(Base):
     is_show = Column(Boolean, default=False)
     is_used = Column(Boolean, default=False)
     frequency = Column(Integer, default=1)
+    # 版本号：ORM更新时比较并递增（乐观并发控制），抽奖和占用名额的条件UPDATE也会递增
+    version = Column(Integer, nullable=False, default=0)
+
+    __mapper_args__ = {"version_id_col": version}
+
+    @property
+    def separate_count(self):
+        """分批设置（schemas.Prize 的 separate_count 字段从这两列读取）"""
+        return {
+            "enable": True if self.separate_count_enable is None else self.separate_count_enable,
+            "count_list": self.separate_count_list or [],
+        }
 
 
 class GlobalConfig(Base):
@@ -112,6 +163,26 @@ class Image(Base):
     thumbnail_url = Column(Text, default="")
 
 
+class UploadBlob(Base):
+    """上传文件表（内容寻址存储，按引用计数回收）"""
+    __tablename__ = "upload_blobs"
+
+    hash = Column(String, primary_key=True)  # 原始内容的SHA-256
+    filename = Column(String, nullable=False, index=True)
+    thumbnail_filename = Column(String, default="")
+    size = Column(Integer, default=0)
+    ref_count = Column(Integer, default=0)
+    create_time = Column(String, default="")
+
+
+class TableVersion(Base):
+    """表版本号（多进程部署时各进程共享，用于缓存失效）"""
+    __tablename__ = "table_versions"
+
+    name = Column(String(64), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
 class Department(Base):
     """部门配置表"""
     __tablename__ = "departments"
@@ -123,10 +194,115 @@ class Department(Base):
     update_time = Column(String, default="")
 
 
+class ChangeLog(Base):
+    """数据变更日志表（增量同步接口按 seq 读取）"""
+    __tablename__ = "change_log"
+
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    table_name = Column(String(32), nullable=False)
+    row_id = Column(Integer, nullable=True)  # resync 标记时为空
+    op = Column(String(8), nullable=False)  # upsert / delete / resync
+
+
+class IdempotencyKey(Base):
+    """幂等请求的响应表（IDEMPOTENCY_DB=true 时使用）"""
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String(255), primary_key=True)
+    fingerprint = Column(String(64), nullable=False)  # 请求的SHA-256
+    status_code = Column(Integer, nullable=False)
+    headers = Column(JSON, default=list)
+    body = Column(LargeBinary, default=b"")
+    expires_at = Column(Float, nullable=False, index=True)  # 过期时间（Unix时间戳）
+
+
+class DrawAudit(Base):
+    """抽奖审计记录表（只追加，用于重放和校验每一轮抽奖）"""
+    __tablename__ = "draw_audits"
+
+    id = Column(Integer, primary_key=True, index=True)
+    prize_id = Column(String, nullable=False, index=True)
+    prize_name = Column(String, default="")
+    algorithm = Column(String, nullable=False)
+    seed = Column(String, nullable=False)  # 十六进制随机种子
+    pool_size = Column(Integer, nullable=False)
+    pool_hash = Column(String, nullable=False)  # 候选池的SHA-256
+    pool_ranges = Column(JSON, default=list)  # 候选池（连续ID区间）
+    winner_ids = Column(JSON, default=list)  # 按抽中顺序
+    options = Column(JSON, default=dict)  # 加权/分层抽取的权重、部门和名额，重放时使用
+    create_time = Column(String, default="")
+
+
+@event.listens_for(DrawAudit, "before_update")
+@event.listens_for(DrawAudit, "before_delete")
+def _reject_audit_change(mapper, connection, target):
+    """审计记录只允许插入，不允许通过ORM修改或删除"""
+    raise ValueError("draw_audits is append-only")
+
+
+# 提交时把行变更写入变更日志（与数据修改在同一事务中）
+track_changes(SessionLocal, ChangeLog.__table__)
+track_changes(AsyncSyncSession, ChangeLog.__table__)
+
+
 # 创建所有表
 def init_db():
     """初始化数据库"""
     Base.metadata.create_all(bind=engine)
+    if shared_table_versions(engine):
+        _init_table_versions()
+
+
+def _init_table_versions():
+    """为每张表创建版本号记录，并改为从数据库读取版本号"""
+    db = SessionLocal()
+    try:
+        existing = {name for (name,) in db.query(TableVersion.name)}
+        for name in Base.metadata.tables:
+            if name in existing:
+                continue
+            db.add(TableVersion(name=name, version=0))
+            try:
+                db.commit()
+            except IntegrityError:
+                # 其他进程同时启动，已经插入了该记录
+                db.rollback()
+    finally:
+        db.close()
+    table_versions.use_database(engine, TableVersion.__table__, async_engine)
+
+
+def person_prize_rows(person_id, prize_ids, prize_names, prize_times):
+    """把人员的中奖JSON数组展开为 person_prizes 表的行"""
+    prize_names = prize_names or []
+    prize_times = prize_times or []
+    rows = []
+    for i, prize_id in enumerate(prize_ids or []):
+        rows.append({
+            "person_id": person_id,
+            "prize_id": str(prize_id),
+            "prize_name": prize_names[i] if i < len(prize_names) else "",
+            "prize_time": prize_times[i] if i < len(prize_times) else "",
+        })
+    return rows
+
+
+def sync_person_prizes(db, persons):
+    """根据人员当前的中奖JSON数组重建其 person_prizes 记录（不提交事务）"""
+    persons = [person for person in persons if person.id is not None]
+    if not persons:
+        return
+    person_ids = [person.id for person in persons]
+    # 分段删除，避免超过SQLite的参数数量上限
+    for start in range(0, len(person_ids), 500):
+        db.query(PersonPrize).filter(
+            PersonPrize.person_id.in_(person_ids[start:start + 500])
+        ).delete(synchronize_session=False)
+    rows = []
+    for person in persons:
+        rows.extend(person_prize_rows(person.id, person.prize_id, person.prize_name, person.prize_time))
+    if rows:
+        db.execute(PersonPrize.__table__.insert(), rows)
 
 
 # 获取数据库会话
@@ -137,3 +313,9 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    """获取异步数据库会话"""
+    async with AsyncSessionLocal() as db:
+        yield db
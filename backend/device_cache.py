@@ -0,0 +1,341 @@
+"""
+设备指纹查询缓存
+
+手机端轮询 GET /api/persons/device/summary 查询自己是否中奖，揭晓时上千台手机同时请求。
+这里在内存中维护 设备指纹 -> 精简人员信息（已序列化的JSON）的映射，启动时预热，
+人员相关的写接口提交后同步更新（单条修改直接更新映射，批量修改标记失效后重新加载），
+查询时不访问数据库。
+
+多进程共享表版本号时（SHARED_TABLE_VERSIONS），persons 表版本号变化后重新加载，
+以发现其他进程的修改。重新加载（连同版本号检查）同时只执行一次，并发的查询等待并共享同一次加载的结果，
+失效后上千个请求同时到达也只加载一次。
+
+GET /api/persons/status 的长轮询也在这里等待：映射更新时唤醒等待该人员的请求；
+标记失效时（有挂起的请求才）立即重新加载一次，与各请求已知的 version 比较，只唤醒状态变化了的请求。
+共享表版本号时每个进程只有一个任务定期检查其他进程的修改，两次抽奖之间挂起的请求不占用数据库连接。
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import load_only
+
+from database import AsyncSessionLocal, Person as PersonModel
+from schemas import PersonDeviceSummary
+from table_versions import table_versions
+
+# 长轮询最多等待的秒数
+STATUS_MAX_WAIT_SECONDS = float(os.getenv("STATUS_MAX_WAIT_SECONDS", "60"))
+# 多进程共享表版本号时，长轮询每隔多少秒检查一次其他进程的修改
+STATUS_VERSION_CHECK_SECONDS = float(os.getenv("STATUS_VERSION_CHECK_SECONDS", "1"))
+
+_TABLES = ("persons",)
+# 只加载摘要需要的列
+_COLUMNS = [PersonModel.id, PersonModel.device_fingerprint] + [
+    getattr(PersonModel, name) for name in PersonDeviceSummary.model_fields if name != "id"
+]
+
+# (人员ID, 精简人员信息JSON, 中奖状态)
+Entry = Tuple[int, bytes, Dict[str, Any]]
+
+
+def _status(person) -> Dict[str, Any]:
+    """中奖状态：是否中奖和最近一次中奖的奖项，version 在状态变化时改变"""
+    prize_ids = person.prize_id or []
+    prize_names = person.prize_name or []
+    prize_times = person.prize_time or []
+    state = [person.id, bool(person.is_win), prize_ids, prize_times]
+    return {
+        "id": person.id,
+        "is_win": bool(person.is_win),
+        "prize_id": str(prize_ids[-1]) if prize_ids else None,
+        "prize_name": prize_names[-1] if prize_names else None,
+        "prize_time": prize_times[-1] if prize_times else None,
+        "version": hashlib.sha1(json.dumps(state, default=str).encode()).hexdigest()[:16],
+    }
+
+
+def _entry(person) -> Entry:
+    return person.id, PersonDeviceSummary.model_validate(person).model_dump_json().encode(), _status(person)
+
+
+class DeviceSummaryCache:
+    """设备指纹 -> 精简人员信息（进程内）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        # 设备指纹 -> (人员ID, JSON, 中奖状态)
+        self._by_fingerprint: Dict[str, Entry] = {}
+        # 人员ID -> 设备指纹（人员修改指纹或被删除时找到旧的映射）
+        self._fingerprints: Dict[int, str] = {}
+        # 每次修改递增，加载期间有修改时放弃本次加载结果
+        self._generation = 0
+        self._versions: Tuple[int, ...] = ()
+        # 正在执行的检查和重新加载，并发的查询共享同一个任务
+        self._refresh_task: Optional[asyncio.Task] = None
+        # 人员ID -> {等待该人员状态变化的长轮询请求: 请求已知的 version}（只在事件循环线程中修改）
+        self._waiters: Dict[int, Dict[asyncio.Event, str]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # 重新加载后比较挂起请求的状态（_check_requested 为 True 时再比较一次）
+        self._check_task: Optional[asyncio.Task] = None
+        self._check_requested = False
+        # 共享表版本号时定期检查其他进程修改的任务
+        self._poll_task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+        self.reloads = 0
+
+    def invalidate(self):
+        """标记失效（批量修改人员后调用），下次查询时重新加载；有挂起的长轮询请求时立即重新加载"""
+        with self._lock:
+            self._loaded = False
+            self._generation += 1
+        self._call_in_loop(self._start_refresh)
+
+    def update(self, persons: Iterable):
+        """人员新增或修改并提交后同步到缓存"""
+        changed = []
+        with self._lock:
+            self._generation += 1
+            for person in persons:
+                changed.append(person.id)
+                self._remove(person.id)
+                if person.device_fingerprint:
+                    existing = self._by_fingerprint.get(person.device_fingerprint)
+                    # 多个人员使用同一设备指纹时保留ID最小的（与按指纹查询数据库的结果一致）
+                    if existing is None or existing[0] > person.id:
+                        if existing is not None:
+                            self._fingerprints.pop(existing[0], None)
+                        self._by_fingerprint[person.device_fingerprint] = _entry(person)
+                        self._fingerprints[person.id] = person.device_fingerprint
+        self._wake(changed)
+
+    def remove(self, person_ids: Iterable[int]):
+        """人员删除并提交后同步到缓存"""
+        person_ids = list(person_ids)
+        with self._lock:
+            self._generation += 1
+            for person_id in person_ids:
+                self._remove(person_id)
+        self._wake(person_ids)
+
+    def _remove(self, person_id: int):
+        fingerprint = self._fingerprints.pop(person_id, None)
+        if fingerprint is not None:
+            self._by_fingerprint.pop(fingerprint, None)
+
+    async def load(self) -> bool:
+        """从数据库加载全部映射，加载期间有修改时放弃结果并返回 False"""
+        with self._lock:
+            generation = self._generation
+        versions = await table_versions.asnapshot(_TABLES)
+        by_fingerprint: Dict[str, Entry] = {}
+        fingerprints: Dict[int, str] = {}
+        async with AsyncSessionLocal() as db:
+            persons = await db.scalars(
+                select(PersonModel)
+                .options(load_only(*_COLUMNS))
+                .where(PersonModel.device_fingerprint != "")
+                .order_by(PersonModel.id)
+            )
+            for person in persons:
+                if person.device_fingerprint not in by_fingerprint:
+                    by_fingerprint[person.device_fingerprint] = _entry(person)
+                    fingerprints[person.id] = person.device_fingerprint
+        with self._lock:
+            if generation != self._generation:
+                return False
+            self._by_fingerprint = by_fingerprint
+            self._fingerprints = fingerprints
+            self._versions = versions
+            self._loaded = True
+            self.reloads += 1
+            return True
+
+    async def get(self, fingerprint: str) -> Optional[bytes]:
+        """按设备指纹获取精简人员信息的JSON，人员不存在时返回 None"""
+        entry = await self._lookup(fingerprint)
+        return entry[1] if entry else None
+
+    async def status(self, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """按设备指纹获取中奖状态，人员不存在时返回 None"""
+        entry = await self._lookup(fingerprint)
+        return entry[2] if entry else None
+
+    async def status_by_uuid(self, uuid: str) -> Optional[Dict[str, Any]]:
+        """按UUID获取中奖状态（未登记设备指纹的人员不在缓存中，直接查询数据库）"""
+        entry = await self._query(PersonModel.uuid == uuid)
+        return entry[2] if entry else None
+
+    async def _ensure_loaded(self) -> bool:
+        """
+        确保映射已加载且没有过期，同时只有一个检查和加载在执行，并发的调用等待同一个任务
+
+        Returns:
+            映射是否可用（False 表示加载期间人员一直在被修改）
+        """
+        if self._loaded and not table_versions.shared:
+            return True
+        # 调用方被取消（客户端断开）时不取消共享的任务
+        return await asyncio.shield(self._start_refresh())
+
+    def _start_refresh(self) -> asyncio.Task:
+        """返回正在执行的检查和加载任务，没有时创建（在事件循环中调用）"""
+        loop = asyncio.get_running_loop()
+        task = self._refresh_task
+        if task is None or task.done() or task.get_loop() is not loop:
+            task = self._refresh_task = loop.create_task(self._refresh())
+        return task
+
+    async def _refresh(self) -> bool:
+        if self._loaded and table_versions.shared and await table_versions.asnapshot(_TABLES) != self._versions:
+            # 其他进程修改了人员，之后开始的加载会读到修改，不需要递增 _generation
+            with self._lock:
+                self._loaded = False
+        if self._loaded:
+            return True
+        # 加载期间本进程有修改时重试一次
+        loaded = await self.load() or await self.load()
+        if self._waiters:
+            self._request_check()
+        return loaded
+
+    async def _lookup(self, fingerprint: str) -> Optional[Entry]:
+        if not await self._ensure_loaded():
+            # 加载期间人员被修改，本次直接查询数据库
+            self.fallbacks += 1
+            return await self._query(PersonModel.device_fingerprint == fingerprint)
+        with self._lock:
+            entry = self._by_fingerprint.get(fingerprint)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    async def _query(self, condition) -> Optional[Entry]:
+        async with AsyncSessionLocal() as db:
+            person = await db.scalar(
+                select(PersonModel)
+                .options(load_only(*_COLUMNS))
+                .where(condition)
+                .order_by(PersonModel.id)
+                .limit(1)
+            )
+            return _entry(person) if person else None
+
+    async def wait(self, person_id: int, version: str, timeout: float) -> bool:
+        """
+        等待人员状态可能发生变化（在事件循环中调用）
+
+        多进程共享表版本号时，由每个进程一个的检查任务发现其他进程的修改。
+
+        Args:
+            person_id: 人员ID
+            version: 调用方已知的状态 version，批量修改后只唤醒状态与它不同的请求
+            timeout: 最多等待的秒数
+
+        Returns:
+            是否被唤醒（False 表示超时）
+        """
+        self._loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        self._waiters.setdefault(person_id, {})[event] = version
+        if table_versions.shared and (self._poll_task is None or self._poll_task.done()):
+            self._poll_task = self._loop.create_task(self._poll())
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            waiters = self._waiters.get(person_id)
+            if waiters is not None:
+                waiters.pop(event, None)
+                if not waiters:
+                    del self._waiters[person_id]
+
+    async def _poll(self):
+        """有挂起的请求时每隔 STATUS_VERSION_CHECK_SECONDS 秒检查一次 persons 表版本号，变化时重新加载"""
+        while self._waiters:
+            await asyncio.sleep(STATUS_VERSION_CHECK_SECONDS)
+            try:
+                await self._ensure_loaded()
+            except Exception as e:
+                print(f"检查人员表版本号失败: {e}")
+
+    def _request_check(self):
+        """重新加载后比较挂起请求的状态（在事件循环中调用）"""
+        self._check_requested = True
+        if self._check_task is None or self._check_task.done():
+            self._check_task = asyncio.get_running_loop().create_task(self._check_waiters())
+
+    async def _check_waiters(self):
+        """只唤醒当前状态 version 与已知 version 不同（或人员已删除）的请求"""
+        while self._check_requested and self._waiters:
+            self._check_requested = False
+            current: Dict[int, Optional[Dict[str, Any]]] = {}
+            missing = []
+            with self._lock:
+                for person_id in self._waiters:
+                    fingerprint = self._fingerprints.get(person_id) if self._loaded else None
+                    if fingerprint is not None:
+                        current[person_id] = self._by_fingerprint[fingerprint][2]
+                    else:
+                        missing.append(person_id)
+            if missing:
+                # 没有设备指纹的人员（按UUID等待）不在缓存中，加载失败时也在这里，一次查询全部
+                current.update(dict.fromkeys(missing))
+                try:
+                    async with AsyncSessionLocal() as db:
+                        persons = await db.scalars(
+                            select(PersonModel).options(load_only(*_COLUMNS)).where(PersonModel.id.in_(missing))
+                        )
+                        for person in persons:
+                            current[person.id] = _status(person)
+                except Exception as e:
+                    print(f"查询等待中的人员状态失败: {e}")
+                    continue
+            for person_id, status in current.items():
+                for event, version in list(self._waiters.get(person_id, {}).items()):
+                    if status is None or status["version"] != version:
+                        event.set()
+
+    def _call_in_loop(self, callback, *args):
+        """在事件循环线程中执行 callback（可以在线程池中调用），没有挂起的请求时不执行"""
+        if not self._waiters or self._loop is None:
+            return
+        try:
+            self._loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
+
+    def _wake(self, person_ids: Iterable[int]):
+        """唤醒等待这些人员的请求，可以在线程池中调用"""
+        self._call_in_loop(self._set_waiters, person_ids)
+
+    def _set_waiters(self, person_ids: Iterable[int]):
+        for person_id in person_ids:
+            for event in list(self._waiters.get(person_id, ())):
+                event.set()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._by_fingerprint),
+            "hits": self.hits,
+            "misses": self.misses,
+            "fallbacks": self.fallbacks,
+            "reloads": self.reloads,
+            "waiters": sum(len(waiters) for waiters in self._waiters.values()),
+        }
+
+
+device_cache = DeviceSummaryCache()
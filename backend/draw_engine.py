@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+抽奖引擎
+
+每次抽奖生成一个32字节的随机种子（secrets），用 HMAC-SHA256 计数器模式从种子派生随机数，
+再对候选人ID数组做部分 Fisher–Yates 洗牌，只交换前 k 个位置（O(k)，不打乱整个候选池）。
+
+设置了人员权重或部门名额时改用加权抽取：按部门分组，每组一个树状数组保存累计权重，
+上层再用一个树状数组保存各部门的总权重。每抽出一人只更新两个树状数组（O(log n)），
+部门名额用完时把该部门的总权重置0，不需要重建抽样表。
+
+种子、候选池（压缩为连续ID区间）及其哈希、中奖人员写入只追加的 draw_audits 表，
+任何一轮抽奖都可以根据审计记录重放并校验结果，也可以离线校验：
+
+    python draw_engine.py audit.json    # audit.json 为 GET /api/draws/{audit_id} 的响应
+"""
+
+import hashlib
+import hmac
+import json
+import secrets
+import sys
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from id_ranges import expand_ranges, id_ranges
+
+# 算法标识，写入审计记录；修改抽取算法时需要更换标识并保留旧算法用于重放
+ALGORITHM = "hmac-sha256-ctr/fisher-yates-v1"
+WEIGHTED_ALGORITHM = "hmac-sha256-ctr/fenwick-weighted-v1"
+
+# 权重按千分之一换算为整数，累计权重用整数计算，重放时结果完全一致
+WEIGHT_SCALE = 1000
+
+SEED_BYTES = 32
+
+
+class HmacDrbg:
+    """HMAC-SHA256 计数器模式的确定性随机数生成器（相同种子产生相同序列）"""
+
+    def __init__(self, seed: bytes):
+        self._key = seed
+        self._counter = 0
+        self._buffer = b""
+
+    def _read(self, size: int) -> bytes:
+        while len(self._buffer) < size:
+            block = hmac.new(self._key, self._counter.to_bytes(8, "big"), hashlib.sha256).digest()
+            self._counter += 1
+            self._buffer += block
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def randbelow(self, n: int) -> int:
+        """返回 [0, n) 内均匀分布的整数（拒绝采样，没有取模偏差）"""
+        limit = (1 << 64) - (1 << 64) % n
+        while True:
+            value = int.from_bytes(self._read(8), "big")
+            if value < limit:
+                return value % n
+
+
+def new_seed() -> str:
+    """生成新的随机种子（十六进制）"""
+    return secrets.token_hex(SEED_BYTES)
+
+
+def pool_hash(pool: Sequence[int]) -> str:
+    """候选池的SHA-256（按ID升序，逗号分隔，包含人数）"""
+    digest = hashlib.sha256(f"{len(pool)}:".encode())
+    digest.update(",".join(map(str, pool)).encode())
+    return digest.hexdigest()
+
+
+def sample(pool: Sequence[int], count: int, seed: str) -> List[int]:
+    """
+    按种子从候选池中抽取 count 个不重复的ID
+
+    部分 Fisher–Yates：第 i 步在 [i, n) 中选一个位置与 i 交换。
+    交换过的位置记在字典中，不复制也不修改候选池，时间和内存都是 O(count)。
+
+    Returns:
+        按抽中顺序排列的ID列表
+    """
+    rng = HmacDrbg(bytes.fromhex(seed))
+    n = len(pool)
+    swapped: Dict[int, int] = {}
+    winners: List[int] = []
+    for i in range(min(count, n)):
+        j = i + rng.randbelow(n - i)
+        winners.append(pool[swapped.get(j, j)])
+        swapped[j] = swapped.get(i, i)
+    return winners
+
+
+class FenwickTree:
+    """树状数组：O(n) 建树，O(log n) 修改单项权重和按累计权重查找"""
+
+    def __init__(self, weights: Sequence[int]):
+        self._size = len(weights)
+        self._tree = [0] + list(weights)
+        for i in range(1, self._size + 1):
+            parent = i + (i & -i)
+            if parent <= self._size:
+                self._tree[parent] += self._tree[i]
+        self.total = sum(weights)
+        self._top_bit = 1 << (self._size.bit_length() - 1) if self._size else 0
+
+    def add(self, index: int, delta: int):
+        """第 index 项的权重增加 delta"""
+        self.total += delta
+        i = index + 1
+        while i <= self._size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def find(self, target: int) -> Tuple[int, int]:
+        """
+        查找累计权重超过 target 的第一项
+
+        Returns:
+            (下标, target 减去之前各项权重后的余数)
+        """
+        position = 0
+        step = self._top_bit
+        while step:
+            next_position = position + step
+            if next_position <= self._size and self._tree[next_position] <= target:
+                position = next_position
+                target -= self._tree[next_position]
+            step >>= 1
+        return position, target
+
+
+def _scaled_weight(weight: float) -> int:
+    """把权重换算为整数（小于千分之一的权重视为0）"""
+    return max(int(round(weight * WEIGHT_SCALE)), 0)
+
+
+def _groups(pool: Sequence[int], options: Dict[str, Any]) -> Tuple[List[List[int]], List[List[int]], List[Optional[int]]]:
+    """
+    按审计参数把候选池分组
+
+    Returns:
+        (各组人员ID, 各组整数权重, 各组剩余名额)，没有部门名额时只有一组
+    """
+    # 只换算不为1的权重，其余人员直接使用默认值
+    scaled = {int(pid): _scaled_weight(weight) for pid, weight in (options.get("weights") or {}).items()}
+    departments = options.get("departments") or {}
+    quotas = options.get("quotas") or {}
+    if not departments:
+        names = [""]
+        members = [list(pool)]
+    else:
+        names = sorted(departments)
+        members = [expand_ranges(departments[name]) for name in names]
+    group_weights = [[scaled.get(pid, WEIGHT_SCALE) for pid in ids] for ids in members]
+    group_quotas = [quotas.get(name) for name in names]
+    return members, group_weights, group_quotas
+
+
+def weighted_sample(pool: Sequence[int], count: int, seed: str, options: Dict[str, Any]) -> List[int]:
+    """
+    按种子从候选池中加权抽取 count 个不重复的ID（可按部门限制名额）
+
+    每抽一人只用一个随机数：先在各部门的总权重上查找部门，余数再在部门内查找人员，
+    等价于在整个候选池上按权重抽取。权重为0或所在部门名额已满的人员不会被抽中，
+    可抽的人不足 count 时返回的人数会少于 count。
+    """
+    rng = HmacDrbg(bytes.fromhex(seed))
+    members, weights, remaining = _groups(pool, options)
+    trees = [FenwickTree(group_weights) for group_weights in weights]
+    group_totals = [
+        tree.total if remaining[g] is None or remaining[g] > 0 else 0
+        for g, tree in enumerate(trees)
+    ]
+    top = FenwickTree(group_totals)
+
+    winners: List[int] = []
+    while len(winners) < count and top.total > 0:
+        g, offset = top.find(rng.randbelow(top.total))
+        i, _ = trees[g].find(offset)
+        winners.append(members[g][i])
+
+        weight = weights[g][i]
+        weights[g][i] = 0
+        trees[g].add(i, -weight)
+        if remaining[g] is not None:
+            remaining[g] -= 1
+        # 部门名额用完时整个部门不再参与
+        delta = -group_totals[g] if remaining[g] == 0 else -weight
+        group_totals[g] += delta
+        top.add(g, delta)
+    return winners
+
+
+def draw(
+    pool: Sequence[int],
+    count: int,
+    weights: Optional[Dict[int, float]] = None,
+    departments: Optional[Dict[int, str]] = None,
+    quotas: Optional[Dict[str, int]] = None,
+    exclusions: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    执行一次抽奖，返回写入审计记录所需的字段
+
+    Args:
+        pool: 按ID升序排列的候选人ID列表（已去掉排除的人员）
+        count: 抽取人数
+        weights: 权重不为1的人员 {人员ID: 权重}
+        departments: 人员所属部门 {人员ID: 部门}，设置部门名额时需要
+        quotas: 各部门剩余名额 {部门: 人数}
+        exclusions: 本轮的排除规则，只记录到审计参数中
+    """
+    seed = new_seed()
+    drawn = {
+        "seed": seed,
+        "pool_size": len(pool),
+        "pool_hash": pool_hash(pool),
+        "pool_ranges": id_ranges(pool),
+    }
+    if not weights and not quotas:
+        options = {"exclusions": exclusions} if exclusions else {}
+        return {**drawn, "algorithm": ALGORITHM, "winner_ids": sample(pool, count, seed), "options": options}
+
+    options: Dict[str, Any] = {"weights": {str(pid): weight for pid, weight in (weights or {}).items()}}
+    if quotas:
+        grouped: Dict[str, List[int]] = {}
+        for pid in pool:
+            grouped.setdefault((departments or {}).get(pid, ""), []).append(pid)
+        options["departments"] = {name: id_ranges(ids) for name, ids in grouped.items()}
+        options["quotas"] = {name: max(quota, 0) for name, quota in quotas.items()}
+    if exclusions:
+        options["exclusions"] = exclusions
+    return {
+        **drawn,
+        "algorithm": WEIGHTED_ALGORITHM,
+        "winner_ids": weighted_sample(pool, count, seed, options),
+        "options": options,
+    }
+
+
+def verify(audit: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    根据审计记录重放抽奖，校验候选池和中奖人员
+
+    Returns:
+        {"valid": bool, "pool_valid": bool, "winners_valid": bool, "replayed_winner_ids": [...]}
+    """
+    algorithm = audit.get("algorithm")
+    if algorithm not in (ALGORITHM, WEIGHTED_ALGORITHM):
+        raise ValueError(f"Unsupported draw algorithm: {algorithm}")
+    pool = expand_ranges(audit["pool_ranges"])
+    pool_valid = len(pool) == audit["pool_size"] and pool_hash(pool) == audit["pool_hash"]
+    if algorithm == WEIGHTED_ALGORITHM:
+        replayed = weighted_sample(pool, len(audit["winner_ids"]), audit["seed"], audit.get("options") or {})
+    else:
+        replayed = sample(pool, len(audit["winner_ids"]), audit["seed"])
+    winners_valid = replayed == list(audit["winner_ids"])
+    return {
+        "valid": pool_valid and winners_valid,
+        "pool_valid": pool_valid,
+        "winners_valid": winners_valid,
+        "replayed_winner_ids": replayed,
+    }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("用法: python draw_engine.py audit.json")
+        sys.exit(2)
+    with open(sys.argv[1], encoding="utf-8") as f:
+        result = verify(json.load(f))
+    print(json.dumps(result, ensure_ascii=False))
+    sys.exit(0 if result["valid"] else 1)
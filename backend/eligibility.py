@@ -0,0 +1,127 @@
+"""
+抽奖候选池索引
+
+在内存中维护每个人员的中奖状态，抽奖时直接从索引取出候选人ID，
+避免每一轮都把整张 persons 表序列化给客户端再由客户端筛选。
+"""
+
+import threading
+from typing import Dict, Iterable, List, Set, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database import Person as PersonModel, PersonPrize as PersonPrizeModel
+from table_versions import table_versions
+
+# 索引依赖的表
+_TABLES = ("persons", "person_prizes")
+
+
+class EligibilityIndex:
+    """候选池索引（进程内）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        # 全部人员ID
+        self._all: Set[int] = set()
+        # 未中过任何奖的人员ID
+        self._not_won: Set[int] = set()
+        # 奖项ID -> {人员ID: 中奖次数}
+        self._win_counts: Dict[str, Dict[int, int]] = {}
+        # 人员ID -> 权重（只记录不为1的）
+        self._weights: Dict[int, float] = {}
+        # 人员ID -> 部门
+        self._departments: Dict[int, str] = {}
+        # 加载时的表版本号（多进程共享版本号时，用来发现其他进程的修改）
+        self._versions: Tuple[int, ...] = ()
+
+    def invalidate(self):
+        """标记索引失效，下次使用时从数据库重新加载"""
+        with self._lock:
+            self._loaded = False
+
+    def _load(self, db: Session):
+        """从数据库加载索引（只查询需要的列，不加载头像）"""
+        self._versions = table_versions.snapshot(_TABLES)
+        self._all = set()
+        self._not_won = set()
+        self._win_counts = {}
+        self._weights = {}
+        self._departments = {}
+        rows = db.query(PersonModel.id, PersonModel.is_win, PersonModel.weight, PersonModel.department)
+        for person_id, is_win, weight, department in rows:
+            self._all.add(person_id)
+            if not is_win:
+                self._not_won.add(person_id)
+            if weight is not None and weight != 1:
+                self._weights[person_id] = weight
+            self._departments[person_id] = department or ""
+        win_rows = db.query(
+            PersonPrizeModel.prize_id, PersonPrizeModel.person_id, func.count(PersonPrizeModel.id)
+        ).group_by(PersonPrizeModel.prize_id, PersonPrizeModel.person_id)
+        for prize_id, person_id, times in win_rows:
+            self._win_counts.setdefault(prize_id, {})[person_id] = times
+        self._loaded = True
+
+    def pool(self, db: Session, prize_id: str, is_all: bool, frequency: int = 1) -> List[int]:
+        """
+        获取奖项的候选人ID列表
+
+        Args:
+            db: 数据库会话
+            prize_id: 奖项ID
+            is_all: 是否全员参加（已中过其他奖项的人员也可参与）
+            frequency: 同一人员最多可获得此奖项的次数
+
+        Returns:
+            按ID排序的候选人ID列表
+        """
+        with self._lock:
+            if table_versions.shared and self._loaded and table_versions.snapshot(_TABLES) != self._versions:
+                self._loaded = False
+            if not self._loaded:
+                self._load(db)
+            counts = self._win_counts.get(str(prize_id), {})
+            limit = max(frequency, 1)
+            if is_all:
+                candidates = (pid for pid in self._all if counts.get(pid, 0) < limit)
+            else:
+                candidates = (pid for pid in self._not_won if counts.get(pid, 0) < limit)
+            return sorted(candidates)
+
+    def weights(self, person_ids: Iterable[int]) -> Dict[int, float]:
+        """返回权重不为1的人员及其权重（在 pool() 之后调用）"""
+        with self._lock:
+            return {pid: self._weights[pid] for pid in person_ids if pid in self._weights}
+
+    def departments(self, person_ids: Iterable[int]) -> Dict[int, str]:
+        """返回人员的部门（在 pool() 之后调用）"""
+        with self._lock:
+            return {pid: self._departments.get(pid, "") for pid in person_ids}
+
+    def department_win_counts(self, prize_id: str) -> Dict[str, int]:
+        """奖项在各部门已抽出的人次"""
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for person_id, times in self._win_counts.get(str(prize_id), {}).items():
+                department = self._departments.get(person_id, "")
+                counts[department] = counts.get(department, 0) + times
+            return counts
+
+    def mark_winners(self, person_ids: Iterable[int], prize_id: str):
+        """抽奖事务提交后，把中奖人员同步到索引"""
+        with self._lock:
+            if table_versions.shared:
+                # 版本号已随本次提交变化，下次使用时重新加载
+                self._loaded = False
+            if not self._loaded:
+                return
+            counts = self._win_counts.setdefault(str(prize_id), {})
+            for person_id in person_ids:
+                self._not_won.discard(person_id)
+                counts[person_id] = counts.get(person_id, 0) + 1
+
+
+eligibility_index = EligibilityIndex()
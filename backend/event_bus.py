@@ -0,0 +1,108 @@
+"""
+实时事件推送
+
+进程内的发布/订阅：写接口在事务提交后发布精简的变更事件（只包含变化的字段），
+大屏和手机通过 SSE（GET /api/events）或 WebSocket（/api/ws）订阅，不再需要轮询。
+
+每个订阅者有一个有界队列。事件只序列化一次，再分发给所有订阅者；
+某个订阅者的队列满了（客户端读得太慢）时直接断开它，不拖慢发布者和其他订阅者，
+客户端重连后重新拉取一次完整数据即可。
+"""
+
+import asyncio
+import itertools
+import json
+import os
+import threading
+from typing import Any, Dict, Optional, Set
+
+# 每个订阅者最多积压的事件数
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "256"))
+# 最大订阅者数量
+EVENT_MAX_SUBSCRIBERS = int(os.getenv("EVENT_MAX_SUBSCRIBERS", "2000"))
+# 心跳间隔（秒），用于保持连接和发现已断开的客户端
+EVENT_HEARTBEAT_SECONDS = float(os.getenv("EVENT_HEARTBEAT_SECONDS", "15"))
+
+
+class Subscriber:
+    """一个订阅者（一个SSE或WebSocket连接）"""
+
+    def __init__(self, queue_size: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = False
+
+    def drop(self):
+        """断开读得太慢的订阅者：清空积压的事件，放入结束标记（None）"""
+        self.dropped = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class TooManySubscribers(Exception):
+    """订阅者数量已达上限"""
+
+
+class EventBus:
+    """进程内的事件总线（订阅和分发在事件循环线程中进行，发布可以在任意线程中调用）"""
+
+    def __init__(self, queue_size: int = EVENT_QUEUE_SIZE, max_subscribers: int = EVENT_MAX_SUBSCRIBERS):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self._subscribers: Set[Subscriber] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._seq = itertools.count(1)
+        self._seq_lock = threading.Lock()
+        self.published = 0
+        self.dropped = 0
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self) -> Subscriber:
+        """
+        添加订阅者（在事件循环中调用）
+
+        Raises:
+            TooManySubscribers: 订阅者数量已达上限
+        """
+        if len(self._subscribers) >= self.max_subscribers:
+            raise TooManySubscribers()
+        self._loop = asyncio.get_running_loop()
+        subscriber = Subscriber(self.queue_size)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self._subscribers.discard(subscriber)
+
+    def publish(self, event_type: str, **data: Any):
+        """发布事件（可以在线程池中调用，没有订阅者时不做任何事）"""
+        if not self._subscribers or self._loop is None:
+            return
+        with self._seq_lock:
+            seq = next(self._seq)
+        message = json.dumps({"seq": seq, "type": event_type, **data}, ensure_ascii=False, separators=(",", ":"), default=str)
+        try:
+            self._loop.call_soon_threadsafe(self._dispatch, seq, event_type, message)
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
+
+    def _dispatch(self, seq: int, event_type: str, message: str):
+        self.published += 1
+        item = (seq, event_type, message)
+        for subscriber in list(self._subscribers):
+            try:
+                subscriber.queue.put_nowait(item)
+            except asyncio.QueueFull:
+                self._subscribers.discard(subscriber)
+                subscriber.drop()
+                self.dropped += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {"subscribers": self.subscriber_count, "published": self.published, "dropped": self.dropped}
+
+
+event_bus = EventBus()
@@ -0,0 +1,98 @@
+"""
+HTTP响应缓存
+
+缓存序列化后的JSON响应体，并用基于内容的强ETag响应 If-None-Match 条件请求。
+缓存以所依赖数据表的版本号为准，数据未变化时直接返回缓存（或304），
+不再查询数据库、构造Pydantic对象。
+"""
+
+import hashlib
+import threading
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, Type
+
+from fastapi import Request, Response
+from pydantic import BaseModel, TypeAdapter
+
+from table_versions import table_versions
+
+
+class CachedResponse:
+    """已序列化的响应体及其ETag"""
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+class ResponseCache:
+    """按数据表版本号失效的响应缓存（进程内）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[Tuple[int, ...], CachedResponse]] = {}
+
+    def get_or_build(self, key: str, tables: Iterable[str], build: Callable[[], bytes]) -> CachedResponse:
+        """
+        获取缓存，依赖的表有变化或缓存不存在时调用 build() 重新生成响应体
+
+        Args:
+            key: 缓存键
+            tables: 响应所依赖的表名
+            build: 生成响应体的函数
+        """
+        tables = tuple(tables)
+        # 先取版本号再构建：构建期间有新的提交时，缓存会在下次请求时因版本号不一致而重建
+        version = table_versions.snapshot(tables)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+
+        cached = CachedResponse(build())
+        with self._lock:
+            self._entries[key] = (version, cached)
+        return cached
+
+    async def aget_or_build(self, key: str, tables: Iterable[str], build: Callable[[], Awaitable[bytes]]) -> CachedResponse:
+        """get_or_build 的异步版本，build 为返回响应体的协程函数"""
+        tables = tuple(tables)
+        version = await table_versions.asnapshot(tables)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+
+        cached = CachedResponse(await build())
+        with self._lock:
+            self._entries[key] = (version, cached)
+        return cached
+
+
+response_cache = ResponseCache()
+
+_list_adapters: Dict[Type[BaseModel], TypeAdapter] = {}
+
+
+def serialize_list(model: Type[BaseModel], items: List[Any]) -> bytes:
+    """把ORM对象列表按Pydantic模型序列化为JSON"""
+    adapter = _list_adapters.get(model)
+    if adapter is None:
+        adapter = _list_adapters[model] = TypeAdapter(List[model])
+    return adapter.dump_json(adapter.validate_python(items, from_attributes=True))
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """检查请求的 If-None-Match 是否与ETag匹配"""
+    header: Optional[str] = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [item.strip() for item in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def cached_json_response(request: Request, cached: CachedResponse) -> Response:
+    """根据条件请求返回304或缓存的JSON响应体"""
+    headers = {"ETag": cached.etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, cached.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=cached.body, media_type="application/json", headers=headers)
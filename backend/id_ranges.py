@@ -0,0 +1,38 @@
+"""
+ID区间工具
+
+把ID列表压缩为连续区间 [[起始, 结束], ...] 及其逆操作。只依赖标准库，
+离线校验抽奖结果（python draw_engine.py audit.json）时不需要加载数据库和Web框架。
+"""
+
+from typing import List
+
+
+def id_ranges(ids: List[int]) -> List[List[int]]:
+    """把ID列表压缩为连续区间"""
+    ranges: List[List[int]] = []
+    for person_id in sorted(ids):
+        if ranges and person_id == ranges[-1][1] + 1:
+            ranges[-1][1] = person_id
+        else:
+            ranges.append([person_id, person_id])
+    return ranges
+
+
+def expand_ranges(ranges: List[List[int]]) -> List[int]:
+    """把连续ID区间展开为ID列表"""
+    pool: List[int] = []
+    for start, end in ranges:
+        pool.extend(range(start, end + 1))
+    return pool
+
+
+def merge_ranges(ranges: List[List[int]]) -> List[List[int]]:
+    """合并重叠或相邻的ID区间"""
+    merged: List[List[int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
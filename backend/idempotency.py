@@ -0,0 +1,303 @@
+"""
+幂等请求（Idempotency-Key）
+
+客户端在写请求（POST / PUT / PATCH / DELETE）上带 Idempotency-Key 请求头，
+第一次请求正常执行，响应（状态码、响应头、响应体）按 key 保存在有界的TTL缓存中；
+网络不稳定导致客户端重试时，直接返回保存的响应（带 Idempotent-Replayed: true），
+不再执行接口、不访问数据库，也不会重复处理图片。
+
+- 同一个 key 用于内容不同的请求（方法、路径、查询参数或请求体不同）时返回 422；
+- 同一个 key 的请求还在执行时再次请求返回 409；
+- 只保存 2xx 和不可重试的 4xx 响应；5xx、408/409/425/429（稍后重试可能成功，如上传排队已满、
+  奖项版本冲突）和超过大小上限的响应不保存，重试时会重新执行；
+- 流式导入（POST /api/persons/import）不经过这里，请求体超过 IDEMPOTENCY_MAX_REQUEST_BYTES 时
+  也不再缓冲，直接交给接口执行（不做幂等处理）。
+
+设置 IDEMPOTENCY_DB=true 时响应还会保存到数据库的 idempotency_keys 表中，
+进程重启后或多进程部署时也能识别重试；进程内缓存未命中时才查询数据库。
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Set
+
+from sqlalchemy import delete, select
+
+from database import AsyncSessionLocal, IdempotencyKey as IdempotencyKeyModel
+from db_config import upsert_insert
+
+# 保存响应的时间（秒）
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+# 进程内最多保存的响应数
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "1000"))
+# 超过该大小的响应体不保存（字节）
+IDEMPOTENCY_MAX_BODY_BYTES = int(os.getenv("IDEMPOTENCY_MAX_BODY_BYTES", str(1024 * 1024)))
+# 超过该大小的请求体不缓冲、不做幂等处理（字节）
+IDEMPOTENCY_MAX_REQUEST_BYTES = int(os.getenv("IDEMPOTENCY_MAX_REQUEST_BYTES", str(16 * 1024 * 1024)))
+# 是否同时保存到数据库
+IDEMPOTENCY_DB = os.getenv("IDEMPOTENCY_DB", "false").lower() in ("1", "true", "yes")
+
+IDEMPOTENCY_HEADER = b"idempotency-key"
+MAX_KEY_LENGTH = 255
+MUTATING_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+# 稍后重试可能成功的4xx，不保存
+RETRYABLE_STATUS = {408, 409, 425, 429}
+# 流式读取请求体的接口（缓冲整个请求体会失去流式处理的意义）
+STREAMING_PATHS = {"/api/persons/import"}
+# 每保存多少条响应清理一次数据库中过期的记录
+_PURGE_EVERY = 200
+
+
+def _storable(status_code: int) -> bool:
+    """是否保存该状态码的响应：2xx 和不可重试的 4xx"""
+    if 200 <= status_code < 300:
+        return True
+    return 400 <= status_code < 500 and status_code not in RETRYABLE_STATUS
+
+
+class StoredResponse(NamedTuple):
+    """保存的响应"""
+    fingerprint: str
+    status_code: int
+    headers: List[List[str]]
+    body: bytes
+    expires_at: float
+
+
+class IdempotencyStore:
+    """按 Idempotency-Key 保存响应的TTL + LRU缓存（可选数据库持久化）"""
+
+    def __init__(
+        self,
+        max_entries: int = IDEMPOTENCY_MAX_ENTRIES,
+        ttl: float = IDEMPOTENCY_TTL_SECONDS,
+        use_database: bool = IDEMPOTENCY_DB,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.use_database = use_database
+        self._entries: "OrderedDict[str, StoredResponse]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: str) -> Optional[StoredResponse]:
+        """获取未过期的响应"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= now:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None and self.use_database:
+            entry = await self._load(key, now)
+            if entry is not None:
+                self._remember(key, entry)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    async def put(self, key: str, entry: StoredResponse):
+        """保存响应"""
+        self._remember(key, entry)
+        if self.use_database:
+            await self._save(key, entry)
+
+    def _remember(self, key: str, entry: StoredResponse):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def _load(self, key: str, now: float) -> Optional[StoredResponse]:
+        async with AsyncSessionLocal() as db:
+            record = await db.scalar(
+                select(IdempotencyKeyModel).where(
+                    IdempotencyKeyModel.key == key, IdempotencyKeyModel.expires_at > now
+                )
+            )
+            if record is None:
+                return None
+            return StoredResponse(
+                record.fingerprint, record.status_code, record.headers or [], record.body or b"", record.expires_at
+            )
+
+    async def _save(self, key: str, entry: StoredResponse):
+        async with AsyncSessionLocal() as db:
+            values = entry._asdict()
+            stmt = upsert_insert(db, IdempotencyKeyModel.__table__).values(key=key, **values)
+            await db.execute(stmt.on_conflict_do_update(index_elements=["key"], set_=values))
+            self._puts += 1
+            if self._puts % _PURGE_EVERY == 0:
+                await db.execute(delete(IdempotencyKeyModel).where(IdempotencyKeyModel.expires_at <= time.time()))
+            await db.commit()
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+idempotency_store = IdempotencyStore()
+
+
+def _fingerprint(scope, body: bytes) -> str:
+    """请求的指纹：方法、路径、查询参数和请求体"""
+    content_type = next((value for name, value in scope["headers"] if name == b"content-type"), b"")
+    if content_type.startswith(b"multipart/form-data") and b"boundary=" in content_type:
+        # 客户端每次请求生成的 multipart 分隔符不同，计算指纹时去掉
+        boundary = content_type.split(b"boundary=", 1)[1].split(b";", 1)[0].strip(b'"')
+        if boundary:
+            body = body.replace(boundary, b"")
+    digest = hashlib.sha256()
+    digest.update(scope["method"].encode())
+    digest.update(b" " + scope["path"].encode())
+    digest.update(b"?" + scope.get("query_string", b""))
+    digest.update(b"\n" + body)
+    return digest.hexdigest()
+
+
+async def _send_json(send, status_code: int, detail: str):
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status_code,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def _replay(chunks: List[bytes], receive):
+    """先返回已读取的请求体分块，再继续读取剩余部分"""
+    pending = list(chunks)
+
+    async def replay_receive():
+        if pending:
+            return {"type": "http.request", "body": pending.pop(0), "more_body": True}
+        return await receive()
+
+    return replay_receive
+
+
+class IdempotencyMiddleware:
+    """带 Idempotency-Key 的写请求：保存第一次的响应，重试时直接返回"""
+
+    def __init__(self, app, store: IdempotencyStore = idempotency_store):
+        self.app = app
+        self.store = store
+        # 正在执行的 key（进程内）
+        self._in_flight: Set[str] = set()
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] not in MUTATING_METHODS
+            or scope["path"] in STREAMING_PATHS
+        ):
+            await self.app(scope, receive, send)
+            return
+        key = next((value for name, value in scope["headers"] if name == IDEMPOTENCY_HEADER), None)
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+        key = key.decode("latin-1").strip()
+        if not key or len(key) > MAX_KEY_LENGTH:
+            await _send_json(send, 400, f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters")
+            return
+
+        content_length = next((value for name, value in scope["headers"] if name == b"content-length"), b"")
+        if content_length.isdigit() and int(content_length) > IDEMPOTENCY_MAX_REQUEST_BYTES:
+            await self.app(scope, receive, send)
+            return
+
+        # 读取完整的请求体用于计算指纹，之后再交给接口；超过上限时（分块传输）停止缓冲
+        chunks = []
+        size = 0
+        complete = False
+        while size <= IDEMPOTENCY_MAX_REQUEST_BYTES:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunk = message.get("body", b"")
+            chunks.append(chunk)
+            size += len(chunk)
+            if not message.get("more_body", False):
+                complete = True
+                break
+        if not complete:
+            await self.app(scope, _replay(chunks, receive), send)
+            return
+        body = b"".join(chunks)
+        fingerprint = _fingerprint(scope, body)
+
+        stored = await self.store.get(key)
+        if stored is not None:
+            if stored.fingerprint != fingerprint:
+                await _send_json(send, 422, "Idempotency-Key was already used for a different request")
+                return
+            await send({
+                "type": "http.response.start",
+                "status": stored.status_code,
+                "headers": [(name.encode("latin-1"), value.encode("latin-1")) for name, value in stored.headers]
+                + [(b"idempotent-replayed", b"true")],
+            })
+            await send({"type": "http.response.body", "body": stored.body})
+            return
+
+        if key in self._in_flight:
+            await _send_json(send, 409, "A request with this Idempotency-Key is still in progress")
+            return
+
+        body_sent = False
+
+        async def replay_receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        response = {"status": None, "headers": [], "body": [], "size": 0, "complete": False}
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = [
+                    [name.decode("latin-1"), value.decode("latin-1")] for name, value in message.get("headers", [])
+                ]
+            elif message["type"] == "http.response.body":
+                chunk = message.get("body", b"")
+                response["size"] += len(chunk)
+                if response["size"] <= IDEMPOTENCY_MAX_BODY_BYTES:
+                    response["body"].append(chunk)
+                if not message.get("more_body", False):
+                    response["complete"] = True
+            await send(message)
+
+        self._in_flight.add(key)
+        try:
+            await self.app(scope, replay_receive, capture_send)
+        finally:
+            self._in_flight.discard(key)
+
+        if (
+            response["complete"]
+            and response["status"] is not None
+            and _storable(response["status"])
+            and response["size"] <= IDEMPOTENCY_MAX_BODY_BYTES
+        ):
+            await self.store.put(key, StoredResponse(
+                fingerprint,
+                response["status"],
+                response["headers"],
+                b"".join(response["body"]),
+                time.time() + self.store.ttl,
+            ))
@@ -1,26 +1,16 @@
 import hashlib
 import os
 from io import BytesIO
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 
-from PIL import Image
+from PIL import Image, ImageOps
 
 
 UPLOAD_DIR = "uploads"
 MAX_WIDTH = 800
 MAX_HEIGHT = 800
 QUALITY = 75
-
-
-def ensure_upload_dir():
-    """确保上传目录存在"""
-    if not os.path.exists(UPLOAD_DIR):
-        os.makedirs(UPLOAD_DIR)
-
-
-def calculate_md5(file_content: bytes) -> str:
-    """计算文件的MD5值"""
-    return hashlib.md5(file_content).hexdigest()
+THUMBNAIL_SIZE = (200, 200)  # 缩略图尺寸
 
 
 def process_image(file_content: bytes, max_width: int = MAX_WIDTH, max_height: int = MAX_HEIGHT, quality: int = QUALITY) -> Tuple[bytes, str]:
@@ -59,9 +49,118 @@ def process_image(file_content: bytes, max_width: int = MAX_WIDTH, max_height: i
     return processed_content, ext
 
 
+def generate_thumbnail(image_path: str, thumbnail_path: str, size: tuple = THUMBNAIL_SIZE) -> str:
+    """生成图片缩略图（可在图片处理进程池中执行）"""
+    try:
+        with Image.open(image_path) as img:
+            # 转换为 RGB 模式（如果原图是 RGBA）
+            if img.mode == 'RGBA':
+                img = img.convert('RGB')
+            # 生成缩略图
+            img.thumbnail(size, Image.Resampling.LANCZOS)
+            # 保存缩略图
+            img.save(thumbnail_path, 'JPEG', quality=85)
+        return thumbnail_path
+    except Exception as e:
+        print(f"生成缩略图失败: {e}")
+        return ""
+
+
+def render_variant(source_path: str, target_path: str, width: int, height: int, image_format: str, quality: int, crop: bool = False) -> str:
+    """
+    生成指定尺寸和格式的图片变体（可在图片处理进程池中执行）
+
+    Args:
+        source_path: 原图路径
+        target_path: 变体保存路径
+        width: 最大宽度
+        height: 最大高度
+        image_format: 输出格式（WEBP / AVIF / JPEG）
+        quality: 图片质量(1-100)
+        crop: 是否裁剪为 width x height（卡片），否则等比缩放到不超过该尺寸
+
+    Returns:
+        变体保存路径
+    """
+    with Image.open(source_path) as img:
+        # 按EXIF方向旋转，避免手机照片方向错误
+        img = ImageOps.exif_transpose(img)
+        if image_format == "JPEG" and img.mode != "RGB":
+            img = img.convert("RGB")
+        elif img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA")
+        if crop:
+            img = ImageOps.fit(img, (width, height), Image.Resampling.LANCZOS)
+        else:
+            img.thumbnail((width, height), Image.Resampling.LANCZOS)
+        # 先写临时文件再替换，避免并发请求读到写了一半的文件
+        temp_path = f"{target_path}.{os.getpid()}.tmp"
+        img.save(temp_path, image_format, quality=quality)
+    os.replace(temp_path, target_path)
+    return target_path
+
+
+def render_atlas_sheet(
+    base_path: Optional[str],
+    target_dir: str,
+    prefix: str,
+    sheet_size: int,
+    cell_size: int,
+    cells: List[Tuple[int, Optional[str]]],
+    quality: int = 85,
+) -> Tuple[str, List[int]]:
+    """
+    在图集上重绘指定格子（可在图片处理进程池中执行）
+
+    Args:
+        base_path: 上一版图集路径，None 时从空白图集开始
+        target_dir: 图集保存目录
+        prefix: 图集文件名前缀
+        sheet_size: 图集边长
+        cell_size: 格子边长
+        cells: [(格子序号, 图片路径)]，图片路径为 None 表示清空该格子
+        quality: WebP 质量(1-100)
+
+    Returns:
+        (图集文件名（按内容哈希命名）, 图片无法读取的格子序号)
+    """
+    if base_path and os.path.isfile(base_path):
+        with Image.open(base_path) as base:
+            sheet = base.convert("RGBA")
+    else:
+        sheet = Image.new("RGBA", (sheet_size, sheet_size), (0, 0, 0, 0))
+
+    columns = sheet_size // cell_size
+    empty = Image.new("RGBA", (cell_size, cell_size), (0, 0, 0, 0))
+    failed = []
+    for slot, source_path in cells:
+        position = ((slot % columns) * cell_size, (slot // columns) * cell_size)
+        sheet.paste(empty, position)
+        if source_path is None:
+            continue
+        try:
+            with Image.open(source_path) as img:
+                img = ImageOps.exif_transpose(img).convert("RGBA")
+                sheet.paste(ImageOps.fit(img, (cell_size, cell_size), Image.Resampling.LANCZOS), position)
+        except Exception:
+            failed.append(slot)
+
+    buffer = BytesIO()
+    sheet.save(buffer, "WEBP", quality=quality)
+    content = buffer.getvalue()
+    filename = f"{prefix}_{hashlib.sha256(content).hexdigest()[:16]}.webp"
+    temp_path = os.path.join(target_dir, f"{filename}.{os.getpid()}.tmp")
+    with open(temp_path, "wb") as f:
+        f.write(content)
+    os.replace(temp_path, os.path.join(target_dir, filename))
+    return filename, failed
+
+
 def save_image(file_content: bytes, max_width: int = MAX_WIDTH, max_height: int = MAX_HEIGHT, quality: int = QUALITY) -> str:
     """
-    处理并保存图片到文件目录
+    处理并保存图片到内容寻址存储（upload_store）
+
+    相同的原始图片只处理、保存一次，再次保存时直接复用并增加引用计数。
     
     Args:
         file_content: 图片二进制内容
@@ -70,51 +169,56 @@ def save_image(file_content: bytes, max_width: int = MAX_WIDTH, max_height: int
         quality: 图片质量(1-100)
     
     Returns:
-        md5文件名（不含扩展名）
+        文件名（SHA-256 + 扩展名）
     """
-    ensure_upload_dir()
-    
-    # 处理图片
-    processed_content, ext = process_image(file_content, max_width, max_height, quality)
-    
-    # 计算MD5
-    md5_hash = calculate_md5(processed_content)
-    
-    # 检查文件是否已存在
-    file_path = os.path.join(UPLOAD_DIR, f"{md5_hash}.{ext}")
-    if not os.path.exists(file_path):
-        # 保存文件
-        with open(file_path, "wb") as f:
-            f.write(processed_content)
-    
-    return f"{md5_hash}.{ext}"
+    # 延迟导入：图片处理进程池只需要本模块中的纯PIL函数，不需要加载数据库
+    from database import SessionLocal
+    from upload_store import put_bytes
+
+    def transform(content: bytes) -> Tuple[bytes, str]:
+        processed_content, ext = process_image(content, max_width, max_height, quality)
+        return processed_content, f".{ext}"
 
+    db = SessionLocal()
+    try:
+        blob = put_bytes(db, file_content, "", transform)
+        filename = blob.filename
+        db.commit()
+        return filename
+    finally:
+        db.close()
 
-def get_image_path(md5_filename: str) -> str:
+
+def get_image_path(filename: str) -> str:
     """
     获取图片的完整路径
     
     Args:
-        md5_filename: MD5文件名（如：abc123.jpg）
+        filename: 文件名（如：abc123.jpg）
     
     Returns:
         图片的完整路径
     """
-    return os.path.join(UPLOAD_DIR, md5_filename)
+    return os.path.join(UPLOAD_DIR, filename)
 
 
-def delete_image(md5_filename: str) -> bool:
+def delete_image(filename: str) -> bool:
     """
-    删除图片文件
+    释放图片的一次引用，没有引用且没有图片、人员或奖项使用时删除文件（先删除使用它的行再调用）
     
     Args:
-        md5_filename: MD5文件名
+        filename: 文件名
     
     Returns:
-        是否删除成功
+        文件是否已被删除
     """
-    file_path = get_image_path(md5_filename)
-    if os.path.exists(file_path):
-        os.remove(file_path)
-        return True
-    return False
+    from database import SessionLocal
+    from upload_store import release
+
+    db = SessionLocal()
+    try:
+        deleted = release(db, filename)
+        db.commit()
+        return deleted
+    finally:
+        db.close()
@@ -0,0 +1,109 @@
+"""
+图片多尺寸变体
+
+按用途为上传的图片生成不同尺寸的变体（thumb / card / full），或按 ?w= 指定宽度生成，
+输出 WebP / AVIF 等压缩格式。变体在第一次请求时在图片处理进程池中生成，并缓存在磁盘上。
+card 变体的尺寸取自全局配置中的 card_width / card_height。
+"""
+
+import os
+from typing import Optional, Tuple
+
+from PIL import features
+
+from image_utils import render_variant
+from image_worker import image_pool
+
+UPLOAD_DIR = "uploads"
+VARIANT_DIR = os.path.join(UPLOAD_DIR, "variants")
+
+# 各变体的最大尺寸；card 使用全局配置的卡片尺寸
+VARIANT_SIZES = {
+    "thumb": (200, 200),
+    "full": (1600, 1600),
+}
+# card 变体按卡片尺寸的倍数输出，适配高分屏
+CARD_SCALE = int(os.getenv("IMAGE_CARD_SCALE", "2"))
+
+# ?w= 可选的宽度档位，实际宽度向上取到最近的档位，避免缓存无限增长
+WIDTH_BUCKETS = (64, 128, 200, 256, 320, 400, 640, 800, 1280, 1600)
+
+FORMAT_QUALITY = {"webp": 80, "avif": 60, "jpeg": 85}
+FORMAT_MEDIA_TYPES = {"webp": "image/webp", "avif": "image/avif", "jpeg": "image/jpeg"}
+
+
+def _avif_supported() -> bool:
+    try:
+        return bool(features.check("avif"))
+    except Exception:
+        return False
+
+
+AVIF_SUPPORTED = _avif_supported()
+
+if not os.path.exists(VARIANT_DIR):
+    os.makedirs(VARIANT_DIR)
+
+
+def negotiate_format(requested: Optional[str], accept: str) -> str:
+    """根据 ?format= 参数或 Accept 请求头选择输出格式"""
+    if requested:
+        if requested == "avif" and not AVIF_SUPPORTED:
+            return "webp"
+        return requested
+    if AVIF_SUPPORTED and "image/avif" in accept:
+        return "avif"
+    if "image/webp" in accept:
+        return "webp"
+    return "jpeg"
+
+
+def snap_width(width: int) -> int:
+    """把请求的宽度向上取到最近的档位"""
+    for bucket in WIDTH_BUCKETS:
+        if width <= bucket:
+            return bucket
+    return WIDTH_BUCKETS[-1]
+
+
+def variant_size(variant: Optional[str], width: Optional[int], card_size: Tuple[int, int]) -> Tuple[str, int, int, bool]:
+    """
+    计算变体尺寸
+
+    Returns:
+        (变体标识, 宽, 高, 是否裁剪)
+    """
+    if width is not None:
+        width = snap_width(width)
+        return f"w{width}", width, width * 4, False
+    if variant == "card":
+        card_width, card_height = card_size
+        return f"card{card_width}x{card_height}", card_width * CARD_SCALE, card_height * CARD_SCALE, True
+    max_width, max_height = VARIANT_SIZES[variant or "thumb"]
+    return variant or "thumb", max_width, max_height, False
+
+
+def variant_url(filename: str, variant: str) -> str:
+    return f"/api/media/variants/{filename}?variant={variant}"
+
+
+async def get_variant(filename: str, key: str, width: int, height: int, crop: bool, image_format: str) -> str:
+    """
+    获取变体文件路径，不存在时在进程池中生成
+
+    Raises:
+        FileNotFoundError: 原图不存在
+        PoolSaturated: 图片处理进程池排队已满
+    """
+    source_path = os.path.join(UPLOAD_DIR, filename)
+    if not os.path.isfile(source_path):
+        raise FileNotFoundError(filename)
+    stem = os.path.splitext(filename)[0]
+    ext = "jpg" if image_format == "jpeg" else image_format
+    target_path = os.path.join(VARIANT_DIR, f"{stem}_{key}.{ext}")
+    if not os.path.exists(target_path):
+        await image_pool.run(
+            render_variant, source_path, target_path, width, height,
+            image_format.upper(), FORMAT_QUALITY[image_format], crop,
+        )
+    return target_path
@@ -0,0 +1,78 @@
+"""
+图片处理进程池
+
+图片解码、缩放和编码都是CPU密集型操作，放在事件循环中执行会阻塞所有请求。
+这里把这些操作提交到有界的进程池中执行，并限制排队数量：队列已满时直接拒绝，
+由接口返回429让客户端稍后重试，而不是无限堆积。
+"""
+
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Optional
+
+# 进程池大小
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", str(min(os.cpu_count() or 2, 4))))
+# 最大排队任务数（包括正在执行的任务）
+IMAGE_MAX_PENDING = int(os.getenv("IMAGE_MAX_PENDING", str(IMAGE_WORKERS * 4)))
+
+
+class PoolSaturated(Exception):
+    """进程池排队已满"""
+
+
+class ImageWorkerPool:
+    """有界的图片处理进程池（只在事件循环线程中使用）"""
+
+    def __init__(self, max_workers: int = IMAGE_WORKERS, max_pending: int = IMAGE_MAX_PENDING):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def saturated(self) -> bool:
+        return self.pending >= self.max_pending
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """
+        在进程池中执行函数
+
+        Raises:
+            PoolSaturated: 排队任务数已达上限
+        """
+        if self.saturated:
+            raise PoolSaturated()
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self.pending -= 1
+
+    async def run_batch_job(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """
+        在进程池中执行内部批量任务（如重绘图集）
+
+        不受排队上限限制，不会因为上传请求多而失败；调用方需要自行限制同时提交的任务数
+        （不超过 max_workers），给请求留出排队空间。
+        """
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+image_pool = ImageWorkerPool()
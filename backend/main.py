@@ -1,8 +1,13 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from database import init_db
-from routers import persons, prizes, config, media, departments
+from database import init_db, engine, async_engine
+from db_config import log_engine_config
+from device_cache import device_cache
+from idempotency import IdempotencyMiddleware
+from image_worker import image_pool
+from migrate_db import upgrade_schema
+from routers import persons, prizes, config, media, departments, system, events, draws
 import os
 
 # 创建FastAPI应用
@@ -12,6 +17,9 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# 带 Idempotency-Key 的写请求重试时直接返回第一次的响应（在CORS之内，重放的响应同样带CORS头）
+app.add_middleware(IdempotencyMiddleware)
+
 # 配置CORS
 app.add_middleware(
     CORSMiddleware,
@@ -27,6 +35,9 @@ app.include_router(prizes.router)
 app.include_router(config.router)
 app.include_router(media.router)
 app.include_router(departments.router)
+app.include_router(system.router)
+app.include_router(events.router)
+app.include_router(draws.router)
 
 
 # 挂载静态文件服务
@@ -41,6 +52,18 @@ app.mount("/api/uploads", StaticFiles(directory=UPLOAD_DIR), name="api_uploads")
 async def startup_event():
     """应用启动时初始化数据库"""
     init_db()
+    # 补齐旧数据库缺少的列（升级后不需要先手动运行 migrate_db.py）
+    upgrade_schema()
+    log_engine_config(engine)
+    # 预热设备指纹缓存，揭晓时手机端的轮询不访问数据库
+    await device_cache.load()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭时停止图片处理进程池并关闭异步数据库连接"""
+    image_pool.shutdown()
+    await async_engine.dispose()
 
 
 @app.get("/")
@@ -2,53 +2,35 @@
 数据迁移脚本：将base64头像转换为URL
 
 此脚本会：
-1. 读取数据库中所有人员记录
-2. 检查avatar字段是否是base64格式（以"data:image"开头）
-3. 如果是base64，将其转换为文件并上传到服务器
-4. 更新数据库中的avatar和thumbnail_avatar字段为URL
+1. 按 id 分块读取 avatar 字段为base64格式（以"data:image"开头）的人员记录
+2. 在进程池中并行解码base64、保存文件并生成缩略图（内容寻址存储，相同头像只保存一份）
+3. 每处理完一块就更新数据库中的avatar和thumbnail_avatar字段为URL并提交
+4. 每块提交后写入检查点，中断后再次运行会从检查点继续
 
 使用方法：
     python migrate_avatar_to_url.py
+    python migrate_avatar_to_url.py --yes --workers 8 --batch-size 500
+    python migrate_avatar_to_url.py --yes --restart   # 忽略检查点，从头开始
 """
 
 import os
 import sys
+import time
 import base64
-import uuid
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from PIL import Image as PILImage
-import io
+
+from sqlalchemy import update
 
 # 添加backend目录到Python路径
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 from database import SessionLocal, Person
+from upload_store import write_blob, register, file_url, thumbnail_url
 
-UPLOAD_DIR = "uploads"
-THUMBNAIL_DIR = os.path.join(UPLOAD_DIR, "thumbnails")
-THUMBNAIL_SIZE = (200, 200)  # 缩略图尺寸
-
-# 确保上传目录存在
-for dir_path in [UPLOAD_DIR, THUMBNAIL_DIR]:
-    if not os.path.exists(dir_path):
-        os.makedirs(dir_path)
-
-
-def generate_thumbnail(image_path: str, thumbnail_path: str, size: tuple = THUMBNAIL_SIZE) -> str:
-    """生成图片缩略图"""
-    try:
-        with PILImage.open(image_path) as img:
-            # 转换为 RGB 模式（如果原图是 RGBA）
-            if img.mode == 'RGBA':
-                img = img.convert('RGB')
-            # 生成缩略图
-            img.thumbnail(size, PILImage.Resampling.LANCZOS)
-            # 保存缩略图
-            img.save(thumbnail_path, 'JPEG', quality=85)
-        return thumbnail_path
-    except Exception as e:
-        print(f"生成缩略图失败: {e}")
-        return ""
+# 检查点文件：记录最后一个已提交分块的人员ID
+CHECKPOINT_FILE = "migrate_avatar_to_url.checkpoint"
 
 
 def is_base64_image(data: str) -> bool:
@@ -58,121 +40,142 @@ def is_base64_image(data: str) -> bool:
     return data.startswith("data:image/")
 
 
-def base64_to_file(base64_data: str) -> tuple[str, str]:
+def decode_base64_image(base64_data: str) -> tuple[bytes, str]:
     """
-    将base64图片数据保存为文件
-    返回：(文件路径, 文件扩展名)
+    解码base64图片数据
+    返回：(图片内容, 文件扩展名)
     """
     # 提取base64数据部分
     if "," in base64_data:
         header, data = base64_data.split(",", 1)
     else:
-        data = base64_data
+        header, data = "", base64_data
 
     # 解析图片类型
-    if "image/jpeg" in base64_data or "image/jpg" in base64_data:
+    if "image/jpeg" in header or "image/jpg" in header:
         ext = ".jpg"
-    elif "image/png" in base64_data:
+    elif "image/png" in header:
         ext = ".png"
-    elif "image/webp" in base64_data:
+    elif "image/webp" in header:
         ext = ".webp"
     else:
         ext = ".jpg"  # 默认使用jpg
 
-    # 生成唯一文件名
-    filename = f"{uuid.uuid4()}{ext}"
-    file_path = os.path.join(UPLOAD_DIR, filename)
-
-    # 解码base64并保存文件
-    image_data = base64.b64decode(data)
-    with open(file_path, "wb") as f:
-        f.write(image_data)
+    image_data = base64.b64decode(data, validate=True)
+    if not image_data:
+        raise ValueError("empty image data")
+    return image_data, ext
 
-    return file_path, ext
 
-
-def process_avatar(person: Person) -> bool:
+def process_avatar(person_id: int, avatar_value: str) -> tuple:
     """
-    处理单个人员的头像
-    返回：是否成功处理
+    处理单个人员的头像（在工作进程中执行，不访问数据库）
+    返回：(人员ID, write_blob 的结果或 None, 错误信息或 None)
     """
     try:
-        # 检查avatar是否是base64
-        avatar_value = str(person.avatar) if person.avatar else ""
-        if not is_base64_image(avatar_value):
-            print(f"  跳过: {person.name} - avatar已经是URL格式")
-            return False
-
-        print(f"  处理: {person.name}")
-
-        # 将base64转换为文件
-        file_path, ext = base64_to_file(avatar_value)
-        print(f"    保存文件: {file_path}")
-
-        # 生成缩略图
-        thumbnail_filename = f"thumb_{os.path.basename(file_path)}"
-        thumbnail_path = os.path.join(THUMBNAIL_DIR, thumbnail_filename)
-        generate_thumbnail(file_path, thumbnail_path)
-        print(f"    生成缩略图: {thumbnail_path}")
+        image_data, ext = decode_base64_image(avatar_value)
+        return person_id, write_blob(image_data, ext), None
+    except Exception as e:
+        return person_id, None, str(e)
 
-        # 更新数据库
-        person.avatar = f"/api/uploads/{os.path.basename(file_path)}"
-        person.thumbnail_avatar = f"/api/uploads/thumbnails/{thumbnail_filename}"
-        person.update_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-        print(f"    更新数据库:")
-        print(f"      avatar: {person.avatar}")
-        print(f"      thumbnail_avatar: {person.thumbnail_avatar}")
+def read_checkpoint() -> int:
+    """读取检查点，没有检查点时返回0"""
+    if not os.path.exists(CHECKPOINT_FILE):
+        return 0
+    with open(CHECKPOINT_FILE) as f:
+        return int(f.read().strip() or 0)
 
-        return True
 
-    except Exception as e:
-        print(f"  错误: {person.name} - {str(e)}")
-        return False
+def write_checkpoint(last_id: int):
+    """原子地写入检查点"""
+    temp_file = f"{CHECKPOINT_FILE}.tmp"
+    with open(temp_file, "w") as f:
+        f.write(str(last_id))
+    os.replace(temp_file, CHECKPOINT_FILE)
 
 
-def migrate():
+def migrate(workers: int = os.cpu_count() or 2, batch_size: int = 200, restart: bool = False):
     """执行数据迁移"""
     print("=" * 60)
     print("开始迁移base64头像到URL")
     print("=" * 60)
 
+    last_id = 0 if restart else read_checkpoint()
+    if last_id:
+        print(f"\n从检查点继续：人员ID > {last_id}")
+
     db = SessionLocal()
+    processed = 0
+    errors = 0
+    bytes_read = 0
+    start = time.perf_counter()
 
     try:
-        # 获取所有人员
-        persons = db.query(Person).all()
-        total = len(persons)
-        print(f"\n找到 {total} 条人员记录\n")
-
-        processed = 0
-        skipped = 0
-        errors = 0
-
-        for i, person in enumerate(persons, 1):
-            print(f"[{i}/{total}] {person.name}:")
-
-            if process_avatar(person):
-                processed += 1
-            else:
-                skipped += 1
-
-            print()
-
-        # 提交更改
-        db.commit()
-
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            while True:
+                # 按 id 游标分块读取，内存中最多只有一块的base64数据
+                chunk = (
+                    db.query(Person.id, Person.name, Person.avatar)
+                    .filter(Person.id > last_id, Person.avatar.like("data:image/%"))
+                    .order_by(Person.id)
+                    .limit(batch_size)
+                    .all()
+                )
+                if not chunk:
+                    break
+
+                names = {person_id: name for person_id, name, _ in chunk}
+                bytes_read += sum(len(avatar) for _, _, avatar in chunk)
+                now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                updates = []
+                results = executor.map(
+                    process_avatar,
+                    [person_id for person_id, _, _ in chunk],
+                    [avatar for _, _, avatar in chunk],
+                )
+                for person_id, stored, error in results:
+                    if error is not None:
+                        errors += 1
+                        print(f"  错误: [{person_id}] {names[person_id]} - {error}")
+                        continue
+                    blob = register(db, *stored)
+                    updates.append({
+                        "id": person_id,
+                        "avatar": file_url(blob.filename),
+                        "thumbnail_avatar": thumbnail_url(blob.thumbnail_filename),
+                        "update_time": now,
+                    })
+
+                if updates:
+                    db.execute(update(Person), updates)
+                db.commit()
+                last_id = chunk[-1][0]
+                write_checkpoint(last_id)
+
+                processed += len(updates)
+                elapsed = time.perf_counter() - start
+                print(
+                    f"  已提交至人员ID {last_id}：累计处理 {processed} 条，错误 {errors} 条，"
+                    f"{processed / elapsed:.1f} 条/秒，{bytes_read / elapsed / 1024 / 1024:.2f} MB/秒"
+                )
+
+        elapsed = time.perf_counter() - start
         print("=" * 60)
         print("迁移完成！")
         print("=" * 60)
-        print(f"总计: {total} 条记录")
         print(f"已处理: {processed} 条")
-        print(f"已跳过: {skipped} 条")
         print(f"错误: {errors} 条")
+        print(f"耗时: {elapsed:.2f} 秒（{processed / elapsed if elapsed else 0:.1f} 条/秒）")
+
+        # 全部完成后清除检查点
+        if os.path.exists(CHECKPOINT_FILE):
+            os.remove(CHECKPOINT_FILE)
 
     except Exception as e:
         db.rollback()
         print(f"\n迁移失败: {str(e)}")
+        print(f"已提交的进度已保存，重新运行将从人员ID > {last_id} 继续")
         import traceback
         traceback.print_exc()
         sys.exit(1)
@@ -181,16 +184,29 @@ def migrate():
         db.close()
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="将数据库中的base64头像转换为URL格式")
+    parser.add_argument("--yes", "-y", action="store_true", help="跳过确认提示")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="并行处理的进程数")
+    parser.add_argument("--batch-size", type=int, default=200, help="每次读取和提交的人员数量")
+    parser.add_argument("--restart", action="store_true", help="忽略检查点，从头开始")
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    # 询问用户确认
-    print("此脚本将把数据库中的base64头像转换为URL格式。")
-    print("建议在执行前备份数据库文件 (lottery.db)\n")
+    args = parse_args()
+
+    if not args.yes:
+        # 询问用户确认
+        print("此脚本将把数据库中的base64头像转换为URL格式。")
+        print("建议在执行前备份数据库文件 (lottery.db)\n")
+
+        response = input("是否继续? (yes/no): ").strip().lower()
 
-    response = input("是否继续? (yes/no): ").strip().lower()
+        if response not in ["yes", "y"]:
+            print("已取消")
+            sys.exit(0)
 
-    if response not in ["yes", "y"]:
-        print("已取消")
-        sys.exit(0)
+        print()
 
-    print()
-    migrate()
+    migrate(workers=args.workers, batch_size=args.batch_size, restart=args.restart)
@@ -2,59 +2,124 @@
 """
 数据库迁移脚本
 用于更新数据库架构以匹配最新的模型定义
+
+通过 SQLAlchemy 连接 DATABASE_URL 指定的数据库（默认 sqlite:///./lottery.db），
+SQLite 和 PostgreSQL 都可以使用。
+
+应用启动时会自动执行 upgrade_schema()，补齐旧数据库缺少的列（见 COLUMNS）
+并回填 person_prizes 表，升级后不需要先手动运行本脚本。
 """
 
-import sqlite3
-from pathlib import Path
+from sqlalchemy import String, cast, inspect, insert, select, text
+from sqlalchemy.exc import DBAPIError
+
+from database import engine, Person, PersonPrize, person_prize_rows
 
-# 数据库路径
-DB_PATH = Path(__file__).parent / "lottery.db"
+# 模型新增、旧数据库中可能缺少的列：(表, 列, 列类型和默认值)
+COLUMNS = [
+    ("prizes", "picture_thumbnail_url", "TEXT DEFAULT ''"),
+    ("images", "thumbnail_url", "TEXT DEFAULT ''"),
+    # 版本号（乐观并发控制）
+    ("prizes", "version", "INTEGER NOT NULL DEFAULT 0"),
+    # 抽奖权重和抽奖审计参数
+    ("persons", "weight", "FLOAT DEFAULT 1"),
+    ("draw_audits", "options", "JSON"),
+]
 
 
 def check_column_exists(conn, table_name, column_name):
     """检查表中是否存在指定列"""
-    cursor = conn.cursor()
-    cursor.execute(f"PRAGMA table_info({table_name});")
-    columns = [col[1] for col in cursor.fetchall()]
+    columns = [column["name"] for column in inspect(conn).get_columns(table_name)]
     return column_name in columns
 
 
+def check_table_exists(conn, table_name):
+    """检查表是否存在"""
+    return inspect(conn).has_table(table_name)
+
+
+def add_column(conn, table_name, column_name, column_definition, verbose=True):
+    """添加列（column_definition 为列类型和默认值，如 "TEXT DEFAULT ''"）"""
+    if not check_column_exists(conn, table_name, column_name):
+        print(f"添加 {table_name}.{column_name} 列...")
+        conn.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_definition}"))
+        print(f"✓ {table_name}.{column_name} 列已添加")
+    elif verbose:
+        print(f"✓ {table_name}.{column_name} 列已存在")
+
+
+def add_missing_columns(conn, verbose=True):
+    """添加 COLUMNS 中缺少的列（表不存在时跳过，由 init_db 按最新模型创建）"""
+    for table_name, column_name, column_definition in COLUMNS:
+        if check_table_exists(conn, table_name):
+            add_column(conn, table_name, column_name, column_definition, verbose)
+
+
+def upgrade_schema():
+    """应用启动时执行（在 init_db 之后）：补齐旧数据库缺少的列并回填中奖记录，没有修改时不输出"""
+    def upgrade():
+        with engine.begin() as conn:
+            add_missing_columns(conn, verbose=False)
+            backfill_person_prizes(conn, verbose=False)
+
+    try:
+        upgrade()
+    except DBAPIError:
+        # 多个进程同时启动时其他进程可能刚添加了同一列或回填了同一人员，重新检查一次
+        upgrade()
+
+
+def backfill_person_prizes(conn, verbose=True):
+    """
+    根据 persons 表的中奖JSON数组回填 person_prizes 表
+
+    按人员判断：只回填有中奖数组、但还没有任何 person_prizes 记录的人员，
+    表中已有其他人员的记录（如迁移前已经抽过奖）时也不会漏掉历史中奖记录。
+    """
+    has_rows = select(PersonPrize.person_id).where(PersonPrize.person_id == Person.id).exists()
+    prize_ids_text = cast(Person.prize_id, String)
+    persons = conn.execute(
+        select(Person.id, Person.prize_id, Person.prize_name, Person.prize_time).where(
+            ~has_rows, Person.prize_id.isnot(None), prize_ids_text.notin_(["[]", "null", ""])
+        )
+    )
+    rows = []
+    backfilled = 0
+    for person_id, prize_ids, prize_names, prize_times in persons:
+        person_rows = person_prize_rows(person_id, prize_ids, prize_names, prize_times)
+        if person_rows:
+            rows.extend(person_rows)
+            backfilled += 1
+
+    if rows:
+        conn.execute(insert(PersonPrize.__table__), rows)
+    if rows or verbose:
+        print(f"✓ 已为 {backfilled} 个人员回填 {len(rows)} 条中奖记录")
+
+
 def migrate():
     """执行数据库迁移"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
+    print(f"数据库: {engine.url.render_as_string(hide_password=True)}")
     try:
-        # 检查并添加 prizes.picture_thumbnail_url 列
-        if not check_column_exists(conn, "prizes", "picture_thumbnail_url"):
-            print("添加 prizes.picture_thumbnail_url 列...")
-            cursor.execute(
-                "ALTER TABLE prizes ADD COLUMN picture_thumbnail_url TEXT DEFAULT '';"
-            )
-            print("✓ prizes.picture_thumbnail_url 列已添加")
-        else:
-            print("✓ prizes.picture_thumbnail_url 列已存在")
-
-        # 检查并添加 images.thumbnail_url 列
-        if not check_column_exists(conn, "images", "thumbnail_url"):
-            print("添加 images.thumbnail_url 列...")
-            cursor.execute(
-                "ALTER TABLE images ADD COLUMN thumbnail_url TEXT DEFAULT '';"
-            )
-            print("✓ images.thumbnail_url 列已添加")
-        else:
-            print("✓ images.thumbnail_url 列已存在")
-
-        # 提交更改
-        conn.commit()
+        # 所有修改在同一个事务中执行，出错时整体回滚
+        with engine.begin() as conn:
+            # 检查并添加 COLUMNS 中的列
+            add_missing_columns(conn)
+
+            # 检查并创建 person_prizes 中奖记录表（包括索引）
+            if not check_table_exists(conn, "person_prizes"):
+                print("创建 person_prizes 表...")
+                PersonPrize.__table__.create(bind=conn)
+                print("✓ person_prizes 表已创建")
+            else:
+                print("✓ person_prizes 表已存在")
+            backfill_person_prizes(conn)
+
         print("\n数据库迁移完成！")
 
     except Exception as e:
-        conn.rollback()
         print(f"\n❌ 迁移失败: {e}")
         raise
-    finally:
-        conn.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,349 @@
+"""
+人员批量导入
+
+使用Core层的 insert/update 批量写入人员数据：按 uuid 做 upsert，分块提交，
+不再为每一行执行 refresh，也不在响应中回显完整的人员数据。
+"""
+
+import codecs
+import csv
+import json
+import threading
+import uuid as uuid_lib
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+
+from sqlalchemy import insert, update
+from sqlalchemy.orm import Session
+
+from change_log import RECORD_CHANGES_OPTION, record_changes
+from database import Person as PersonModel, PersonPrize as PersonPrizeModel, person_prize_rows
+from id_ranges import merge_ranges
+from schemas import PersonCreate
+
+# 每个事务写入的行数
+CHUNK_SIZE = 1000
+
+# uuid 冲突时的处理方式
+ON_CONFLICT_UPDATE = "update"
+ON_CONFLICT_SKIP = "skip"
+
+# 最多保留的错误信息条数
+MAX_ERRORS = 100
+
+# 导入统计中最多保留的ID区间数（超过后不再记录新的区间，内存占用与导入行数无关）
+MAX_ID_RANGES = 1000
+
+# 最多保留的导入进度记录数
+MAX_PROGRESS_RECORDS = 50
+
+# CSV 导入只接受标量字段，列表字段（prize_*）请使用 NDJSON
+CSV_FIELDS = {name for name in PersonCreate.model_fields if not name.startswith("prize_")}
+PRIZE_FIELDS = {"prize_id", "prize_name", "prize_time"}
+
+# 新增人员时未提供的字段使用 PersonCreate 的默认值
+_DEFAULTS = {
+    name: field.get_default(call_default_factory=True)
+    for name, field in PersonCreate.model_fields.items()
+    if not field.is_required()
+}
+
+
+class ImportSummary:
+    """导入统计（跨分块累计）"""
+
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.skipped = 0
+        self.chunks = 0
+        self.invalid = 0
+        self.errors: List[str] = []
+        self.inserted_id_ranges: List[List[int]] = []
+        self.updated_id_ranges: List[List[int]] = []
+        self.id_ranges_truncated = False
+
+    def add_ids(self, ranges: List[List[int]], ids: List[int]):
+        """把一个分块的ID合并到区间列表中（区间数达到 MAX_ID_RANGES 后不再增加）"""
+        for person_id in sorted(ids):
+            if ranges and ranges[-1][0] <= person_id <= ranges[-1][1] + 1:
+                ranges[-1][1] = max(ranges[-1][1], person_id)
+            elif len(ranges) < MAX_ID_RANGES:
+                ranges.append([person_id, person_id])
+            else:
+                self.id_ranges_truncated = True
+
+    def add_error(self, line_no: int, message: str):
+        self.invalid += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append(f"line {line_no}: {message}")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "skipped": self.skipped,
+            "chunks": self.chunks,
+            "inserted_id_ranges": merge_ranges(self.inserted_id_ranges),
+            "updated_id_ranges": merge_ranges(self.updated_id_ranges),
+            "id_ranges_truncated": self.id_ranges_truncated,
+            "invalid": self.invalid,
+            "errors": self.errors,
+        }
+
+
+def _insert_prize_rows(db: Session, rows: List[Dict[str, Any]]):
+    """写入新增人员的 person_prizes 记录"""
+    prize_rows = []
+    for row in rows:
+        prize_rows.extend(person_prize_rows(row["id"], row.get("prize_id"), row.get("prize_name"), row.get("prize_time")))
+    if prize_rows:
+        db.execute(PersonPrizeModel.__table__.insert(), prize_rows)
+
+
+def _rebuild_prize_rows(db: Session, person_ids: List[int]):
+    """按人员更新后的中奖JSON数组重建其 person_prizes 记录（只提供了部分 prize_* 字段时也保持一致）"""
+    db.query(PersonPrizeModel).filter(PersonPrizeModel.person_id.in_(person_ids)).delete(synchronize_session=False)
+    persons = db.query(PersonModel.id, PersonModel.prize_id, PersonModel.prize_name, PersonModel.prize_time).filter(
+        PersonModel.id.in_(person_ids)
+    )
+    prize_rows = []
+    for person_id, prize_ids, prize_names, prize_times in persons:
+        prize_rows.extend(person_prize_rows(person_id, prize_ids, prize_names, prize_times))
+    if prize_rows:
+        db.execute(PersonPrizeModel.__table__.insert(), prize_rows)
+
+
+def upsert_persons_chunk(
+    db: Session,
+    rows: List[Dict[str, Any]],
+    summary: ImportSummary,
+    on_conflict: str = ON_CONFLICT_UPDATE,
+):
+    """
+    按 uuid upsert 一个分块并提交
+
+    Args:
+        db: 数据库会话
+        rows: 人员数据（PersonCreate.model_dump(exclude_unset=True) 的结果），不超过 CHUNK_SIZE 行；
+            新增人员时未提供的字段使用默认值，更新已有人员时只修改提供了的字段
+        summary: 导入统计
+        on_conflict: uuid 已存在时更新（update）还是跳过（skip）
+    """
+    if not rows:
+        return
+
+    # 去掉分块内重复的 uuid（保留第一次出现的行），空 uuid 自动生成
+    unique_rows: Dict[str, Dict[str, Any]] = {}
+    for row in rows:
+        if not row.get("uuid"):
+            row["uuid"] = str(uuid_lib.uuid4())
+        if row["uuid"] in unique_rows:
+            summary.skipped += 1
+            continue
+        unique_rows[row["uuid"]] = row
+
+    existing = dict(
+        db.query(PersonModel.uuid, PersonModel.id).filter(PersonModel.uuid.in_(list(unique_rows)))
+    )
+    new_by_uuid = {key: {**_DEFAULTS, **row} for key, row in unique_rows.items() if key not in existing}
+    new_rows = list(new_by_uuid.values())
+    conflict_rows = [row for key, row in unique_rows.items() if key in existing]
+
+    if new_rows:
+        # 新行的id由 RETURNING 得到，变更日志在这里显式记录
+        result = db.execute(
+            insert(PersonModel.__table__)
+            .returning(PersonModel.id, PersonModel.uuid)
+            .execution_options(**{RECORD_CHANGES_OPTION: False}),
+            new_rows,
+        )
+        inserted_ids = []
+        for person_id, person_uuid in result:
+            new_by_uuid[person_uuid]["id"] = person_id
+            inserted_ids.append(person_id)
+        summary.add_ids(summary.inserted_id_ranges, inserted_ids)
+        record_changes(db, PersonModel.__tablename__, inserted_ids)
+        summary.inserted += len(new_rows)
+        _insert_prize_rows(db, [row for row in new_rows if row.get("prize_id")])
+
+    if conflict_rows:
+        if on_conflict == ON_CONFLICT_SKIP:
+            summary.skipped += len(conflict_rows)
+        else:
+            for row in conflict_rows:
+                row["id"] = existing[row["uuid"]]
+            # 按主键批量更新，每行只写入提供了的字段（字段不同的行由ORM分组执行）
+            db.execute(update(PersonModel), conflict_rows)
+            summary.add_ids(summary.updated_id_ranges, [row["id"] for row in conflict_rows])
+            summary.updated += len(conflict_rows)
+            prize_ids = [row["id"] for row in conflict_rows if PRIZE_FIELDS & row.keys()]
+            if prize_ids:
+                _rebuild_prize_rows(db, prize_ids)
+
+    db.commit()
+    summary.chunks += 1
+
+
+def import_persons(
+    db: Session,
+    rows: List[Dict[str, Any]],
+    on_conflict: str = ON_CONFLICT_UPDATE,
+    chunk_size: int = CHUNK_SIZE,
+    summary: Optional[ImportSummary] = None,
+) -> ImportSummary:
+    """分块导入人员数据"""
+    summary = summary or ImportSummary()
+    for start in range(0, len(rows), chunk_size):
+        upsert_persons_chunk(db, rows[start:start + chunk_size], summary, on_conflict)
+    return summary
+
+
+# ==================== 流式导入 ====================
+class ImportProgress:
+    """单次流式导入的进度"""
+
+    def __init__(self, import_id: str):
+        self.import_id = import_id
+        self.status = "running"
+        self.bytes_read = 0
+        self.rows_read = 0
+        self.summary = ImportSummary()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "import_id": self.import_id,
+            "status": self.status,
+            "bytes_read": self.bytes_read,
+            "rows_read": self.rows_read,
+            "summary": self.summary.to_dict(),
+        }
+
+
+class ImportProgressRegistry:
+    """最近导入任务的进度表（进程内，只保留最近 MAX_PROGRESS_RECORDS 条）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._records: "OrderedDict[str, ImportProgress]" = OrderedDict()
+
+    def start(self, import_id: Optional[str] = None) -> ImportProgress:
+        progress = ImportProgress(import_id or str(uuid_lib.uuid4()))
+        with self._lock:
+            self._records[progress.import_id] = progress
+            self._records.move_to_end(progress.import_id)
+            while len(self._records) > MAX_PROGRESS_RECORDS:
+                self._records.popitem(last=False)
+        return progress
+
+    def get(self, import_id: str) -> Optional[ImportProgress]:
+        with self._lock:
+            return self._records.get(import_id)
+
+
+import_progress = ImportProgressRegistry()
+
+
+async def iter_lines(stream: AsyncIterator[bytes], progress: ImportProgress) -> AsyncIterator[str]:
+    """把请求体字节流按行切分（增量解码，兼容UTF-8 BOM）"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    async for chunk in stream:
+        progress.bytes_read += len(chunk)
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer.rstrip("\r")
+
+
+async def iter_ndjson_records(lines: AsyncIterator[str]) -> AsyncIterator[tuple]:
+    """解析NDJSON，产出 (行号, 记录或错误信息)"""
+    line_no = 0
+    async for line in lines:
+        line_no += 1
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_no, f"invalid JSON: {e.msg}"
+            continue
+        if not isinstance(record, dict):
+            yield line_no, "record must be a JSON object"
+            continue
+        yield line_no, record
+
+
+async def iter_csv_records(lines: AsyncIterator[str]) -> AsyncIterator[tuple]:
+    """解析CSV（第一行为表头），产出 (行号, 记录或错误信息)"""
+    header: Optional[List[str]] = None
+    line_no = 0
+    pending = ""
+    start_line = 0
+    async for line in lines:
+        line_no += 1
+        if not pending:
+            start_line = line_no
+        pending = f"{pending}\n{line}" if pending else line
+        # 引号未闭合说明字段内包含换行，继续拼接下一行
+        if pending.count('"') % 2 == 1:
+            continue
+        text, pending = pending, ""
+        if not text.strip():
+            continue
+        values = next(csv.reader([text]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        if len(values) > len(header):
+            yield start_line, f"expected {len(header)} columns, got {len(values)}"
+            continue
+        yield start_line, {
+            name: value
+            for name, value in zip(header, values)
+            if name in CSV_FIELDS and value != ""
+        }
+    if pending:
+        yield start_line, "unterminated quoted field"
+
+
+def _format_validation_error(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(loc) for loc in item['loc'])}: {item['msg']}" for item in error.errors()
+    )
+
+
+async def stream_import(
+    db: Session,
+    records: AsyncIterator[tuple],
+    progress: ImportProgress,
+    on_conflict: str = ON_CONFLICT_UPDATE,
+    chunk_size: int = CHUNK_SIZE,
+):
+    """
+    边读边校验边写入：每攒够一个分块就在线程池中提交一次，
+    内存中最多只保留一个分块的数据
+    """
+    rows: List[Dict[str, Any]] = []
+    async for line_no, record in records:
+        progress.rows_read += 1
+        if isinstance(record, str):
+            progress.summary.add_error(line_no, record)
+            continue
+        try:
+            # 只保留记录中提供了的字段，更新已有人员时不覆盖其他字段（CSV 不含 prize_* 列，中奖记录不受影响）
+            rows.append(PersonCreate.model_validate(record).model_dump(exclude_unset=True))
+        except ValidationError as e:
+            progress.summary.add_error(line_no, _format_validation_error(e))
+            continue
+        if len(rows) >= chunk_size:
+            await run_in_threadpool(upsert_persons_chunk, db, rows, progress.summary, on_conflict)
+            rows = []
+    if rows:
+        await run_in_threadpool(upsert_persons_chunk, db, rows, progress.summary, on_conflict)
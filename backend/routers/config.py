@@ -1,66 +1,42 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import Dict, Any
 
-from database import get_db
+from database import get_db, get_async_db
 from schemas import GlobalConfig, GlobalConfigUpdate, Theme, ThemeDetail
 from database import GlobalConfig as GlobalConfigModel
+from http_cache import response_cache, cached_json_response
+from event_bus import event_bus
 
 router = APIRouter(prefix="/api/config", tags=["config"])
 
 
-@router.get("/", response_model=GlobalConfig)
-def get_global_config(db: Session = Depends(get_db)):
-    """获取全局配置"""
+def _get_global_config_internal(db: Session):
+    """内部函数：获取全局配置并构造嵌套结构"""
     config = db.query(GlobalConfigModel).first()
     if not config:
-        # 如果没有配置，创建默认配置
         config = GlobalConfigModel()
         db.add(config)
         db.commit()
         db.refresh(config)
-    
-    # 构造嵌套的 theme 对象以匹配 Pydantic 模型
-    theme = Theme(
-        name=config.theme_name,
-        detail=ThemeDetail(**config.theme_detail) if config.theme_detail else ThemeDetail(),
-        card_color=config.card_color,
-        card_width=config.card_width,
-        card_height=config.card_height,
-        text_color=config.text_color,
-        lucky_card_color=config.lucky_card_color,
-        text_size=config.text_size,
-        pattern_color=config.pattern_color,
-        pattern_list=config.pattern_list if config.pattern_list else [],
-        background=config.background if config.background else {},
-        font=config.font,
-        title_font=config.title_font,
-        title_font_sync_global=config.title_font_sync_global,
-    )
-    
-    # 返回完整的 GlobalConfig 对象
-    return GlobalConfig(
-        id=config.id,
-        row_count=config.row_count,
-        is_show_prize_list=config.is_show_prize_list,
-        is_show_avatar=config.is_show_avatar,
-        top_title=config.top_title,
-        language=config.language,
-        definite_time=config.definite_time,
-        win_music=config.win_music,
-        theme=theme,
-    )
+    return _to_schema(config)
 
 
-def _get_global_config_internal(db: Session):
-    """内部函数：获取全局配置并构造嵌套结构"""
-    config = db.query(GlobalConfigModel).first()
+async def _aget_global_config_internal(db: AsyncSession):
+    """_get_global_config_internal 的异步版本"""
+    config = await db.scalar(select(GlobalConfigModel).limit(1))
     if not config:
         config = GlobalConfigModel()
         db.add(config)
-        db.commit()
-        db.refresh(config)
-    
+        await db.commit()
+        await db.refresh(config)
+    return _to_schema(config)
+
+
+def _to_schema(config: GlobalConfigModel) -> GlobalConfig:
+    """把全局配置表的行转换为嵌套结构"""
     # 构造嵌套的 theme 对象以匹配 Pydantic 模型
     theme = Theme(
         name=config.theme_name,
@@ -93,9 +69,12 @@ def _get_global_config_internal(db: Session):
     )
 
 @router.get("/", response_model=GlobalConfig)
-def get_global_config(db: Session = Depends(get_db)):
-    """获取全局配置"""
-    return _get_global_config_internal(db)
+async def get_global_config(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """获取全局配置（命中缓存时不访问数据库，ETag匹配时返回304）"""
+    async def build():
+        return (await _aget_global_config_internal(db)).model_dump_json().encode()
+    cached = await response_cache.aget_or_build("config", ["global_config"], build)
+    return cached_json_response(request, cached)
 
 @router.put("/", response_model=GlobalConfig)
 def update_global_config(config_update: GlobalConfigUpdate, db: Session = Depends(get_db)):
@@ -147,6 +126,7 @@ def update_global_config(config_update: GlobalConfigUpdate, db: Session = Depend
 
     db.commit()
     db.refresh(config)
+    event_bus.publish("config.updated", changes=config_update.model_dump(mode="json", exclude_unset=True))
     
     # 返回完整的配置对象（需要构造嵌套结构）
     return _get_global_config_internal(db)
@@ -163,4 +143,6 @@ def reset_global_config(db: Session = Depends(get_db)):
     db.add(config)
     db.commit()
     db.refresh(config)
+    # 与更新配置相同的事件，changes 为重置后的完整配置
+    event_bus.publish("config.updated", changes=_get_global_config_internal(db).model_dump(mode="json"))
     return {"status": "success", "message": "Global config reset successfully", "config": config}
@@ -0,0 +1,48 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, defer
+from typing import List, Optional
+
+import draw_engine
+from database import get_db, get_async_db, DrawAudit as DrawAuditModel
+from schemas import DrawAudit, DrawAuditSummary, DrawVerifyResult
+
+router = APIRouter(prefix="/api/draws", tags=["draws"])
+
+
+@router.get("/", response_model=List[DrawAuditSummary])
+async def get_draw_audits(
+    prize_id: Optional[str] = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """获取抽奖审计记录（按时间倒序，不含候选池）"""
+    query = select(DrawAuditModel).options(defer(DrawAuditModel.pool_ranges))
+    if prize_id is not None:
+        query = query.where(DrawAuditModel.prize_id == prize_id)
+    audits = (await db.scalars(query.order_by(DrawAuditModel.id.desc()).offset(skip).limit(limit))).all()
+    return [DrawAuditSummary.model_validate(audit) for audit in audits]
+
+
+@router.get("/{audit_id}", response_model=DrawAudit)
+async def get_draw_audit(audit_id: int, db: AsyncSession = Depends(get_async_db)):
+    """获取单条审计记录（包含候选池，可用 draw_engine.py 离线校验）"""
+    audit = await db.get(DrawAuditModel, audit_id)
+    if not audit:
+        raise HTTPException(status_code=404, detail="Draw audit not found")
+    return DrawAudit.model_validate(audit)
+
+
+@router.get("/{audit_id}/verify", response_model=DrawVerifyResult)
+def verify_draw_audit(audit_id: int, db: Session = Depends(get_db)):
+    """根据审计记录重放抽奖，校验候选池哈希和中奖人员"""
+    audit = db.get(DrawAuditModel, audit_id)
+    if not audit:
+        raise HTTPException(status_code=404, detail="Draw audit not found")
+    try:
+        result = draw_engine.verify(DrawAudit.model_validate(audit).model_dump())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return DrawVerifyResult(audit_id=audit_id, **result)
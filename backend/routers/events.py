@@ -0,0 +1,76 @@
+from fastapi import APIRouter, HTTPException, WebSocket
+from fastapi.responses import StreamingResponse
+import asyncio
+
+from event_bus import event_bus, TooManySubscribers, EVENT_HEARTBEAT_SECONDS
+
+router = APIRouter(prefix="/api", tags=["events"])
+
+
+@router.get("/events")
+async def stream_events():
+    """通过SSE订阅实时事件（连接被服务端断开时收到 dropped 事件，客户端应重连并重新拉取数据）"""
+    try:
+        subscriber = event_bus.subscribe()
+    except TooManySubscribers:
+        raise HTTPException(status_code=503, detail="Too many subscribers", headers={"Retry-After": "5"})
+
+    async def generate():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    item = await asyncio.wait_for(subscriber.queue.get(), timeout=EVENT_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if item is None:
+                    yield "event: dropped\ndata: {}\n\n"
+                    return
+                seq, event_type, message = item
+                yield f"id: {seq}\nevent: {event_type}\ndata: {message}\n\n"
+        finally:
+            event_bus.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _send_events(websocket: WebSocket, subscriber):
+    """把订阅到的事件逐条发送给WebSocket客户端"""
+    while True:
+        try:
+            item = await asyncio.wait_for(subscriber.queue.get(), timeout=EVENT_HEARTBEAT_SECONDS)
+        except asyncio.TimeoutError:
+            await websocket.send_text('{"type":"ping"}')
+            continue
+        if item is None:
+            # 客户端读得太慢，断开后由客户端重连
+            await websocket.close(code=1013, reason="dropped")
+            return
+        await websocket.send_text(item[2])
+
+
+@router.websocket("/ws")
+async def websocket_events(websocket: WebSocket):
+    """通过WebSocket订阅实时事件（每条消息是一个JSON事件）"""
+    try:
+        subscriber = event_bus.subscribe()
+    except TooManySubscribers:
+        await websocket.close(code=1013)
+        return
+
+    await websocket.accept()
+    sender = asyncio.create_task(_send_events(websocket, subscriber))
+    try:
+        # 同时读取客户端消息，客户端断开时立即结束，而不是等到下一次发送失败
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+    finally:
+        sender.cancel()
+        event_bus.unsubscribe(subscriber)
@@ -1,50 +1,30 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Literal, Optional, Tuple
 import os
-import uuid
-from datetime import datetime
-from PIL import Image as PILImage
-import io
 
 from database import get_db
 from schemas import Music, MusicCreate, Image, ImageCreate
-from database import Music as MusicModel, Image as ImageModel
+from database import Music as MusicModel, Image as ImageModel, GlobalConfig as GlobalConfigModel
+from http_cache import response_cache, cached_json_response, serialize_list
+from image_worker import image_pool, PoolSaturated
+from upload_store import put_upload, release, file_url, thumbnail_url
+from image_variants import FORMAT_MEDIA_TYPES, get_variant, negotiate_format, variant_size, variant_url
+from table_versions import table_versions
+from avatar_atlas import avatar_atlas
 
 router = APIRouter(prefix="/api/media", tags=["media"])
 
-UPLOAD_DIR = "uploads"
-THUMBNAIL_DIR = os.path.join(UPLOAD_DIR, "thumbnails")
-THUMBNAIL_SIZE = (200, 200)  # 缩略图尺寸
-
-for dir_path in [UPLOAD_DIR, THUMBNAIL_DIR]:
-    if not os.path.exists(dir_path):
-        os.makedirs(dir_path)
-
-
-def generate_thumbnail(image_path: str, thumbnail_path: str, size: tuple = THUMBNAIL_SIZE) -> str:
-    """生成图片缩略图"""
-    try:
-        with PILImage.open(image_path) as img:
-            # 转换为 RGB 模式（如果原图是 RGBA）
-            if img.mode == 'RGBA':
-                img = img.convert('RGB')
-            # 生成缩略图
-            img.thumbnail(size, PILImage.Resampling.LANCZOS)
-            # 保存缩略图
-            img.save(thumbnail_path, 'JPEG', quality=85)
-        return thumbnail_path
-    except Exception as e:
-        print(f"生成缩略图失败: {e}")
-        return ""
-
-
 # ==================== 音乐相关接口 ====================
 @router.get("/music", response_model=List[Music])
-def get_all_music(db: Session = Depends(get_db)):
+def get_all_music(request: Request, db: Session = Depends(get_db)):
     """获取所有音乐"""
-    music_list = db.query(MusicModel).all()
-    return music_list
+    def build():
+        music_list = db.query(MusicModel).all()
+        return serialize_list(Music, music_list)
+    return cached_json_response(request, response_cache.get_or_build("music:all", ["music"], build))
 
 
 @router.get("/music/{music_id}", response_model=Music)
@@ -88,10 +68,12 @@ def delete_all_music(db: Session = Depends(get_db)):
 
 # ==================== 图片相关接口 ====================
 @router.get("/images", response_model=List[Image])
-def get_all_images(db: Session = Depends(get_db)):
+def get_all_images(request: Request, db: Session = Depends(get_db)):
     """获取所有图片"""
-    images = db.query(ImageModel).all()
-    return images
+    def build():
+        images = db.query(ImageModel).all()
+        return serialize_list(Image, images)
+    return cached_json_response(request, response_cache.get_or_build("images:all", ["images"], build))
 
 
 @router.get("/images/{image_id}", response_model=Image)
@@ -120,7 +102,10 @@ def delete_image(image_id: str, db: Session = Depends(get_db)):
     if not db_image:
         raise HTTPException(status_code=404, detail="Image not found")
 
+    # 先删除图片再释放文件的引用，没有其他行使用该文件时回收文件
     db.delete(db_image)
+    db.flush()
+    release(db, db_image.url)
     db.commit()
     return {"status": "success", "message": "Image deleted successfully"}
 
@@ -128,43 +113,93 @@ def delete_image(image_id: str, db: Session = Depends(get_db)):
 @router.delete("/images")
 def delete_all_images(db: Session = Depends(get_db)):
     """删除所有图片"""
+    urls = [url for (url,) in db.query(ImageModel.url)]
     db.query(ImageModel).delete()
+    for url in urls:
+        release(db, url)
     db.commit()
     return {"status": "success", "message": "All images deleted successfully"}
 
 
 @router.post("/upload", response_model=dict)
-async def upload_image(file: UploadFile = File(...)):
-    """上传图片并返回URL"""
+async def upload_image(file: UploadFile = File(...), db: Session = Depends(get_db)):
+    """上传图片并返回URL（按内容去重，相同图片只保存一份）"""
     # 检查文件类型
     allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/webp"]
     if file.content_type not in allowed_types:
         raise HTTPException(status_code=400, detail="Invalid file type. Only JPEG, PNG, WebP are allowed.")
 
-    # 生成唯一文件名
-    file_extension = os.path.splitext(file.filename or "")[1]
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = os.path.join(UPLOAD_DIR, unique_filename)
+    # 图片处理进程池已满时直接拒绝，避免请求无限堆积
+    if image_pool.saturated:
+        raise HTTPException(status_code=429, detail="Too many uploads in progress", headers={"Retry-After": "1"})
 
-    # 保存文件
+    file_extension = os.path.splitext(file.filename or "")[1].lower()
     try:
-        contents = await file.read()
-        with open(file_path, "wb") as f:
-            f.write(contents)
-    except Exception as e:
+        blob, deduplicated = await put_upload(db, file, file_extension)
+    except PoolSaturated:
+        raise HTTPException(status_code=429, detail="Too many uploads in progress", headers={"Retry-After": "1"})
+    except OSError as e:
         raise HTTPException(status_code=500, detail=f"Failed to upload file: {str(e)}")
 
-    # 生成缩略图
-    thumbnail_filename = f"thumb_{unique_filename}"
-    thumbnail_path = os.path.join(THUMBNAIL_DIR, thumbnail_filename)
-    generate_thumbnail(file_path, thumbnail_path)
-    thumbnail_url = f"/api/uploads/thumbnails/{thumbnail_filename}"
-
-    # 返回文件URL和缩略图URL
-    file_url = f"/api/uploads/{unique_filename}"
     return {
-        "url": file_url,
-        "thumbnail_url": thumbnail_url,
-        "filename": unique_filename,
-        "original_filename": file.filename
+        "url": file_url(blob.filename),
+        "thumbnail_url": thumbnail_url(blob.thumbnail_filename),
+        "filename": blob.filename,
+        "original_filename": file.filename,
+        "deduplicated": deduplicated,
+        "variants": {variant: variant_url(blob.filename, variant) for variant in ("thumb", "card", "full")},
     }
+
+
+# 卡片尺寸缓存：(global_config表版本号, (宽, 高))
+_card_size_cache: Tuple[int, Tuple[int, int]] = (-1, (140, 200))
+
+
+def _get_card_size(db: Session) -> Tuple[int, int]:
+    """获取全局配置中的卡片尺寸（配置未变化时不查询数据库）"""
+    global _card_size_cache
+    version = table_versions.get("global_config")
+    if _card_size_cache[0] != version:
+        row = db.query(GlobalConfigModel.card_width, GlobalConfigModel.card_height).first()
+        _card_size_cache = (version, (row[0], row[1]) if row else (140, 200))
+    return _card_size_cache[1]
+
+
+@router.get("/variants/{filename}")
+async def get_image_variant(
+    filename: str,
+    request: Request,
+    variant: Optional[Literal["thumb", "card", "full"]] = Query(None, description="预设变体"),
+    w: Optional[int] = Query(None, ge=1, le=4096, description="期望宽度，向上取到最近的档位"),
+    format: Optional[Literal["webp", "avif", "jpeg"]] = Query(None, description="输出格式，不传时根据Accept请求头选择"),
+    db: Session = Depends(get_db)
+):
+    """获取图片的尺寸变体，第一次请求时生成并缓存到磁盘"""
+    if filename != os.path.basename(filename) or filename.startswith("."):
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    card_size = await run_in_threadpool(_get_card_size, db) if variant == "card" and w is None else (140, 200)
+    image_format = negotiate_format(format, request.headers.get("accept", ""))
+    key, width, height, crop = variant_size(variant, w, card_size)
+    try:
+        path = await get_variant(filename, key, width, height, crop, image_format)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Image not found")
+    except PoolSaturated:
+        raise HTTPException(status_code=429, detail="Too many image jobs in progress", headers={"Retry-After": "1"})
+    except OSError:
+        raise HTTPException(status_code=400, detail="Unsupported image")
+
+    # 原图按内容命名不会变化；card 变体随卡片尺寸配置变化，需要重新验证
+    cache_control = "no-cache" if key.startswith("card") else "public, max-age=31536000, immutable"
+    if format is None:
+        headers = {"Cache-Control": cache_control, "Vary": "Accept"}
+    else:
+        headers = {"Cache-Control": cache_control}
+    return FileResponse(path, media_type=FORMAT_MEDIA_TYPES[image_format], headers=headers)
+
+
+@router.get("/atlas")
+async def get_avatar_atlas(request: Request, db: Session = Depends(get_db)):
+    """获取人员头像图集索引（人员ID → 图集及UV位置），人员头像有变化时先增量更新图集"""
+    return cached_json_response(request, await avatar_atlas.get_index(db))
@@ -1,33 +1,124 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
-from typing import List
-
-from database import get_db
-from schemas import Person, PersonCreate, PersonUpdate, PersonWithoutAvatar
-from database import Person as PersonModel
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, defer
+from typing import List, Literal, Optional
+import time
+
+from database import get_db, get_async_db, sync_person_prizes
+from schemas import (
+    Person, PersonCreate, PersonUpdate, PersonWithoutAvatar, PersonDeviceSummary, PersonStatus, PersonImportSummary,
+    PersonImportProgress, PersonPage,
+)
+from database import Person as PersonModel, PersonPrize as PersonPrizeModel
+from device_cache import device_cache, STATUS_MAX_WAIT_SECONDS
+from eligibility import eligibility_index
+from event_bus import event_bus
+from http_cache import response_cache, cached_json_response, serialize_list
+from person_import import (
+    import_persons, import_progress, iter_lines, iter_csv_records, iter_ndjson_records, stream_import,
+)
 
 router = APIRouter(prefix="/api/persons", tags=["persons"])
 
+# 分页接口可选择的字段（默认不包含 avatar 大字段）
+PERSON_FIELDS = {column.name: column for column in PersonModel.__table__.columns}
+DEFAULT_PAGE_FIELDS = [name for name in PERSON_FIELDS if name != "avatar"]
+
 
 @router.get("/", response_model=List[PersonWithoutAvatar])
-def get_all_persons(db: Session = Depends(get_db)):
+async def get_all_persons(request: Request, db: AsyncSession = Depends(get_async_db)):
     """获取所有人员"""
-    persons = db.query(PersonModel).all()
-    return persons
+    async def build():
+        # 响应模型不包含 avatar，查询时也不加载该列
+        persons = (await db.scalars(select(PersonModel).options(defer(PersonModel.avatar)))).all()
+        return serialize_list(PersonWithoutAvatar, persons)
+    return cached_json_response(request, await response_cache.aget_or_build("persons:all", ["persons"], build))
+
+
+@router.get("/page", response_model=PersonPage)
+async def get_persons_page(
+    limit: int = Query(100, ge=1, le=1000, description="每页数量"),
+    after: int = Query(0, ge=0, description="游标：返回 id 大于该值的人员"),
+    fields: Optional[str] = Query(None, description="逗号分隔的字段列表，默认返回除 avatar 外的所有字段"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """按 id 游标分页获取人员，只查询请求的字段"""
+    names = [name.strip() for name in fields.split(",") if name.strip()] if fields else DEFAULT_PAGE_FIELDS
+    unknown = [name for name in names if name not in PERSON_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    if "id" not in names:
+        names = ["id"] + names
+
+    rows = (await db.execute(
+        select(*[PERSON_FIELDS[name] for name in names])
+        .where(PersonModel.id > after)
+        .order_by(PersonModel.id)
+        .limit(limit + 1)
+    )).all()
+    # 多查一行用于判断是否还有下一页
+    has_more = len(rows) > limit
+    items = [row._asdict() for row in rows[:limit]]
+    return {"items": items, "next_cursor": items[-1]["id"] if has_more else None}
 
 
 @router.get("/device", response_model=Person)
-def get_person_by_device_fingerprint(
+async def get_person_by_device_fingerprint(
     device_fingerprint: str = Query(..., description="设备指纹"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """根据设备指纹获取人员"""
-    person = db.query(PersonModel).filter(PersonModel.device_fingerprint == device_fingerprint).first()
+    person = await db.scalar(
+        select(PersonModel).where(PersonModel.device_fingerprint == device_fingerprint).limit(1)
+    )
     if not person:
         raise HTTPException(status_code=404, detail="Person not found")
     return person
 
 
+@router.get("/device/summary", response_model=PersonDeviceSummary)
+async def get_person_summary_by_device_fingerprint(device_fingerprint: str = Query(..., description="设备指纹")):
+    """根据设备指纹获取精简人员信息（手机端轮询是否中奖，从内存缓存返回，不含头像原图）"""
+    content = await device_cache.get(device_fingerprint)
+    if content is None:
+        raise HTTPException(status_code=404, detail="Person not found")
+    return Response(content=content, media_type="application/json")
+
+
+@router.get("/status", response_model=PersonStatus)
+async def get_person_status(
+    device_fingerprint: Optional[str] = Query(None, description="设备指纹"),
+    uuid: Optional[str] = Query(None, description="人员UUID（没有设备指纹时使用）"),
+    wait: float = Query(0, ge=0, le=STATUS_MAX_WAIT_SECONDS, description="长轮询：状态未变化时最多等待的秒数"),
+    version: Optional[str] = Query(None, description="上次返回的 version，不传时以请求时的状态为准"),
+):
+    """获取人员是否中奖及最近一次中奖的奖项，wait 大于0时挂起直到状态变化或超时"""
+    if not device_fingerprint and not uuid:
+        raise HTTPException(status_code=400, detail="device_fingerprint or uuid is required")
+
+    async def current():
+        if device_fingerprint:
+            return await device_cache.status(device_fingerprint)
+        return await device_cache.status_by_uuid(uuid)
+
+    status = await current()
+    if status is None:
+        raise HTTPException(status_code=404, detail="Person not found")
+    known = version or status["version"]
+    deadline = time.monotonic() + wait
+    while status["version"] == known:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        await device_cache.wait(status["id"], known, remaining)
+        # 修改人员的其他字段也会唤醒，重新查询后状态没变时继续等待
+        status = await current()
+        if status is None:
+            raise HTTPException(status_code=404, detail="Person not found")
+    return status
+
+
 @router.delete("/device", response_model=dict)
 def delete_person_by_device_fingerprint(
     device_fingerprint: str = Query(..., description="设备指纹"),
@@ -37,24 +128,29 @@ def delete_person_by_device_fingerprint(
     person = db.query(PersonModel).filter(PersonModel.device_fingerprint == device_fingerprint).first()
     if not person:
         raise HTTPException(status_code=404, detail="Person not found")
+    db.query(PersonPrizeModel).filter(PersonPrizeModel.person_id == person.id).delete(synchronize_session=False)
+    person_id = person.id
     db.delete(person)
     db.commit()
+    eligibility_index.invalidate()
+    device_cache.remove([person_id])
+    event_bus.publish("person.deleted", id=person_id)
     return {"status": "success", "message": "Person deleted successfully"}
 
 
 @router.get("/{person_id}", response_model=Person)
-def get_person(person_id: int, db: Session = Depends(get_db)):
+async def get_person(person_id: int, db: AsyncSession = Depends(get_async_db)):
     """根据ID获取人员"""
-    person = db.query(PersonModel).filter(PersonModel.id == person_id).first()
+    person = await db.get(PersonModel, person_id)
     if not person:
         raise HTTPException(status_code=404, detail="Person not found")
     return person
 
 
 @router.get("/uuid/{uuid}", response_model=Person)
-def get_person_by_uuid(uuid: str, db: Session = Depends(get_db)):
+async def get_person_by_uuid(uuid: str, db: AsyncSession = Depends(get_async_db)):
     """根据UUID获取人员"""
-    person = db.query(PersonModel).filter(PersonModel.uuid == uuid).first()
+    person = await db.scalar(select(PersonModel).where(PersonModel.uuid == uuid).limit(1))
     if not person:
         raise HTTPException(status_code=404, detail="Person not found")
     return person
@@ -65,8 +161,13 @@ def create_person(person: PersonCreate, db: Session = Depends(get_db)):
     """创建人员"""
     db_person = PersonModel(**person.model_dump())
     db.add(db_person)
+    db.flush()
+    sync_person_prizes(db, [db_person])
     db.commit()
+    eligibility_index.invalidate()
     db.refresh(db_person)
+    device_cache.update([db_person])
+    event_bus.publish("person.created", person=PersonWithoutAvatar.model_validate(db_person).model_dump(mode="json"))
     return db_person
 
 
@@ -75,10 +176,67 @@ def create_persons_batch(persons: List[PersonCreate], db: Session = Depends(get_
     """批量创建人员"""
     db_persons = [PersonModel(**person.model_dump()) for person in persons]
     db.add_all(db_persons)
+    db.flush()
+    sync_person_prizes(db, db_persons)
+    # flush 后主键和默认值都已就绪，提交前直接序列化，避免逐行 refresh
+    result = [Person.model_validate(person) for person in db_persons]
     db.commit()
-    for person in db_persons:
-        db.refresh(person)
-    return db_persons
+    eligibility_index.invalidate()
+    device_cache.update(result)
+    event_bus.publish("persons.changed", created=len(result))
+    return result
+
+
+@router.post("/bulk", response_model=PersonImportSummary)
+def import_persons_bulk(
+    persons: List[PersonCreate],
+    on_conflict: Literal["update", "skip"] = Query("update", description="uuid已存在时更新或跳过"),
+    db: Session = Depends(get_db)
+):
+    """批量导入人员（按uuid upsert，分块提交，只返回统计信息）"""
+    summary = import_persons(db, [person.model_dump(exclude_unset=True) for person in persons], on_conflict)
+    eligibility_index.invalidate()
+    device_cache.invalidate()
+    event_bus.publish("persons.changed", inserted=summary.inserted, updated=summary.updated)
+    return summary.to_dict()
+
+
+@router.post("/import", response_model=PersonImportProgress)
+async def import_persons_stream(
+    request: Request,
+    format: Optional[Literal["ndjson", "csv"]] = Query(None, description="数据格式，不传时根据Content-Type判断"),
+    on_conflict: Literal["update", "skip"] = Query("update", description="uuid已存在时更新或跳过"),
+    import_id: Optional[str] = Query(None, description="导入任务ID，可用于查询进度"),
+    db: Session = Depends(get_db)
+):
+    """流式导入人员（NDJSON或CSV），边上传边分块写入"""
+    if format is None:
+        content_type = request.headers.get("content-type", "")
+        format = "csv" if "csv" in content_type else "ndjson"
+
+    progress = import_progress.start(import_id)
+    lines = iter_lines(request.stream(), progress)
+    records = iter_csv_records(lines) if format == "csv" else iter_ndjson_records(lines)
+    try:
+        await stream_import(db, records, progress, on_conflict)
+    except Exception:
+        progress.status = "failed"
+        raise
+    finally:
+        eligibility_index.invalidate()
+        device_cache.invalidate()
+        event_bus.publish("persons.changed", inserted=progress.summary.inserted, updated=progress.summary.updated)
+    progress.status = "done"
+    return progress.to_dict()
+
+
+@router.get("/import/{import_id}", response_model=PersonImportProgress)
+def get_import_progress(import_id: str):
+    """查询流式导入进度"""
+    progress = import_progress.get(import_id)
+    if not progress:
+        raise HTTPException(status_code=404, detail="Import not found")
+    return progress.to_dict()
 
 
 @router.put("/{person_id}", response_model=Person)
@@ -92,8 +250,18 @@ def update_person(person_id: int, person_update: PersonUpdate, db: Session = Dep
     for key, value in update_data.items():
         setattr(db_person, key, value)
 
+    # 中奖数组有变化时同步中奖记录表
+    if update_data.keys() & {"prize_id", "prize_name", "prize_time"}:
+        sync_person_prizes(db, [db_person])
+
     db.commit()
+    eligibility_index.invalidate()
     db.refresh(db_person)
+    device_cache.update([db_person])
+    # 只推送变化的字段（头像可能是base64大字段，只推送缩略图）
+    changes = person_update.model_dump(mode="json", exclude_unset=True)
+    changes.pop("avatar", None)
+    event_bus.publish("person.updated", id=person_id, changes=changes)
     return db_person
 
 
@@ -104,52 +272,82 @@ def delete_person(person_id: int, db: Session = Depends(get_db)):
     if not db_person:
         raise HTTPException(status_code=404, detail="Person not found")
 
+    db.query(PersonPrizeModel).filter(PersonPrizeModel.person_id == person_id).delete(synchronize_session=False)
     db.delete(db_person)
     db.commit()
+    eligibility_index.invalidate()
+    device_cache.remove([person_id])
+    event_bus.publish("person.deleted", id=person_id)
     return {"status": "success", "message": "Person deleted successfully"}
 
 
 @router.delete("/")
 def delete_all_persons(db: Session = Depends(get_db)):
     """删除所有人员"""
+    db.query(PersonPrizeModel).delete()
     db.query(PersonModel).delete()
     db.commit()
+    eligibility_index.invalidate()
+    device_cache.invalidate()
+    event_bus.publish("persons.changed", deleted_all=True)
     return {"status": "success", "message": "All persons deleted successfully"}
 
 
 @router.get("/already/list", response_model=List[Person])
-def get_already_won_persons(db: Session = Depends(get_db)):
+async def get_already_won_persons(request: Request, db: AsyncSession = Depends(get_async_db)):
     """获取已中奖人员列表"""
-    persons = db.query(PersonModel).filter(PersonModel.is_win == True).all()
-    return persons
+    async def build():
+        persons = (await db.scalars(select(PersonModel).where(PersonModel.is_win == True))).all()
+        return serialize_list(Person, persons)
+    return cached_json_response(request, await response_cache.aget_or_build("persons:already", ["persons"], build))
 
 
 @router.get("/not/list", response_model=List[Person])
-def get_not_won_persons(db: Session = Depends(get_db)):
+async def get_not_won_persons(request: Request, db: AsyncSession = Depends(get_async_db)):
     """获取未中奖人员列表"""
-    persons = db.query(PersonModel).filter(PersonModel.is_win == False).all()
-    return persons
+    async def build():
+        persons = (await db.scalars(select(PersonModel).where(PersonModel.is_win == False))).all()
+        return serialize_list(Person, persons)
+    return cached_json_response(request, await response_cache.aget_or_build("persons:not", ["persons"], build))
 
 
 @router.get("/not/prize/{prize_id}", response_model=List[Person])
-def get_not_won_this_prize_persons(prize_id: str, db: Session = Depends(get_db)):
+async def get_not_won_this_prize_persons(prize_id: str, db: AsyncSession = Depends(get_async_db)):
     """获取未中此奖的人员列表"""
-    persons = db.query(PersonModel).all()
-    result = []
-    for person in persons:
-        if prize_id not in person.prize_id:
-            result.append(person)
-    return result
+    # 通过中奖记录表做反连接，不再逐行反序列化 prize_id JSON 列
+    won_this_prize = select(PersonPrizeModel.id).where(
+        PersonPrizeModel.person_id == PersonModel.id,
+        PersonPrizeModel.prize_id == prize_id,
+    )
+    persons = (await db.scalars(select(PersonModel).where(~won_this_prize.exists()))).all()
+    return persons
+
+
+def _reset_won_status(db: Session) -> int:
+    """内部函数：批量重置中奖状态（不提交事务），返回被重置的人员数量"""
+    # 只改写中过奖或仍有中奖记录的行，一条UPDATE完成，不逐行加载ORM对象
+    has_prize = db.query(PersonPrizeModel.person_id)
+    count = db.query(PersonModel).filter(
+        or_(PersonModel.is_win == True, PersonModel.id.in_(has_prize))
+    ).update(
+        {
+            PersonModel.is_win: False,
+            PersonModel.prize_name: [],
+            PersonModel.prize_id: [],
+            PersonModel.prize_time: [],
+        },
+        synchronize_session=False,
+    )
+    db.query(PersonPrizeModel).delete(synchronize_session=False)
+    return count
 
 
 @router.post("/reset/won")
 def reset_won_status(db: Session = Depends(get_db)):
     """重置所有人员的中奖状态"""
-    persons = db.query(PersonModel).all()
-    for person in persons:
-        person.is_win = False
-        person.prize_name = []
-        person.prize_id = []
-        person.prize_time = []
+    count = _reset_won_status(db)
     db.commit()
+    eligibility_index.invalidate()
+    device_cache.invalidate()
+    event_bus.publish("persons.reset", count=count)
     return {"status": "success", "message": "Won status reset successfully"}
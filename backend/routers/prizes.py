@@ -1,34 +1,110 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy import bindparam, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, defer
+from sqlalchemy.orm.exc import StaleDataError
+from typing import Dict, List, Optional
+from datetime import datetime
+import threading
 
-from database import get_db
-from schemas import Prize, PrizeCreate, PrizeUpdate
-from database import Prize as PrizeModel
+import draw_engine
+from change_log import RECORD_CHANGES_OPTION, record_changes
+from database import get_db, get_async_db, person_prize_rows
+from schemas import Prize, PrizeCreate, PrizeUpdate, PrizeClaim, DrawRequest, DrawResult, PersonWithoutAvatar
+from database import (
+    Prize as PrizeModel, Person as PersonModel, PersonPrize as PersonPrizeModel, DrawAudit as DrawAuditModel,
+)
+from device_cache import device_cache
+from eligibility import eligibility_index
+from event_bus import event_bus
+from http_cache import response_cache, cached_json_response, serialize_list
 
 router = APIRouter(prefix="/api/prizes", tags=["prizes"])
 
+# 同一进程内同一奖项的抽奖串行执行；不同奖项可以并行，冲突由条件UPDATE检测
+_draw_locks: Dict[int, threading.Lock] = {}
+_draw_locks_guard = threading.Lock()
+
+
+def _prize_lock(prize_id: int) -> threading.Lock:
+    """获取奖项的抽奖锁"""
+    with _draw_locks_guard:
+        return _draw_locks.setdefault(prize_id, threading.Lock())
+
+
+def _conflict(db: Session, prize_id: int, message: str) -> HTTPException:
+    """构造409错误，detail 中带奖项当前的剩余名额和版本号"""
+    current = db.execute(
+        select(PrizeModel.count, PrizeModel.is_used_count, PrizeModel.version).where(PrizeModel.id == prize_id)
+    ).first()
+    if current is None:
+        return HTTPException(status_code=404, detail="Prize not found")
+    return HTTPException(status_code=409, detail={
+        "message": message,
+        "remaining": max(current.count - current.is_used_count, 0),
+        "version": current.version,
+    })
+
+
+def _claim_slots(db: Session, prize_id: int, count: int, expected_version: Optional[int] = None, **values):
+    """
+    原子地占用奖项的 count 个名额（条件UPDATE，不提交事务）
+
+    剩余名额不足（或传入的版本号已变化）时不修改任何数据，直接返回409，
+    不需要加锁读取奖项，不同奖项的抽奖可以并行。
+
+    Args:
+        expected_version: 读取奖项时的版本号，传入时还要求版本号未变
+        values: 同一条UPDATE中一起写入的其他列（如分批状态）
+
+    Returns:
+        更新后的 (is_used_count, is_used, version)
+
+    Raises:
+        HTTPException: 奖项不存在（404）或名额不足/版本号已变化（409）
+    """
+    used_count = PrizeModel.is_used_count + count
+    stmt = (
+        update(PrizeModel)
+        .where(PrizeModel.id == prize_id, used_count <= PrizeModel.count)
+        .values(is_used_count=used_count, is_used=used_count >= PrizeModel.count,
+                version=PrizeModel.version + 1, **values)
+        .returning(PrizeModel.is_used_count, PrizeModel.is_used, PrizeModel.version)
+        .execution_options(synchronize_session=False, **{RECORD_CHANGES_OPTION: False})
+    )
+    if expected_version is not None:
+        stmt = stmt.where(PrizeModel.version == expected_version)
+    row = db.execute(stmt).first()
+    if row is None:
+        raise _conflict(db, prize_id, "Not enough prize slots remaining or prize was modified concurrently")
+    record_changes(db, PrizeModel.__tablename__, [prize_id])
+    return row
+
 
 @router.get("/", response_model=List[Prize])
-def get_all_prizes(db: Session = Depends(get_db)):
+async def get_all_prizes(request: Request, db: AsyncSession = Depends(get_async_db)):
     """获取所有奖项"""
-    prizes = db.query(PrizeModel).order_by(PrizeModel.sort).all()
-    return prizes
+    async def build():
+        prizes = (await db.scalars(select(PrizeModel).order_by(PrizeModel.sort))).all()
+        return serialize_list(Prize, prizes)
+    return cached_json_response(request, await response_cache.aget_or_build("prizes:all", ["prizes"], build))
 
 
 @router.get("/{prize_id}", response_model=Prize)
-def get_prize(prize_id: int, db: Session = Depends(get_db)):
+async def get_prize(prize_id: int, db: AsyncSession = Depends(get_async_db)):
     """根据ID获取奖项"""
-    prize = db.query(PrizeModel).filter(PrizeModel.id == prize_id).first()
+    prize = await db.get(PrizeModel, prize_id)
     if not prize:
         raise HTTPException(status_code=404, detail="Prize not found")
     return prize
 
 
 @router.get("/current", response_model=Prize)
-def get_current_prize(db: Session = Depends(get_db)):
+async def get_current_prize(db: AsyncSession = Depends(get_async_db)):
     """获取当前奖项（第一个未使用的奖项）"""
-    prize = db.query(PrizeModel).filter(PrizeModel.is_used == False).order_by(PrizeModel.sort).first()
+    prize = await db.scalar(
+        select(PrizeModel).where(PrizeModel.is_used == False).order_by(PrizeModel.sort).limit(1)
+    )
     if not prize:
         raise HTTPException(status_code=404, detail="No available prize found")
     return prize
@@ -57,6 +133,7 @@ def create_prize(prize: PrizeCreate, db: Session = Depends(get_db)):
     db.add(db_prize)
     db.commit()
     db.refresh(db_prize)
+    event_bus.publish("prize.created", prize=Prize.model_validate(db_prize).model_dump(mode="json"))
     return db_prize
 
 
@@ -87,6 +164,7 @@ def create_prizes_batch(prizes: List[PrizeCreate], db: Session = Depends(get_db)
     db.commit()
     for db_prize in db_prizes:
         db.refresh(db_prize)
+    event_bus.publish("prizes.changed", created=len(db_prizes))
     return db_prizes
 
 
@@ -98,6 +176,10 @@ def update_prize(prize_id: int, prize_update: PrizeUpdate, db: Session = Depends
         raise HTTPException(status_code=404, detail="Prize not found")
 
     update_data = prize_update.model_dump(exclude_unset=True)
+    changes = prize_update.model_dump(mode="json", exclude_unset=True, exclude={"version"})
+    expected_version = update_data.pop("version", None)
+    if expected_version is not None and expected_version != db_prize.version:
+        raise _conflict(db, prize_id, "Prize was modified concurrently")
 
     # 处理嵌套的picture和separate_count
     if "picture" in update_data:
@@ -121,8 +203,15 @@ def update_prize(prize_id: int, prize_update: PrizeUpdate, db: Session = Depends
     else:
         db_prize.is_used = False
 
-    db.commit()
+    try:
+        # 版本号在读取之后被其他请求修改时，ORM的UPDATE不会匹配到行
+        db.commit()
+    except StaleDataError:
+        db.rollback()
+        raise _conflict(db, prize_id, "Prize was modified concurrently")
     db.refresh(db_prize)
+    changes["is_used"] = db_prize.is_used
+    event_bus.publish("prize.updated", id=prize_id, changes=changes)
     return db_prize
 
 
@@ -135,6 +224,7 @@ def delete_prize(prize_id: int, db: Session = Depends(get_db)):
 
     db.delete(db_prize)
     db.commit()
+    event_bus.publish("prize.deleted", id=prize_id)
     return {"status": "success", "message": "Prize deleted successfully"}
 
 
@@ -143,6 +233,7 @@ def delete_all_prizes(db: Session = Depends(get_db)):
     """删除所有奖项"""
     db.query(PrizeModel).delete()
     db.commit()
+    event_bus.publish("prizes.changed", deleted_all=True)
     return {"status": "success", "message": "All prizes deleted successfully"}
 
 
@@ -160,9 +251,185 @@ def set_current_prize(prize_id: int, db: Session = Depends(get_db)):
     return {"status": "success", "message": "Current prize set successfully", "prize": db_prize}
 
 
+@router.post("/{prize_id}/claim", response_model=Prize)
+def claim_prize_slots(prize_id: int, claim: PrizeClaim, db: Session = Depends(get_db)):
+    """原子地占用奖项的名额（客户端自行抽奖时使用，代替直接修改 is_used_count）"""
+    is_used_count, is_used, _ = _claim_slots(db, prize_id, claim.count, expected_version=claim.version)
+    db.commit()
+    event_bus.publish("prize.updated", id=prize_id, changes={"is_used_count": is_used_count, "is_used": is_used})
+    return db.query(PrizeModel).filter(PrizeModel.id == prize_id).first()
+
+
+def _reset_prizes(db: Session) -> int:
+    """内部函数：批量重置奖项（不提交事务），返回奖项数量"""
+    # 各批次的已抽数量在JSON列中，逐个奖项清零（Core层按主键批量UPDATE，版本号由下面的整表UPDATE递增）
+    separate_rows = [
+        {"prize_id": prize_id, "separate_list": [dict(item, is_used_count=0) for item in separate_list]}
+        for prize_id, separate_list in db.query(PrizeModel.id, PrizeModel.separate_count_list)
+        if separate_list
+    ]
+    if separate_rows:
+        prizes = PrizeModel.__table__
+        db.execute(
+            update(prizes)
+            .where(prizes.c.id == bindparam("prize_id"))
+            .values(separate_count_list=bindparam("separate_list")),
+            separate_rows,
+        )
+    return db.query(PrizeModel).update(
+        {"is_used": False, "is_used_count": 0, "version": PrizeModel.version + 1}, synchronize_session=False
+    )
+
+
 @router.post("/reset")
 def reset_prizes(db: Session = Depends(get_db)):
     """重置所有奖项"""
-    db.query(PrizeModel).update({"is_used": False, "is_used_count": 0})
+    count = _reset_prizes(db)
     db.commit()
+    event_bus.publish("prizes.reset", count=count)
     return {"status": "success", "message": "All prizes reset successfully"}
+
+
+def _current_separate_index(db_prize: PrizeModel) -> Optional[int]:
+    """获取当前进行中的分批下标（第一个未抽完的批次）"""
+    if not db_prize.separate_count_enable:
+        return None
+    for index, item in enumerate(db_prize.separate_count_list or []):
+        if item.get("is_used_count", 0) < item.get("count", 0):
+            return index
+    return None
+
+
+@router.post("/{prize_id}/draw", response_model=DrawResult)
+def draw_prize(prize_id: int, draw: Optional[DrawRequest] = None, db: Session = Depends(get_db)):
+    """服务端抽奖：从候选池中抽取中奖人员，并在同一事务中写入人员和奖项"""
+    with _prize_lock(prize_id):
+        # 不加行锁读取奖项，写入时用条件UPDATE检查名额和版本号，其他进程的并发抽奖会得到409
+        db_prize = db.query(PrizeModel).filter(PrizeModel.id == prize_id).first()
+        if not db_prize:
+            raise HTTPException(status_code=404, detail="Prize not found")
+
+        remaining = db_prize.count - db_prize.is_used_count
+        if remaining <= 0:
+            raise HTTPException(status_code=400, detail="Prize already completed")
+
+        # 分批抽取时，本轮最多抽取当前批次的剩余数量
+        separate_index = _current_separate_index(db_prize)
+        if separate_index is not None:
+            separate_item = db_prize.separate_count_list[separate_index]
+            remaining = min(remaining, separate_item["count"] - separate_item.get("is_used_count", 0))
+
+        count = remaining
+        if draw is not None and draw.count is not None:
+            count = min(draw.count, remaining)
+
+        pool = eligibility_index.pool(db, str(db_prize.id), db_prize.is_all, db_prize.frequency)
+        draw = draw or DrawRequest()
+        exclusions = {}
+        if draw.exclude_person_ids or draw.exclude_departments:
+            excluded_ids = set(draw.exclude_person_ids)
+            excluded_departments = set(draw.exclude_departments)
+            departments = eligibility_index.departments(pool) if excluded_departments else {}
+            pool = [
+                pid for pid in pool
+                if pid not in excluded_ids and departments.get(pid) not in excluded_departments
+            ]
+            exclusions = draw.model_dump(include={"exclude_person_ids", "exclude_departments"})
+        if not pool:
+            raise HTTPException(status_code=400, detail="No eligible persons for this prize")
+        count = min(count, len(pool))
+
+        # 部门名额包括此奖项之前各轮已抽出的人次
+        quotas = {}
+        if draw.department_quotas:
+            won = eligibility_index.department_win_counts(str(db_prize.id))
+            quotas = {name: quota - won.get(name, 0) for name, quota in draw.department_quotas.items()}
+
+        # 用新的随机种子抽取，种子和候选池写入审计记录，之后可以重放校验
+        drawn = draw_engine.draw(
+            pool,
+            count,
+            weights=eligibility_index.weights(pool),
+            departments=eligibility_index.departments(pool) if quotas else None,
+            quotas=quotas,
+            exclusions=exclusions,
+        )
+        winner_ids = drawn["winner_ids"]
+        if not winner_ids:
+            raise HTTPException(status_code=400, detail="No eligible persons within weights and department quotas")
+        winners_by_id = {
+            person.id: person
+            for person in db.query(PersonModel)
+            .options(defer(PersonModel.avatar))
+            .filter(PersonModel.id.in_(winner_ids))
+        }
+        # 候选池过期：抽中的人员已被其他进程删除
+        if len(winners_by_id) != len(winner_ids):
+            db.rollback()
+            eligibility_index.invalidate()
+            raise _conflict(db, prize_id, "Drawn persons were deleted concurrently, please retry")
+        winners =[winners_by_id[person_id] for person_id in winner_ids]
+
+        # 占用名额并更新分批状态（条件UPDATE，读取之后奖项被修改或名额被抽走时返回409）
+        claim_values = {}
+        if separate_index is not None:
+            separate_list = [dict(item) for item in db_prize.separate_count_list]
+            separate_list[separate_index]["is_used_count"] = separate_list[separate_index].get("is_used_count", 0) + len(winners)
+            claim_values["separate_count_list"] = separate_list
+        _claim_slots(db, db_prize.id, len(winners), expected_version=db_prize.version, **claim_values)
+
+        # 非全员奖项只能抽给未中过奖的人：其他奖项的并发抽奖已抽中同一个人时返回409
+        if not db_prize.is_all:
+            claimed = db.execute(
+                update(PersonModel)
+                .where(PersonModel.id.in_(winner_ids), PersonModel.is_win.is_not(True))
+                .values(is_win=True)
+                .execution_options(synchronize_session=False, **{RECORD_CHANGES_OPTION: False})
+            ).rowcount
+            if claimed != len(winner_ids):
+                db.rollback()
+                eligibility_index.invalidate()
+                raise _conflict(db, prize_id, "Winners were drawn concurrently by another prize, please retry")
+        db.refresh(db_prize)
+
+        # 写入中奖信息（JSON列需要赋新列表才能被检测到变更）
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        audit = DrawAuditModel(prize_id=str(db_prize.id), prize_name=db_prize.name, create_time=now, **drawn)
+        db.add(audit)
+        for person in winners:
+            person.is_win = True
+            person.prize_name = list(person.prize_name or []) + [db_prize.name]
+            person.prize_id = list(person.prize_id or []) + [str(db_prize.id)]
+            person.prize_time = list(person.prize_time or []) + [now]
+        if winners:
+            db.execute(PersonPrizeModel.__table__.insert(), [
+                row
+                for person in winners
+                for row in person_prize_rows(person.id, [db_prize.id], [db_prize.name], [now])
+            ])
+
+        db.flush()
+        result = DrawResult(
+            prize=Prize.model_validate(db_prize),
+            winners=[PersonWithoutAvatar.model_validate(person) for person in winners],
+            pool_size=len(pool),
+            audit_id=audit.id,
+        )
+        db.commit()
+        eligibility_index.mark_winners([person.id for person in winners], str(db_prize.id))
+        device_cache.update(result.winners)
+        # 使用提交前构造好的结果，提交后不再访问已过期的ORM对象
+        event_bus.publish(
+            "draw",
+            prize_id=prize_id,
+            audit_id=result.audit_id,
+            is_used_count=result.prize.is_used_count,
+            is_used=result.prize.is_used,
+            separate_count=result.prize.separate_count.model_dump(mode="json"),
+            winners=[
+                {"id": person.id, "uid": person.uid, "name": person.name, "department": person.department,
+                 "thumbnail_avatar": person.thumbnail_avatar, "prize_time": now}
+                for person in result.winners
+            ],
+        )
+        return result
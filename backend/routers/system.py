@@ -0,0 +1,123 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, defer
+from typing import Dict, List, Tuple
+import time
+
+from change_log import OP_DELETE, OP_RESYNC, OP_UPSERT, SYNC_MAX_CHANGES
+from database import (
+    get_db, get_async_db, ChangeLog as ChangeLogModel, Department as DepartmentModel,
+    Person as PersonModel, Prize as PrizeModel,
+)
+from device_cache import device_cache
+from eligibility import eligibility_index
+from event_bus import event_bus
+from idempotency import idempotency_store
+from routers.config import _aget_global_config_internal
+from routers.persons import _reset_won_status
+from routers.prizes import _reset_prizes
+from schemas import (
+    Department, DepartmentDelta, PersonDelta, PersonWithoutAvatar, Prize, PrizeDelta, SyncResult,
+)
+
+router = APIRouter(prefix="/api", tags=["system"])
+
+
+@router.post("/reset")
+def reset_all(db: Session = Depends(get_db)):
+    """在同一事务中重置人员中奖状态和所有奖项"""
+    start = time.perf_counter()
+    persons_reset = _reset_won_status(db)
+    prizes_reset = _reset_prizes(db)
+    db.commit()
+    eligibility_index.invalidate()
+    device_cache.invalidate()
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    event_bus.publish("reset", persons_reset=persons_reset, prizes_reset=prizes_reset)
+    return {
+        "status": "success",
+        "message": "Persons and prizes reset successfully",
+        "stats": {
+            "persons_reset": persons_reset,
+            "prizes_reset": prizes_reset,
+            "elapsed_ms": round(elapsed_ms, 2),
+        },
+    }
+
+
+@router.get("/stats")
+def get_stats():
+    """进程内缓存和事件推送的统计（命中/未命中次数等）"""
+    return {
+        "device_cache": device_cache.stats(),
+        "idempotency": idempotency_store.stats(),
+        "events": event_bus.stats(),
+    }
+
+
+async def _load_changed_rows(db: AsyncSession, model, ops: Dict[int, str], options=()) -> Tuple[List, List[int]]:
+    """读取被修改行的当前数据，返回 (现存的行, 被删除的id)"""
+    upsert_ids = sorted(row_id for row_id, op in ops.items() if op == OP_UPSERT)
+    deleted = {row_id for row_id, op in ops.items() if op == OP_DELETE}
+    rows = []
+    # 分段查询，避免超过SQLite的参数数量上限
+    for start in range(0, len(upsert_ids), 500):
+        chunk = upsert_ids[start:start + 500]
+        rows.extend((await db.scalars(
+            select(model).options(*options).where(model.id.in_(chunk)).order_by(model.id)
+        )).all())
+    # 记录为修改但现在已不存在的行按删除返回
+    found = {row.id for row in rows}
+    deleted.update(row_id for row_id in upsert_ids if row_id not in found)
+    return rows, sorted(deleted)
+
+
+@router.get("/sync", response_model=SyncResult)
+async def sync_changes(since: int = Query(0, ge=0), db: AsyncSession = Depends(get_async_db)):
+    """增量同步：返回 since 之后变化的人员、奖项、部门和全局配置"""
+    oldest, latest = (await db.execute(
+        select(func.min(ChangeLogModel.seq), func.max(ChangeLogModel.seq))
+    )).one()
+    latest = latest or 0
+    # since 为0（首次同步）、早于保留的变更记录或大于当前位置（数据库被重建）时需要全量同步
+    if since == 0 or since > latest or (oldest is not None and since < oldest - 1):
+        return SyncResult(seq=latest, full_resync=True)
+
+    changes = (await db.execute(
+        select(ChangeLogModel.seq, ChangeLogModel.table_name, ChangeLogModel.row_id, ChangeLogModel.op)
+        .where(ChangeLogModel.seq > since)
+        .order_by(ChangeLogModel.seq)
+        .limit(SYNC_MAX_CHANGES + 1)
+    )).all()
+    if len(changes) > SYNC_MAX_CHANGES:
+        return SyncResult(seq=latest, full_resync=True)
+
+    # 同一行只保留最后一次变更
+    ops: Dict[str, Dict[int, str]] = {}
+    resync = set()
+    for _, table_name, row_id, op in changes:
+        if op == OP_RESYNC:
+            resync.add(table_name)
+        else:
+            ops.setdefault(table_name, {})[row_id] = op
+
+    result = SyncResult(seq=changes[-1].seq if changes else since)
+    if "persons" in resync:
+        result.persons = PersonDelta(resync=True)
+    elif "persons" in ops:
+        rows, deleted = await _load_changed_rows(db, PersonModel, ops["persons"], (defer(PersonModel.avatar),))
+        result.persons = PersonDelta(upserted=[PersonWithoutAvatar.model_validate(row) for row in rows], deleted=deleted)
+    if "prizes" in resync:
+        result.prizes = PrizeDelta(resync=True)
+    elif "prizes" in ops:
+        rows, deleted = await _load_changed_rows(db, PrizeModel, ops["prizes"])
+        result.prizes = PrizeDelta(upserted=[Prize.model_validate(row) for row in rows], deleted=deleted)
+    if "departments" in resync:
+        result.departments = DepartmentDelta(resync=True)
+    elif "departments" in ops:
+        rows, deleted = await _load_changed_rows(db, DepartmentModel, ops["departments"])
+        result.departments = DepartmentDelta(upserted=[Department.model_validate(row) for row in rows], deleted=deleted)
+    if "global_config" in resync or "global_config" in ops:
+        result.global_config = await _aget_global_config_internal(db)
+    return result
@@ -15,6 +15,8 @@ class PersonBase(BaseModel):
     thumbnail_avatar: str = ""
     device_fingerprint: str = ""
     is_win: bool = False
+    # 抽奖权重（中奖概率与权重成正比），0 表示不参与抽奖
+    weight: float = Field(default=1.0, ge=0)
     x: int = 0
     y: int = 0
     create_time: str = ""
@@ -39,6 +41,7 @@ class PersonUpdate(BaseModel):
     thumbnail_avatar: Optional[str] = None
     device_fingerprint: Optional[str] = None
     is_win: Optional[bool] = None
+    weight: Optional[float] = Field(default=None, ge=0)
     x: Optional[int] = None
     y: Optional[int] = None
     create_time: Optional[str] = None
@@ -66,6 +69,7 @@ class PersonWithoutAvatar(BaseModel):
     thumbnail_avatar: str = ""
     device_fingerprint: str = ""
     is_win: bool = False
+    weight: float = 1.0
     x: int = 0
     y: int = 0
     create_time: str = ""
@@ -78,6 +82,40 @@ class PersonWithoutAvatar(BaseModel):
         from_attributes = True
 
 
+# 手机端按设备指纹查询的精简人员信息（不含头像原图）
+class PersonDeviceSummary(BaseModel):
+    id: int
+    uuid: str = ""
+    name: str
+    department: str = ""
+    position: str = ""
+    thumbnail_avatar: str = ""
+    is_win: bool = False
+    prize_name: List[str] = []
+    prize_id: List[str] = []
+    prize_time: List[str] = []
+
+    class Config:
+        from_attributes = True
+
+
+# 手机端长轮询的中奖状态（最近一次中奖的奖项），version 在状态变化时改变
+class PersonStatus(BaseModel):
+    id: int
+    is_win: bool = False
+    prize_id: Optional[str] = None
+    prize_name: Optional[str] = None
+    prize_time: Optional[str] = None
+    version: str
+
+
+class PersonPage(BaseModel):
+    # 只包含请求的字段（fields参数），id 始终返回
+    items: List[Dict[str, Any]]
+    # 下一页游标（作为 after 参数传回），没有更多数据时为 None
+    next_cursor: Optional[int] = None
+
+
 # ==================== 奖项相关模型 ====================
 class SeparateCountItem(BaseModel):
     id: str
@@ -127,10 +165,13 @@ class PrizeUpdate(BaseModel):
     is_show: Optional[bool] = None
     is_used: Optional[bool] = None
     frequency: Optional[int] = None
+    # 读取奖项时的版本号，传入时只有版本号未变才更新，否则返回409
+    version: Optional[int] = None
 
 
 class Prize(PrizeBase):
     id: int
+    version: int = 0
 
     class Config:
         from_attributes = True
@@ -251,3 +292,115 @@ class Department(DepartmentBase):
 
     class Config:
         from_attributes = True
+
+
+# ==================== 抽奖相关模型 ====================
+class DrawRequest(BaseModel):
+    # 本轮抽取人数，不传时按奖项剩余数量（或当前分批剩余数量）抽取
+    count: Optional[int] = Field(default=None, ge=1)
+    # 各部门在此奖项中最多的中奖人次（包括之前的轮次），未列出的部门不限
+    department_quotas: Dict[str, int] = {}
+    # 不参与本轮抽奖的部门和人员
+    exclude_departments: List[str] = []
+    exclude_person_ids: List[int] = []
+
+
+class PrizeClaim(BaseModel):
+    # 占用的名额数
+    count: int = Field(ge=1)
+    # 读取奖项时的版本号，传入时只有版本号未变才占用
+    version: Optional[int] = None
+
+
+class DrawResult(BaseModel):
+    prize: Prize
+    winners: List[PersonWithoutAvatar]
+    pool_size: int
+    # 本轮抽奖的审计记录ID（GET /api/draws/{audit_id}）
+    audit_id: Optional[int] = None
+
+
+class DrawAuditSummary(BaseModel):
+    id: int
+    prize_id: str
+    prize_name: str = ""
+    algorithm: str
+    seed: str
+    pool_size: int
+    pool_hash: str
+    winner_ids: List[int] = []
+    create_time: str = ""
+
+    class Config:
+        from_attributes = True
+
+
+class DrawAudit(DrawAuditSummary):
+    # 候选池的连续ID区间，重放时展开
+    pool_ranges: List[List[int]] = []
+    # 加权/分层抽取的参数：weights（不为1的权重）、departments（部门 -> ID区间）、quotas（部门剩余名额）、排除规则
+    options: Optional[Dict[str, Any]] = None
+
+
+class DrawVerifyResult(BaseModel):
+    audit_id: int
+    valid: bool
+    pool_valid: bool
+    winners_valid: bool
+    replayed_winner_ids: List[int] = []
+
+
+# ==================== 人员导入相关模型 ====================
+class PersonImportSummary(BaseModel):
+    inserted: int = 0
+    updated: int = 0
+    skipped: int = 0
+    chunks: int = 0
+    # 连续ID区间列表，例如 [[1, 500], [720, 730]]
+    inserted_id_ranges: List[List[int]] = []
+    updated_id_ranges: List[List[int]] = []
+    # 区间数超过上限（1000）时为 true，之后的ID不再记录
+    id_ranges_truncated: bool = False
+    # 流式导入时校验失败的行数及错误信息（最多保留前100条）
+    invalid: int = 0
+    errors: List[str] = []
+
+
+class PersonImportProgress(BaseModel):
+    import_id: str
+    status: str  # running / done / failed
+    bytes_read: int = 0
+    rows_read: int = 0
+    summary: PersonImportSummary = PersonImportSummary()
+
+
+# ==================== 增量同步相关模型 ====================
+class PersonDelta(BaseModel):
+    # resync 为 True 时该表有无法逐行记录的批量修改，客户端需要重新拉取整张表
+    resync: bool = False
+    upserted: List[PersonWithoutAvatar] = []
+    deleted: List[int] = []
+
+
+class PrizeDelta(BaseModel):
+    resync: bool = False
+    upserted: List[Prize] = []
+    deleted: List[int] = []
+
+
+class DepartmentDelta(BaseModel):
+    resync: bool = False
+    upserted: List[Department] = []
+    deleted: List[int] = []
+
+
+class SyncResult(BaseModel):
+    # 本次同步到的位置，下次请求时作为 since 传入
+    seq: int
+    # 为 True 时客户端需要重新拉取全部数据（since 过旧或变更太多）
+    full_resync: bool = False
+    persons: PersonDelta = PersonDelta()
+    prizes: PrizeDelta = PrizeDelta()
+    departments: DepartmentDelta = DepartmentDelta()
+    # 全局配置有变化时返回完整配置
+    global_config: Optional[GlobalConfig] = None
@@ -0,0 +1,124 @@
+"""
+数据表版本号
+
+每张表维护一个单调递增的版本号。通过 Session 事件自动收集事务中写过的表
+（ORM对象的增删改以及 insert/update/delete 批量语句），在事务提交后统一加一，
+所有写接口都不需要手动维护。
+
+多进程/多主机共用一个数据库时，版本号改为保存在数据库的 table_versions 表中：
+在提交前与数据修改在同一事务中加一，读取时查询该表，各进程的缓存因此保持一致。
+"""
+
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import Table, event, select, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.orm import Session
+
+# Session.info 中记录本事务写过的表名
+_TOUCHED_KEY = "touched_tables"
+
+
+class TableVersions:
+    """表版本号（默认在进程内，调用 use_database 后保存在数据库中）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions: Dict[str, int] = {}
+        self._engine: Optional[Engine] = None
+        self._async_engine: Optional[AsyncEngine] = None
+        self.table: Optional[Table] = None
+
+    @property
+    def shared(self) -> bool:
+        return self._engine is not None
+
+    def use_database(self, engine: Engine, table: Table, async_engine: Optional[AsyncEngine] = None):
+        """改为从数据库的版本号表读取版本号"""
+        self._engine = engine
+        self._async_engine = async_engine
+        self.table = table
+
+    def _load_shared(self) -> Dict[str, int]:
+        with self._engine.connect() as connection:
+            return dict(connection.execute(select(self.table.c.name, self.table.c.version)).all())
+
+    def get(self, table: str) -> int:
+        if self.shared:
+            return self._load_shared().get(table, 0)
+        return self._versions.get(table, 0)
+
+    def snapshot(self, tables: Iterable[str]) -> Tuple[int, ...]:
+        if self.shared:
+            versions = self._load_shared()
+            return tuple(versions.get(table, 0) for table in tables)
+        with self._lock:
+            return tuple(self._versions.get(table, 0) for table in tables)
+
+    async def asnapshot(self, tables: Iterable[str]) -> Tuple[int, ...]:
+        """snapshot 的异步版本（共享模式下不阻塞事件循环）"""
+        if self.shared and self._async_engine is not None:
+            async with self._async_engine.connect() as connection:
+                result = await connection.execute(select(self.table.c.name, self.table.c.version))
+                versions = dict(result.all())
+            return tuple(versions.get(table, 0) for table in tables)
+        return self.snapshot(tables)
+
+    def bump(self, tables: Iterable[str]):
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+
+
+table_versions = TableVersions()
+
+
+def _touch(session: Session, table_name: str):
+    if table_versions.table is not None and table_name == table_versions.table.name:
+        return
+    session.info.setdefault(_TOUCHED_KEY, set()).add(table_name)
+
+
+def track_table_changes(session_factory):
+    """为会话工厂注册事件，在提交后递增被修改表的版本号"""
+
+    @event.listens_for(session_factory, "after_flush")
+    def _collect_flushed(session, flush_context):
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+            table = getattr(obj, "__table__", None)
+            if table is not None:
+                _touch(session, table.name)
+
+    @event.listens_for(session_factory, "do_orm_execute")
+    def _collect_bulk(orm_execute_state):
+        if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+            table = getattr(orm_execute_state.statement, "table", None)
+            if table is not None:
+                _touch(orm_execute_state.session, table.name)
+
+    @event.listens_for(session_factory, "before_commit")
+    def _bump_shared(session):
+        if not table_versions.shared:
+            return
+        # 先刷新，确保本事务写过的表都已收集
+        session.flush()
+        touched = session.info.get(_TOUCHED_KEY)
+        if touched:
+            version_table = table_versions.table
+            session.execute(
+                update(version_table)
+                .where(version_table.c.name.in_(sorted(touched)))
+                .values(version=version_table.c.version + 1)
+            )
+
+    @event.listens_for(session_factory, "after_commit")
+    def _bump_committed(session):
+        touched = session.info.pop(_TOUCHED_KEY, None)
+        if touched and not table_versions.shared:
+            table_versions.bump(touched)
+
+    @event.listens_for(session_factory, "after_rollback")
+    def _discard_rolled_back(session):
+        session.info.pop(_TOUCHED_KEY, None)
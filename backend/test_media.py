@@ -0,0 +1,57 @@
+"""
+图片上传和内容寻址存储的测试
+"""
+
+import io
+import os
+import uuid
+
+from PIL import Image
+
+from database import SessionLocal, Image as ImageModel
+from upload_store import UPLOAD_DIR
+
+
+def _upload(client, color):
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), color).save(buffer, format="PNG")
+    response = client.post("/api/media/upload", files={"file": ("test.png", buffer.getvalue(), "image/png")})
+    assert response.status_code == 200
+    return response.json()
+
+
+def _add_images(url, count):
+    """直接写入使用同一个文件的图片记录，返回图片ID"""
+    db = SessionLocal()
+    try:
+        ids = [uuid.uuid4().hex for _ in range(count)]
+        db.add_all(ImageModel(id=image_id, name="test", url=url) for image_id in ids)
+        db.commit()
+        return ids
+    finally:
+        db.close()
+
+
+def test_shared_blob_kept_until_last_image_deleted(client):
+    """两张图片使用同一个文件时，删除其中一张不删除文件"""
+    upload = _upload(client, (10, 20, 30))
+    path = os.path.join(UPLOAD_DIR, upload["filename"])
+    first, second = _add_images(upload["url"], 2)
+
+    assert client.delete(f"/api/media/images/{first}").status_code == 200
+    assert os.path.isfile(path)
+    assert client.get(upload["url"]).status_code == 200
+
+    assert client.delete(f"/api/media/images/{second}").status_code == 200
+    assert not os.path.isfile(path)
+
+
+def test_blob_used_as_avatar_kept_after_image_deleted(client):
+    """人员头像与图片使用同一个文件时，删除图片不删除文件"""
+    upload = _upload(client, (40, 50, 60))
+    path = os.path.join(UPLOAD_DIR, upload["filename"])
+    (image_id,) = _add_images(upload["url"], 1)
+    client.post("/api/persons/", json={"uuid": "avatar-owner", "name": "头像", "avatar": upload["url"]})
+
+    assert client.delete(f"/api/media/images/{image_id}").status_code == 200
+    assert os.path.isfile(path)
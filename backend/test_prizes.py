@@ -0,0 +1,92 @@
+"""
+奖项和服务端抽奖的测试
+"""
+
+import json
+
+from database import SessionLocal, Person as PersonModel, Prize as PrizeModel
+from eligibility import eligibility_index
+
+
+def _separate_prize(client, batches):
+    """创建分批抽取的奖项，batches 为各批次的人数"""
+    return client.post("/api/prizes/", json={
+        "name": "分批奖",
+        "count": sum(batches),
+        "separate_count": {
+            "enable": True,
+            "count_list": [
+                {"id": str(index), "count": count, "is_used_count": 0} for index, count in enumerate(batches)
+            ],
+        },
+    }).json()
+
+
+def _separate_list(prize_id):
+    db = SessionLocal()
+    try:
+        return db.get(PrizeModel, prize_id).separate_count_list
+    finally:
+        db.close()
+
+
+def test_reset_clears_separate_batches(client):
+    """重置后各批次的已抽数量清零，再次抽奖从第一批开始"""
+    client.post("/api/persons/batch", json=[{"uuid": f"reset-{i}", "name": f"人员{i}"} for i in range(10)])
+    prize = _separate_prize(client, [2, 2])
+    for _ in range(2):
+        assert client.post(f"/api/prizes/{prize['id']}/draw").status_code == 200
+    assert [item["is_used_count"] for item in _separate_list(prize["id"])] == [2, 2]
+
+    assert client.post("/api/reset").status_code == 200
+    assert [item["is_used_count"] for item in _separate_list(prize["id"])] == [0, 0]
+
+    response = client.post(f"/api/prizes/{prize['id']}/draw")
+    assert response.status_code == 200
+    assert len(response.json()["winners"]) == 2
+    assert [item["is_used_count"] for item in _separate_list(prize["id"])] == [2, 0]
+
+
+def test_draw_reports_separate_batches(client):
+    """抽奖响应和 draw 事件中的分批状态来自奖项的分批列"""
+    client.post("/api/persons/batch", json=[{"uuid": f"event-{i}", "name": f"人员{i}"} for i in range(10)])
+    prize = _separate_prize(client, [2, 3])
+    assert [item["count"] for item in prize["separate_count"]["count_list"]] == [2, 3]
+
+    with client.websocket_connect("/api/ws") as ws:
+        response = client.post(f"/api/prizes/{prize['id']}/draw")
+        event = json.loads(ws.receive_text())
+
+    assert response.status_code == 200
+    expected = {
+        "enable": True,
+        "count_list": [
+            {"id": "0", "count": 2, "is_used_count": 2},
+            {"id": "1", "count": 3, "is_used_count": 0},
+        ],
+    }
+    assert response.json()["prize"]["separate_count"] == expected
+    assert event["type"] == "draw"
+    assert event["separate_count"] == expected
+
+
+def test_draw_conflict_when_drawn_person_deleted(client):
+    """候选池过期（抽中的人员已被其他进程删除）时返回409，重试时使用新的候选池"""
+    persons = client.post("/api/persons/batch", json=[{"uuid": f"gone-{i}", "name": f"人员{i}"} for i in range(2)]).json()
+    prize = client.post("/api/prizes/", json={"name": "全员奖", "count": 2}).json()
+    # 加载候选池后绕过接口直接删除人员，模拟其他进程的修改
+    db = SessionLocal()
+    try:
+        eligibility_index.pool(db, str(prize["id"]), False, 1)
+        db.query(PersonModel).filter(PersonModel.id == persons[0]["id"]).delete()
+        db.commit()
+    finally:
+        db.close()
+
+    response = client.post(f"/api/prizes/{prize['id']}/draw")
+    assert response.status_code == 409
+    assert response.json()["detail"]["remaining"] == 2
+
+    response = client.post(f"/api/prizes/{prize['id']}/draw")
+    assert response.status_code == 200
+    assert [person["id"] for person in response.json()["winners"]] == [persons[1]["id"]]
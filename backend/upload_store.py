@@ -0,0 +1,235 @@
+"""
+内容寻址的上传文件存储
+
+所有上传（图片上传接口、image_utils.save_image、头像迁移脚本）都经过这里：
+文件按原始内容的SHA-256命名，边读边算哈希，不在内存中缓存整个文件；
+哈希命中时直接复用已有文件和缩略图，不做任何图片处理。
+upload_blobs 表记录每个文件的引用计数（每次上传加一，删除图片时减一）；
+同一个文件可能被多个图片、人员头像和奖项图片使用，计数归零且没有任何一行的URL指向该文件时才删除文件。
+"""
+
+import glob
+import hashlib
+import os
+import uuid
+from datetime import datetime
+from typing import Callable, Optional, Tuple
+
+import aiofiles
+from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import or_, select, update
+from sqlalchemy.orm import Session
+
+from database import UploadBlob, Image as ImageModel, Person as PersonModel, Prize as PrizeModel
+from db_config import upsert_insert
+from image_utils import generate_thumbnail
+from image_worker import image_pool, PoolSaturated
+
+UPLOAD_DIR = "uploads"
+THUMBNAIL_DIR = os.path.join(UPLOAD_DIR, "thumbnails")
+TEMP_DIR = os.path.join(UPLOAD_DIR, ".tmp")
+VARIANT_DIR = os.path.join(UPLOAD_DIR, "variants")
+# 流式读取上传文件时每次读取的字节数
+READ_CHUNK_SIZE = 1024 * 1024
+# 可能指向上传文件的URL列
+REFERENCE_COLUMNS = (
+    ImageModel.url, ImageModel.thumbnail_url,
+    PersonModel.avatar, PersonModel.thumbnail_avatar,
+    PrizeModel.picture_url, PrizeModel.picture_thumbnail_url,
+)
+
+for dir_path in [UPLOAD_DIR, THUMBNAIL_DIR, TEMP_DIR]:
+    if not os.path.exists(dir_path):
+        os.makedirs(dir_path)
+
+
+def file_url(filename: str) -> str:
+    return f"/api/uploads/{filename}"
+
+
+def thumbnail_url(thumbnail_filename: str) -> str:
+    return f"/api/uploads/thumbnails/{thumbnail_filename}" if thumbnail_filename else ""
+
+
+def blob_paths(digest: str, ext: str) -> Tuple[str, str, str, str]:
+    """返回 (文件名, 文件路径, 缩略图文件名, 缩略图路径)"""
+    filename = f"{digest}{ext}"
+    thumbnail_filename = f"thumb_{filename}"
+    return (
+        filename,
+        os.path.join(UPLOAD_DIR, filename),
+        thumbnail_filename,
+        os.path.join(THUMBNAIL_DIR, thumbnail_filename),
+    )
+
+
+def acquire(db: Session, digest: str) -> Optional[UploadBlob]:
+    """哈希已存在时引用计数加一并返回记录，否则返回 None（不提交事务）"""
+    result = db.execute(
+        update(UploadBlob)
+        .where(UploadBlob.hash == digest)
+        .values(ref_count=UploadBlob.ref_count + 1)
+    )
+    if result.rowcount == 0:
+        return None
+    return db.get(UploadBlob, digest, populate_existing=True)
+
+
+def register(db: Session, digest: str, filename: str, thumbnail_filename: str, size: int) -> UploadBlob:
+    """登记新文件（引用计数为1）；并发上传了相同内容时改为引用计数加一（不提交事务）"""
+    statement = upsert_insert(db, UploadBlob).values(
+        hash=digest,
+        filename=filename,
+        thumbnail_filename=thumbnail_filename,
+        size=size,
+        ref_count=1,
+        create_time=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    )
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[UploadBlob.hash],
+        set_={"ref_count": UploadBlob.ref_count + 1},
+    ))
+    return db.get(UploadBlob, digest, populate_existing=True)
+
+
+def referenced(db: Session, filename: str) -> bool:
+    """是否还有图片、人员头像或奖项图片的URL指向该文件（缩略图文件名包含原文件名，也会匹配）"""
+    for column in REFERENCE_COLUMNS:
+        if db.execute(select(column).where(column.contains(filename, autoescape=True)).limit(1)).first():
+            return True
+    return False
+
+
+def release(db: Session, url_or_filename: str) -> bool:
+    """
+    释放一次引用，计数归零且没有行再使用该文件时删除文件、缩略图和尺寸变体（不提交事务）
+
+    调用方需要先删除（或修改）不再使用该文件的行并 flush，再调用本函数。
+
+    Returns:
+        文件是否已被回收
+    """
+    if not url_or_filename:
+        return False
+    filename = os.path.basename(url_or_filename.split("?", 1)[0])
+    blob = db.query(UploadBlob).filter(UploadBlob.filename == filename).first()
+    if blob is None:
+        return False
+    db.execute(
+        update(UploadBlob)
+        .where(UploadBlob.hash == blob.hash, UploadBlob.ref_count > 0)
+        .values(ref_count=UploadBlob.ref_count - 1)
+    )
+    if db.scalar(select(UploadBlob.ref_count).where(UploadBlob.hash == blob.hash)) > 0:
+        return False
+    # 同一个文件可能被多行使用（复制的图片、与图片相同的头像等），计数归零后还在使用时保留
+    if referenced(db, blob.filename):
+        return False
+    deleted = db.query(UploadBlob).filter(
+        UploadBlob.hash == blob.hash, UploadBlob.ref_count <= 0
+    ).delete(synchronize_session=False)
+    if not deleted:
+        return False
+    variant_paths = glob.glob(os.path.join(VARIANT_DIR, f"{blob.hash}_*"))
+    for path in [
+        os.path.join(UPLOAD_DIR, blob.filename),
+        os.path.join(THUMBNAIL_DIR, blob.thumbnail_filename or ""),
+        *variant_paths,
+    ]:
+        if os.path.isfile(path):
+            os.remove(path)
+    return True
+
+
+def write_blob(
+    content: bytes,
+    ext: str,
+    digest: Optional[str] = None,
+    transform: Optional[Callable[[bytes], Tuple[bytes, str]]] = None,
+) -> Tuple[str, str, str, int]:
+    """
+    把文件内容写入存储目录并生成缩略图（不访问数据库，可在进程池中执行）
+    文件和缩略图已存在时直接跳过，不做任何图片处理
+
+    Returns:
+        (哈希, 文件名, 缩略图文件名, 文件大小)
+    """
+    digest = digest or hashlib.sha256(content).hexdigest()
+    if transform is not None:
+        content, ext = transform(content)
+    filename, path, thumbnail_filename, thumbnail_path = blob_paths(digest, ext)
+    if not os.path.exists(path):
+        temp_path = os.path.join(TEMP_DIR, uuid.uuid4().hex)
+        with open(temp_path, "wb") as f:
+            f.write(content)
+        os.replace(temp_path, path)
+    if not os.path.exists(thumbnail_path) and not generate_thumbnail(path, thumbnail_path):
+        thumbnail_filename = ""
+    return digest, filename, thumbnail_filename, len(content)
+
+
+def put_bytes(
+    db: Session,
+    content: bytes,
+    ext: str,
+    transform: Optional[Callable[[bytes], Tuple[bytes, str]]] = None,
+) -> UploadBlob:
+    """
+    保存内存中的文件内容（同步版本，供脚本和 image_utils 使用，不提交事务）
+
+    Args:
+        db: 数据库会话
+        content: 原始文件内容
+        ext: 文件扩展名（如 .jpg）
+        transform: 可选的处理函数，返回 (处理后的内容, 扩展名)；哈希命中时不会调用
+    """
+    digest = hashlib.sha256(content).hexdigest()
+    blob = acquire(db, digest)
+    if blob is not None:
+        return blob
+    return register(db, *write_blob(content, ext, digest, transform))
+
+
+async def put_upload(db: Session, file: UploadFile, ext: str) -> Tuple[UploadBlob, bool]:
+    """
+    流式保存上传文件：边读边写临时文件边计算哈希，哈希命中时丢弃临时文件，
+    否则在图片处理进程池中生成缩略图。会提交事务。
+
+    Returns:
+        (文件记录, 是否复用了已有文件)
+
+    Raises:
+        PoolSaturated: 图片处理进程池排队已满
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    temp_path = os.path.join(TEMP_DIR, uuid.uuid4().hex)
+    try:
+        async with aiofiles.open(temp_path, "wb") as f:
+            while chunk := await file.read(READ_CHUNK_SIZE):
+                hasher.update(chunk)
+                size += len(chunk)
+                await f.write(chunk)
+        digest = hasher.hexdigest()
+
+        blob = await run_in_threadpool(acquire, db, digest)
+        if blob is not None:
+            # 先从会话中移除，提交后属性不会过期，调用方读取时无需再次查询
+            db.expunge(blob)
+            await run_in_threadpool(db.commit)
+            return blob, True
+
+        filename, path, thumbnail_filename, thumbnail_path = blob_paths(digest, ext)
+        if image_pool.saturated:
+            raise PoolSaturated()
+        os.replace(temp_path, path)
+        if not await image_pool.run(generate_thumbnail, path, thumbnail_path):
+            thumbnail_filename = ""
+        blob = await run_in_threadpool(register, db, digest, filename, thumbnail_filename, size)
+        db.expunge(blob)
+        await run_in_threadpool(db.commit)
+        return blob, False
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)